@@ -1,8 +1,19 @@
 # ai_model.py (UPDATED - lighter model)
+import os
+import threading
+import time
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
 import logging
 
+from batching import MicroBatcher
+from menu_scorer import MenuScorer
+from inference_backends import load_model_backend, configure_threads
+from response_cache import ResponseCache
+from semantic_cache import SemanticCache, SentenceEmbedder, calibrate
+from intent_matcher import IntentMatcher, IntentMatch
+from menu import NOODLE_REVERSE_MAP
+from metrics import AI_STAGE_SECONDS, AI_BATCH_SIZE, AI_DECISIONS
+
 logger = logging.getLogger(__name__)
 
 # Use a smaller model for better performance
@@ -10,32 +21,169 @@ logger = logging.getLogger(__name__)
 # Alternative: "distilgpt2" or "gpt2" if DialoGPT fails
 MODEL_NAME = "microsoft/DialoGPT-small"  
 
+# Micro-batching: concurrent prompts are collected for a few milliseconds
+# and generated together in one forward pass
+BATCH_WINDOW_MS = float(os.getenv("AI_BATCH_WINDOW_MS", "10"))
+BATCH_MAX_SIZE = int(os.getenv("AI_BATCH_MAX_SIZE", "8"))
+
+# How the model picks an item:
+#   generate - (default) sample up to 50 tokens and look for a menu name in the
+#              text; /chat/stream sends the tokens as they are generated
+#   score    - (opt-in) log-likelihood of each "I'll prepare <item>" continuation
+#              in one batched pass (deterministic, see menu_scorer.py). Nothing
+#              is generated, so /chat/stream sends only the final decision.
+#              The backend check at startup compares its picks with greedy
+#              generation on SCORE_CHECK_PROMPTS; below AI_SCORE_MIN_AGREEMENT
+#              the server falls back to generate mode (INFERENCE_MODE).
+AI_INFERENCE_MODE = os.getenv("AI_INFERENCE_MODE", "generate")
+# score mode: below this confidence (softmax over the 4 items, 0.25 is chance)
+# the default reply is used instead
+AI_MIN_CONFIDENCE = float(os.getenv("AI_MIN_CONFIDENCE", "0.4"))
+AI_SCORE_MIN_AGREEMENT = float(os.getenv("AI_SCORE_MIN_AGREEMENT", "0.75"))
+
+# Inference backend: default | int8 | compile | onnx (see inference_backends.py)
+AI_BACKEND = os.getenv("AI_BACKEND", "default")
+AI_NUM_THREADS = int(os.getenv("AI_NUM_THREADS", "0"))  # 0 = torch default
 
 # Cache for responses to improve performance
-response_cache = {}
-
-try:
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModelForCausalLM.from_pretrained(
-        MODEL_NAME,
-        torch_dtype=torch.float32,
-        device_map="auto",
-        low_cpu_mem_usage=True
-    )
-    model.eval()
-    AI_LOADED = True
-    logger.info(f"✅ AI model '{MODEL_NAME}' loaded successfully")
+# Bounded LRU with TTL; AI_CACHE_PATH enables persistence across restarts
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("AI_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=float(os.getenv("AI_CACHE_TTL_SECONDS", "3600")),
+    token_sort=os.getenv("AI_CACHE_TOKEN_SORT", "0") == "1",
+    persist_path=os.getenv("AI_CACHE_PATH") or None
+)
+
+# Semantic cache (opt-in, AI_SEMANTIC_CACHE=1): model answers are also indexed
+# by a sentence embedding of the message (AI_SEMANTIC_MODEL), and a new message
+# close enough to a past one reuses its answer (see semantic_cache.py). The
+# threshold is calibrated on semantic_cache.LABELLED_PAIRS when the encoder
+# loads; semantic_cache stays None if the encoder cannot be loaded or the
+# labelled pairs cannot be separated, since a reused answer dispenses.
+AI_SEMANTIC_CACHE = os.getenv("AI_SEMANTIC_CACHE", "0") == "1"
+AI_SEMANTIC_MODEL = os.getenv("AI_SEMANTIC_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+semantic_cache = None
+SEMANTIC_CALIBRATION = None
+
+# Model is loaded in a background thread (see start_model_loading) so the
+# server can answer keyword/cached requests while it loads
+tokenizer = None
+model = None
+menu_scorer = None
+AI_LOADED = False
+
+# not_loaded -> loading -> warming -> ready (or failed)
+MODEL_STATE = "not_loaded"
+MODEL_ERROR = None
+MODEL_LOAD_SECONDS = None
+MODEL_WARMUP_SECONDS = None
+ACTIVE_BACKEND = None
+BACKEND_CHECK = None
+INFERENCE_MODE = AI_INFERENCE_MODE  # mode in effect, after the backend check
+_load_lock = threading.Lock()
+
+def load_model():
+    """Load tokenizer and model, then run one warm-up generation"""
+    global tokenizer, model, menu_scorer, AI_LOADED, MODEL_STATE, MODEL_ERROR
+    global MODEL_LOAD_SECONDS, MODEL_WARMUP_SECONDS, ACTIVE_BACKEND, INFERENCE_MODE
     
-    # Set padding token if not set
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
+    MODEL_STATE = "loading"
+    INFERENCE_MODE = AI_INFERENCE_MODE
+    started = time.perf_counter()
+    try:
+        from transformers import AutoTokenizer
         
-except Exception as e:
-    logger.warning(f"⚠️ Failed to load AI model: {e}")
-    logger.info("Using mock AI responses")
-    AI_LOADED = False
-    tokenizer = None
-    model = None
+        configure_threads(AI_NUM_THREADS)
+        loaded_tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        loaded_model, ACTIVE_BACKEND = load_model_backend(MODEL_NAME, AI_BACKEND)
+        
+        # Set padding token if not set
+        if loaded_tokenizer.pad_token is None:
+            loaded_tokenizer.pad_token = loaded_tokenizer.eos_token
+        # Decoder-only models must be padded on the left for batched generation
+        loaded_tokenizer.padding_side = "left"
+        
+        tokenizer, model = loaded_tokenizer, loaded_model
+        menu_scorer = MenuScorer(tokenizer, model)
+        MODEL_LOAD_SECONDS = round(time.perf_counter() - started, 3)
+        logger.info(f"✅ AI model '{MODEL_NAME}' loaded in {MODEL_LOAD_SECONDS}s (backend={ACTIVE_BACKEND})")
+    except Exception as e:
+        logger.warning(f"⚠️ Failed to load AI model: {e}")
+        logger.info("Using mock AI responses")
+        MODEL_STATE = "failed"
+        MODEL_ERROR = str(e)
+        return False
+    
+    # Warm-up: first generate() pays for lazy allocations, do it before real traffic.
+    # The warm-up batch doubles as a check that this backend still picks menu items.
+    MODEL_STATE = "warming"
+    warm_started = time.perf_counter()
+    try:
+        check_backend_accuracy()
+    except Exception as e:
+        logger.warning(f"⚠️ Model warm-up failed: {e}")
+        if INFERENCE_MODE == "score":
+            INFERENCE_MODE = "generate"  # scoring is unchecked, do not trust it
+    MODEL_WARMUP_SECONDS = round(time.perf_counter() - warm_started, 3)
+    
+    AI_LOADED = True
+    MODEL_STATE = "ready"
+    logger.info(f"✅ AI model warmed up in {MODEL_WARMUP_SECONDS}s")
+    if AI_SEMANTIC_CACHE:
+        load_semantic_cache()
+    return True
+
+def load_semantic_cache():
+    """Load the sentence encoder and enable the semantic cache if its calibrated threshold is valid"""
+    global semantic_cache, SEMANTIC_CALIBRATION
+    try:
+        embedder = SentenceEmbedder(AI_SEMANTIC_MODEL)
+        SEMANTIC_CALIBRATION = calibrate(embedder)
+    except Exception as e:
+        SEMANTIC_CALIBRATION = {"embedder": AI_SEMANTIC_MODEL, "valid": False, "error": str(e)}
+        logger.warning(f"⚠️ Semantic cache disabled, encoder '{AI_SEMANTIC_MODEL}' failed to load: {e}")
+        return False
+    if not SEMANTIC_CALIBRATION["valid"]:
+        logger.warning(f"⚠️ Semantic cache disabled, '{AI_SEMANTIC_MODEL}' does not separate the labelled "
+                       f"pairs: {SEMANTIC_CALIBRATION}")
+        return False
+    semantic_cache = SemanticCache(
+        embedder,
+        max_entries=int(os.getenv("AI_SEMANTIC_MAX_ENTRIES", "2048")),
+        threshold=SEMANTIC_CALIBRATION["threshold"],
+        ttl_seconds=float(os.getenv("AI_CACHE_TTL_SECONDS", "3600")),
+        calibration=SEMANTIC_CALIBRATION
+    )
+    logger.info(f"🧭 Semantic cache enabled: threshold {SEMANTIC_CALIBRATION['threshold']}, "
+                f"recall {SEMANTIC_CALIBRATION['recall']} on {SEMANTIC_CALIBRATION['pairs']} labelled pairs")
+    return True
+
+def start_model_loading():
+    """Start loading the model in a daemon thread (no-op if already started)"""
+    global MODEL_STATE
+    with _load_lock:
+        if MODEL_STATE != "not_loaded":
+            return False
+        MODEL_STATE = "loading"
+    threading.Thread(target=load_model, name="ai-model-loader", daemon=True).start()
+    return True
+
+def get_model_status():
+    """Model loading state for readiness checks"""
+    return {
+        "model": MODEL_NAME,
+        "state": MODEL_STATE,
+        "ready": MODEL_STATE == "ready",
+        "load_seconds": MODEL_LOAD_SECONDS,
+        "warmup_seconds": MODEL_WARMUP_SECONDS,
+        "backend": ACTIVE_BACKEND,
+        "requested_backend": AI_BACKEND,
+        "inference_mode": INFERENCE_MODE,
+        "requested_inference_mode": AI_INFERENCE_MODE,
+        "num_threads": torch.get_num_threads(),
+        "backend_check": BACKEND_CHECK,
+        "error": MODEL_ERROR
+    }
 
 # Pre-defined responses for common requests
 PRE_DEFINED_RESPONSES = {
@@ -59,68 +207,398 @@ PRE_DEFINED_RESPONSES = {
     "default": "I'll prepare Hot Spicy Ramen for you! This is our signature dish and customer favorite."
 }
 
-def get_ai_reply(user_message: str) -> str:
-    """Get AI response for user message"""
+def _generate_batch(prompts, sample=True):
+    """Run one padded generate() call for a batch of prompts (greedy if not `sample`)"""
+    started = time.perf_counter()
+    inputs = tokenizer(
+        prompts,
+        return_tensors="pt",
+        padding=True,
+        truncation=True,
+        max_length=100
+    )
+    tokenized = time.perf_counter()
+    
+    sampling = {"do_sample": True, "temperature": 0.7, "top_p": 0.9} if sample else {"do_sample": False}
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=50,
+            pad_token_id=tokenizer.pad_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            **sampling
+        )
+    
+    generated = time.perf_counter()
+    
+    replies = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+    AI_STAGE_SECONDS.labels("tokenize").observe(tokenized - started)
+    AI_STAGE_SECONDS.labels("generate").observe(generated - tokenized)
+    AI_STAGE_SECONDS.labels("decode").observe(time.perf_counter() - generated)
+    AI_BATCH_SIZE.observe(len(prompts))
+    return replies
+
+generation_batcher = MicroBatcher(
+    _generate_batch,
+    max_batch_size=BATCH_MAX_SIZE,
+    window_ms=BATCH_WINDOW_MS,
+    name="ai-generate-batcher"
+)
+
+def _score_batch(prompts):
+    """Score every menu item for a batch of prompts (one cached-prefix pass)"""
+    started = time.perf_counter()
+    results = menu_scorer.score(prompts)
+    AI_STAGE_SECONDS.labels("score").observe(time.perf_counter() - started)
+    AI_BATCH_SIZE.observe(len(prompts))
+    return results
+
+score_batcher = MicroBatcher(
+    _score_batch,
+    max_batch_size=BATCH_MAX_SIZE,
+    window_ms=BATCH_WINDOW_MS,
+    name="ai-score-batcher"
+)
+
+def get_ai_stats():
+    """AI model and inference statistics"""
+    return {
+        "model": MODEL_NAME,
+        "ai_loaded": AI_LOADED,
+        "model_state": MODEL_STATE,
+        "backend": ACTIVE_BACKEND,
+        "inference_mode": INFERENCE_MODE,
+        "batching": (score_batcher if INFERENCE_MODE == "score" else generation_batcher).stats(),
+        "cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+        "semantic_calibration": SEMANTIC_CALIBRATION
+    }
+
+def save_response_cache():
+    """Persist the response cache if AI_CACHE_PATH is configured"""
+    return response_cache.save()
+
+# All keywords and menu names compiled into one matcher ("default" is the fallback, not a keyword)
+intent_matcher = IntentMatcher(
+    {k: v for k, v in PRE_DEFINED_RESPONSES.items() if k != "default"}
+)
+DEFAULT_INTENT = IntentMatch(
+    PRE_DEFINED_RESPONSES["default"],
+    *intent_matcher.find_noodle(PRE_DEFINED_RESPONSES["default"]),
+    "fallback"
+)
+
+def _cached_intent(reply, noodle_code):
+    return IntentMatch(reply, NOODLE_REVERSE_MAP.get(noodle_code), noodle_code, "cache")
+
+def _semantic_intent(user_message):
+    """Answer of the nearest past model decision, or None below the similarity threshold"""
+    if semantic_cache is None:
+        return None
+    try:
+        hit = semantic_cache.lookup(user_message)
+    except Exception as e:  # the encoder can fail like any forward pass; answer without it
+        logger.warning(f"⚠️ Semantic cache lookup failed: {e}")
+        return None
+    if hit is None:
+        return None
+    (reply, noodle_code), _, _ = hit
+    response_cache.set(user_message, (reply, noodle_code))
+    return IntentMatch(reply, NOODLE_REVERSE_MAP.get(noodle_code), noodle_code, "semantic")
+
+def _remember(user_message, intent):
+    """Cache a model decision under its exact text and its embedding"""
+    response_cache.set(user_message, (intent.reply, intent.noodle_code))
+    if semantic_cache is not None:
+        try:
+            semantic_cache.add(user_message, (intent.reply, intent.noodle_code))
+        except Exception as e:
+            logger.warning(f"⚠️ Semantic cache add failed: {e}")
+
+def _build_prompt(user_message):
+    return f"""User: {user_message}
+Assistant: I'll prepare """
+
+def _score_prompt(user_message):
+    # No trailing space: candidates are scored as " Hot Spicy Ramen", the way BPE splits them
+    return _build_prompt(user_message).rstrip()
+
+def _resolve_scored(scored):
+    """(name, code, confidence, scores) from the scorer -> IntentMatch with a template reply"""
+    noodle_name, noodle_code, confidence, _ = scored
+    if confidence < AI_MIN_CONFIDENCE:
+        return DEFAULT_INTENT
+    return IntentMatch(intent_matcher.menu_reply(noodle_name), noodle_name, noodle_code, "model", confidence)
+
+def _extract_reply(generated):
+    # Extract only the assistant's response
+    if "Assistant:" in generated:
+        return generated.split("Assistant:")[-1].strip()
+    return generated
+
+def _resolve_generated(user_message, generated):
+    """Turn raw generated text into an IntentMatch"""
+    response = _extract_reply(generated)
+    noodle_name, noodle_code = intent_matcher.find_noodle(response)
+    
+    # Ensure it starts with "I'll prepare"
+    if not response.startswith("I'll prepare"):
+        # Find which noodle is mentioned
+        mentioned_name, mentioned_code = intent_matcher.find_noodle(user_message)
+        
+        if mentioned_name:
+            response = f"I'll prepare {mentioned_name} for you! {response}"
+            noodle_name, noodle_code = mentioned_name, mentioned_code
+        else:
+            return DEFAULT_INTENT
+    
+    return IntentMatch(response, noodle_name, noodle_code, "model")
+
+# Prompts the backend check runs through the model (no keywords, so they reach generation)
+BACKEND_CHECK_PROMPTS = [
+    "hello",
+    "what do you have today?",
+    "something warm for a rainy evening",
+    "I had a long day at work",
+]
+
+# Score mode is checked against greedy generation; prompts naming an item give
+# generation a clear answer to agree with (the keyword matcher is bypassed here)
+SCORE_CHECK_PROMPTS = BACKEND_CHECK_PROMPTS + [
+    "One Hot Spicy Ramen please",
+    "Chicken Noodles, thanks",
+    "Can I get the Cheese Noodles?",
+    "Veg Clear Soup for me",
+]
+
+def check_backend_accuracy(prompts=None):
+    """Run one batch through the model and check that its picks can be trusted.
+    
+    generate: `model_resolved` counts raw generations that name a NOODLE_MAP
+    item; `reply_resolved` counts final replies (after the default fallback).
+    
+    score: the scorer's pick for each prompt is compared with the item named
+    by greedy generation (prompts where generation names none are skipped).
+    Valid when they agree on at least AI_SCORE_MIN_AGREEMENT of the compared
+    prompts; otherwise INFERENCE_MODE falls back to generate.
+    """
+    global BACKEND_CHECK, INFERENCE_MODE
+    started = time.perf_counter()
+    if INFERENCE_MODE == "score":
+        prompts = prompts or SCORE_CHECK_PROMPTS
+        scored = _score_batch([_score_prompt(p) for p in prompts])
+        generations = _generate_batch([_build_prompt(p) for p in prompts], sample=False)
+        reference = [intent_matcher.find_noodle(_extract_reply(g))[1] for g in generations]
+        compared = [(s[1], r) for s, r in zip(scored, reference) if r is not None]
+        agreement = sum(1 for pick, r in compared if pick == r) / len(compared) if compared else 0.0
+        BACKEND_CHECK = {
+            "prompts": len(prompts),
+            "mode": "score",
+            "picks": {p: s[0] for p, s in zip(prompts, scored)},
+            "generated": {p: NOODLE_REVERSE_MAP.get(r) for p, r in zip(prompts, reference)},
+            "compared": len(compared),
+            "agreement": round(agreement, 4),
+            "mean_confidence": round(sum(s[2] for s in scored) / len(scored), 4),
+            "below_min_confidence": sum(1 for s in scored if s[2] < AI_MIN_CONFIDENCE),
+            "valid": bool(compared) and agreement >= AI_SCORE_MIN_AGREEMENT,
+            "batch_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+        if not BACKEND_CHECK["valid"]:
+            logger.warning(
+                f"⚠️ Backend check: scoring agreed with generation on {agreement:.0%} of "
+                f"{len(compared)} prompts, using generate mode"
+            )
+            INFERENCE_MODE = "generate"
+        return BACKEND_CHECK
+    prompts = prompts or BACKEND_CHECK_PROMPTS
+    generations = _generate_batch([_build_prompt(p) for p in prompts])
+    model_resolved = sum(
+        1 for g in generations if intent_matcher.find_noodle(_extract_reply(g))[1]
+    )
+    reply_resolved = sum(
+        1 for p, g in zip(prompts, generations) if _resolve_generated(p, g).noodle_code
+    )
+    BACKEND_CHECK = {
+        "prompts": len(prompts),
+        "mode": "generate",
+        "model_resolved": model_resolved,
+        "reply_resolved": reply_resolved,
+        "valid": reply_resolved == len(prompts),
+        "batch_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+    if not BACKEND_CHECK["valid"]:
+        logger.warning(f"⚠️ Backend check: only {reply_resolved}/{len(prompts)} replies resolved to a menu item")
+    return BACKEND_CHECK
+
+def get_ai_decision(user_message: str) -> IntentMatch:
+    """Get AI reply for user message together with the selected noodle"""
+    intent = _decide(user_message)
+    AI_DECISIONS.labels(intent.source).inc()
+    return intent
+
+def _decide(user_message):
+    
+    # Worker processes load their own copy on first use
+    if MODEL_STATE == "not_loaded":
+        start_model_loading()
     
     # Check cache first
-    user_lower = user_message.lower().strip()
-    if user_lower in response_cache:
-        return response_cache[user_lower]
+    cached = response_cache.get(user_message)
+    if cached is not None:
+        return _cached_intent(*cached)
+    
+    # First, try to match with pre-defined responses (single pass over the message)
+    intent = intent_matcher.match(user_message)
+    if intent is not None:
+        response_cache.set(user_message, (intent.reply, intent.noodle_code))
+        return intent
     
-    # First, try to match with pre-defined responses
-    for keyword, response in PRE_DEFINED_RESPONSES.items():
-        if keyword in user_lower:
-            response_cache[user_lower] = response
-            return response
+    # Then a past model decision for a differently worded message
+    intent = _semantic_intent(user_message)
+    if intent is not None:
+        return intent
     
+    return _model_decision(user_message)
+
+def _model_decision(user_message):
+    """Ask the model (batched) once cache, keyword and semantic lookups have missed"""
     # If AI model is loaded, use it
     if AI_LOADED and tokenizer and model:
         try:
-            prompt = f"""User: {user_message}
-Assistant: I'll prepare """
+            if INFERENCE_MODE == "score":
+                # Deterministic, so every answer can be cached
+                intent = _resolve_scored(score_batcher.submit(_score_prompt(user_message)).result())
+                if intent is not DEFAULT_INTENT:
+                    _remember(user_message, intent)
+                return intent
+            
+            # Blocks until this prompt's batch has been generated
+            response = generation_batcher.submit(_build_prompt(user_message)).result()
             
-            inputs = tokenizer(prompt, return_tensors="pt", truncation=True, max_length=100)
+            intent = _resolve_generated(user_message, response)
+            if intent is not DEFAULT_INTENT:
+                # Cache the response
+                _remember(user_message, intent)
+            return intent
             
+        except Exception as e:
+            logger.error(f"AI model error: {e}")
+            # Fall back to pre-defined response
+            return DEFAULT_INTENT
+    
+    # Fallback if AI model is not available
+    return DEFAULT_INTENT
+
+class _StopWhenSet:
+    """generate() stopping criterion driven by a threading.Event"""
+    
+    def __init__(self, event):
+        self.event = event
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool)
+
+def stream_ai_decision(user_message: str, cancelled=None):
+    """Yield ("token", text) chunks as the model generates, then ("decision", IntentMatch).
+    
+    Cached and keyword answers yield only the decision. Generation stops as
+    soon as a NOODLE_MAP item appears in the output (or `cancelled` is set).
+    """
+    if MODEL_STATE == "not_loaded":
+        start_model_loading()
+    
+    cached = response_cache.get(user_message)
+    if cached is not None:
+        intent = _cached_intent(*cached)
+        AI_DECISIONS.labels(intent.source).inc()
+        yield "decision", intent
+        return
+    
+    intent = intent_matcher.match(user_message)
+    if intent is not None:
+        response_cache.set(user_message, (intent.reply, intent.noodle_code))
+        AI_DECISIONS.labels(intent.source).inc()
+        yield "decision", intent
+        return
+    
+    intent = _semantic_intent(user_message)
+    if intent is not None:
+        AI_DECISIONS.labels(intent.source).inc()
+        yield "decision", intent
+        return
+    
+    if not (AI_LOADED and tokenizer and model):
+        AI_DECISIONS.labels(DEFAULT_INTENT.source).inc()
+        yield "decision", DEFAULT_INTENT
+        return
+    
+    if INFERENCE_MODE == "score":
+        # One forward pass, nothing to stream token by token
+        intent = _model_decision(user_message)
+        AI_DECISIONS.labels(intent.source).inc()
+        yield "decision", intent
+        return
+    
+    from transformers import TextIteratorStreamer, StoppingCriteriaList
+    
+    stop = threading.Event()
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    started = time.perf_counter()
+    inputs = tokenizer(_build_prompt(user_message), return_tensors="pt", truncation=True, max_length=100)
+    AI_STAGE_SECONDS.labels("tokenize").observe(time.perf_counter() - started)
+    
+    def run_generate():
+        # Decoding happens incrementally in the streamer, so it is included here
+        generate_started = time.perf_counter()
+        try:
             with torch.no_grad():
-                outputs = model.generate(
+                model.generate(
                     **inputs,
                     max_new_tokens=50,
                     temperature=0.7,
                     do_sample=True,
                     top_p=0.9,
                     pad_token_id=tokenizer.pad_token_id,
-                    eos_token_id=tokenizer.eos_token_id
+                    eos_token_id=tokenizer.eos_token_id,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([_StopWhenSet(stop)])
                 )
-            
-            response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-            
-            # Extract only the assistant's response
-            if "Assistant:" in response:
-                response = response.split("Assistant:")[-1].strip()
-            
-            # Ensure it starts with "I'll prepare"
-            if not response.startswith("I'll prepare"):
-                # Find which noodle is mentioned
-                noodles = ["Hot Spicy Ramen", "Chicken Noodles", "Cheese Noodles", "Veg Clear Soup"]
-                mentioned_noodle = None
-                for noodle in noodles:
-                    if noodle.lower() in user_lower:
-                        mentioned_noodle = noodle
-                        break
-                
-                if mentioned_noodle:
-                    response = f"I'll prepare {mentioned_noodle} for you! {response}"
-                else:
-                    response = PRE_DEFINED_RESPONSES["default"]
-            
-            # Cache the response
-            response_cache[user_lower] = response
-            return response
-            
         except Exception as e:
-            logger.error(f"AI model error: {e}")
-            # Fall back to pre-defined response
-            return PRE_DEFINED_RESPONSES["default"]
+            logger.error(f"AI model streaming error: {e}")
+            streamer.end()
+        finally:
+            AI_STAGE_SECONDS.labels("stream_generate").observe(time.perf_counter() - generate_started)
     
-    # Fallback if AI model is not available
-    return PRE_DEFINED_RESPONSES["default"]
\ No newline at end of file
+    generator_thread = threading.Thread(target=run_generate, name="ai-stream", daemon=True)
+    generator_thread.start()
+    
+    # The prompt already ends with "I'll prepare ", so the reply starts there
+    generated = "I'll prepare "
+    found_name = None
+    try:
+        for chunk in streamer:
+            if not chunk:
+                continue
+            generated += chunk
+            yield "token", chunk
+            if cancelled is not None and cancelled.is_set():
+                break
+            found_name = intent_matcher.find_noodle(generated)[0]
+            if found_name:
+                break
+    finally:
+        # Early stop: menu item found, client gone, or generator closed
+        stop.set()
+    
+    if found_name and generated.rstrip().lower().endswith(found_name.lower()):
+        generated = generated.rstrip() + " for you!"
+    
+    intent = _resolve_generated(user_message, generated.strip())
+    if intent is not DEFAULT_INTENT:
+        _remember(user_message, intent)
+    AI_DECISIONS.labels(intent.source).inc()
+    yield "decision", intent
+
+def get_ai_reply(user_message: str) -> str:
+    """Get AI response for user message"""
+    return get_ai_decision(user_message).reply
@@ -0,0 +1,121 @@
+# batching.py - Dynamic micro-batching for model generation
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Collect concurrent requests for a short window and run them as one batch.
+
+    `run_batch` receives a list of items and must return a list of results
+    in the same order. Callers get a Future back from `submit`.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, window_ms=10.0, name="batcher"):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.name = name
+
+        self._pending = deque()  # (item, future, enqueue_time)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+        # Stats
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._batch_sizes = {}  # size -> count
+        self._max_batch_seen = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def submit(self, item):
+        """Queue an item for the next batch and return a Future for its result"""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            self._pending.append((item, future, time.perf_counter()))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def close(self):
+        """Stop the worker thread once pending items are drained"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return None
+
+            # Hold the batch open until the window expires or it is full
+            deadline = self._pending[0][2] + self.window
+            while len(self._pending) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            size = min(len(self._pending), self.max_batch_size)
+            return [self._pending.popleft() for _ in range(size)]
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            started = time.perf_counter()
+            waits = [started - enqueued for _, _, enqueued in batch]
+            self._record(len(batch), waits)
+
+            try:
+                results = self.run_batch([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: expected {len(batch)} results, got {len(results)}")
+            except Exception as e:
+                logger.error(f"{self.name} batch of {len(batch)} failed: {e}")
+                self._errors += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def _record(self, size, waits):
+        self._batches += 1
+        self._items += size
+        self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+        self._max_batch_seen = max(self._max_batch_seen, size)
+        self._total_wait += sum(waits)
+        self._max_wait = max(self._max_wait, max(waits))
+
+    def stats(self):
+        """Batch size and queue wait statistics"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "window_ms": round(self.window * 1000, 3),
+            "batches": self._batches,
+            "items": self._items,
+            "errors": self._errors,
+            "pending": len(self._pending),
+            "avg_batch_size": round(self._items / self._batches, 3) if self._batches else 0.0,
+            "largest_batch": self._max_batch_seen,
+            "batch_size_counts": dict(sorted(self._batch_sizes.items())),
+            "avg_queue_wait_ms": round(self._total_wait / self._items * 1000, 3) if self._items else 0.0,
+            "max_queue_wait_ms": round(self._max_wait * 1000, 3),
+        }
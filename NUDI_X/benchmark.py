@@ -0,0 +1,466 @@
+# benchmark.py - Latency/throughput benchmarks for the chat, status and MQTT ingest hot paths
+#
+#   python benchmark.py --output bench.json
+#   python benchmark.py --only ingest,http --baseline bench_baseline.json
+#   python benchmark.py --save-baseline bench_baseline.json
+#
+# Sections:
+#   ai      get_ai_reply on cache hits, keyword hits, semantic cache hits and (with --model)
+#           model generation
+#   ingest  main.on_message (network thread), handle_message (ingest worker) and the
+#           sustained rate through the ingest queue, with simulated ESP32 payloads
+#   telemetry  wearable readings through TelemetryIngest (single and batched messages)
+#           and one classification pass over every device window
+#   http    /chat, /status and /logs over real HTTP against an in-process server,
+#           with mini_broker and one simulated device standing in for MQTT
+#
+# Every benchmark reports p50/p95/p99 latency and throughput; peak RSS is
+# recorded per section. With --baseline, p95 and throughput are compared
+# and regressions beyond --tolerance are listed (exit code 1).
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import types
+import logging
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SECTIONS = ("ai", "ingest", "telemetry", "http")
+
+KEYWORD_MESSAGES = [
+    "I want something spicy", "chicken please", "cheese noodles", "something light",
+    "I'm cold", "vegetarian option", "creamy please", "hot ramen",
+]
+# No keywords, so they reach the semantic cache
+SEMANTIC_MESSAGES = [
+    "what would you suggest for dinner", "something warm for a rainy evening",
+    "I had a long day at work", "surprise me",
+]
+
+# Payload mix modelled on esp32_main.ino traffic during a busy period
+INGEST_PAYLOADS = [
+    ("noodle_vending/status", "dispensing_noodle_2"),
+    ("noodle_vending/status", "ready"),
+    ("noodle_vending/heartbeat", "ready"),
+    ("noodle_vending/log", "Dispensing noodle 2"),
+    ("noodle_vending/log", "📏 Distance: 17.4 cm"),
+    ("noodle_vending/log", "📏 Distance: 16.9 cm"),
+    ("noodle_vending/log", "📏 Distance: 12.1 cm"),
+    ("noodle_vending/log", "Drop detected for noodle 2"),
+    ("noodle_vending/log", "START_HEATING sent to Arduino - L298N & Relay activating for noodle 2"),
+    ("noodle_vending/log", "Noodle 2 ready!"),
+    ("noodle_vending/drop_detected", "success_noodle_2"),
+]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """latencies in seconds -> report dict in ms"""
+    ms = sorted(x * 1000 for x in latencies)
+    return {
+        "n": len(ms),
+        "errors": errors,
+        "mean_ms": round(sum(ms) / len(ms), 4) if ms else None,
+        "p50_ms": round(percentile(ms, 0.50), 4) if ms else None,
+        "p95_ms": round(percentile(ms, 0.95), 4) if ms else None,
+        "p99_ms": round(percentile(ms, 0.99), 4) if ms else None,
+        "max_ms": round(ms[-1], 4) if ms else None,
+        "throughput_per_s": round(len(ms) / elapsed, 2) if elapsed else None,
+    }
+
+
+def run_serial(fn, n, warmup=10):
+    for i in range(min(warmup, n)):
+        fn(i)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(n):
+        t = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run_concurrent(fn, n, concurrency):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        t = time.perf_counter()
+        try:
+            fn(i)
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        elapsed = time.perf_counter() - t
+        with lock:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n)))
+    report = summarize(latencies, time.perf_counter() - started, errors)
+    report["concurrency"] = concurrency
+    return report
+
+
+# --- sections ----------------------------------------------------------------
+
+def bench_ai(args):
+    try:
+        import ai_model
+    except ImportError as e:
+        return {"skipped": f"ai_model unavailable: {e}"}
+
+    results = {}
+    ai_model.response_cache.clear()
+    for message in KEYWORD_MESSAGES:
+        ai_model.get_ai_reply(message)  # populate the cache
+    results["cache_hit"] = run_serial(
+        lambda i: ai_model.get_ai_reply(KEYWORD_MESSAGES[i % len(KEYWORD_MESSAGES)]), args.n * 10
+    )
+    # Unique text defeats the cache, so every call runs the keyword matcher
+    results["keyword_hit"] = run_serial(
+        lambda i: ai_model.get_ai_reply(f"{KEYWORD_MESSAGES[i % len(KEYWORD_MESSAGES)]} #{i}-{random.random()}"),
+        args.n * 10
+    )
+    if ai_model.semantic_cache is None and ai_model.AI_SEMANTIC_CACHE:
+        ai_model.load_semantic_cache()  # on servers this follows the model load
+    if ai_model.semantic_cache is None:
+        results["semantic_hit"] = {"skipped": f"semantic cache disabled ({ai_model.SEMANTIC_CALIBRATION})"}
+    else:
+        ai_model.semantic_cache.clear()
+        for message in SEMANTIC_MESSAGES:
+            ai_model.semantic_cache.add(message, (ai_model.DEFAULT_INTENT.reply, ai_model.DEFAULT_INTENT.noodle_code))
+        # Reworded and numbered, so the exact cache misses and the nearest neighbour answers
+        results["semantic_hit"] = run_serial(
+            lambda i: ai_model.get_ai_reply(f"{SEMANTIC_MESSAGES[i % len(SEMANTIC_MESSAGES)]} please {i}"),
+            args.n * 10
+        )
+        results["semantic_hit"]["hit_rate"] = ai_model.semantic_cache.stats()["hit_rate"]
+
+    if args.model:
+        # Every model call below must reach the model, not a semantic neighbour
+        semantic_cache, ai_model.semantic_cache = ai_model.semantic_cache, None
+        ai_model.AI_SEMANTIC_CACHE = False  # and the loader must not enable it again
+        ai_model.start_model_loading()
+        deadline = time.time() + args.model_timeout
+        while not ai_model.get_model_status()["ready"] and time.time() < deadline:
+            if ai_model.get_model_status()["state"] == "failed":
+                break
+            time.sleep(0.5)
+        status = ai_model.get_model_status()
+        if status["ready"]:
+            results["model_generation"] = run_serial(
+                lambda i: ai_model.get_ai_reply(f"what would you suggest for dinner tonight {i}?"),
+                args.model_n, warmup=2
+            )
+            results["model_generation_concurrent"] = run_concurrent(
+                lambda i: ai_model.get_ai_reply(f"what is good on a rainy evening {i}?"),
+                args.model_n * 2, ai_model.BATCH_MAX_SIZE
+            )
+            results["model"] = {"backend": status.get("backend"), "load_seconds": status.get("load_seconds")}
+        else:
+            results["model_generation"] = {"skipped": f"model not ready ({status['state']})"}
+    else:
+        results["model_generation"] = {"skipped": "pass --model to load the model"}
+    if args.model:
+        ai_model.semantic_cache = semantic_cache
+    return results
+
+
+def bench_ingest(args):
+    import main
+
+    messages = [
+        types.SimpleNamespace(topic=topic, payload=payload.encode(), retain=False)
+        for topic, payload in INGEST_PAYLOADS
+    ]
+    main.ingest.start()
+    results = {}
+
+    # Network thread cost only: classify + enqueue (the worker drains concurrently)
+    results["on_message"] = run_serial(
+        lambda i: main.on_message(None, None, messages[i % len(messages)]), args.ingest_n
+    )
+    main.ingest.wait_idle(30)
+    results["on_message"]["dropped"] = main.ingest.dropped
+
+    # Worker cost per message, called directly
+    routes = [(main.topics.classify(m.topic), m.payload) for m in messages]
+    results["handle_message"] = run_serial(
+        lambda i: main.handle_message(*routes[i % len(routes)], time.time()), args.ingest_n
+    )
+
+    # Sustained end to end: lossless flood, timed until the worker has drained it
+    processed = main.ingest.processed
+    cpu = time.process_time()
+    started = time.perf_counter()
+    for i in range(args.ingest_n):
+        route, payload = routes[i % len(routes)]
+        main.ingest.put(route, payload, time.time(), block=True)
+    main.ingest.wait_idle(60)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu
+    handled = main.ingest.processed - processed
+    results["sustained"] = {
+        "n": handled,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_per_s": round(handled / elapsed, 2) if elapsed else None,
+        "messages_per_cpu_s": round(handled / cpu, 2) if cpu else None,
+        "max_queue_depth": main.ingest.max_depth,
+    }
+    results["messages_per_s"] = results["sustained"]["throughput_per_s"]
+    return results
+
+
+def bench_telemetry(args):
+    try:
+        from cooling_model import train
+        from wearable_telemetry import TelemetryIngest
+    except ImportError as e:
+        return {"skipped": f"missing dependency: {e}"}
+
+    devices = [f"wear-{i:04d}" for i in range(1000)]
+    telemetry = TelemetryIngest(train(), lambda device_id, state: True, window=60)
+    single = [f"{36 + i % 5},{37 + (i % 3) * 0.5:.1f},{90 + i % 40}".encode() for i in range(64)]
+    batch = [b"\n".join(f"{k},{36 + k % 5},{37.5:.1f},{100 + k % 30}".encode() for k in range(10))]
+
+    results = {}
+    results["single_reading"] = run_serial(
+        lambda i: telemetry.submit(devices[i % len(devices)], single[i % len(single)]), args.ingest_n
+    )
+    results["batch_of_10"] = run_serial(
+        lambda i: telemetry.submit(devices[i % len(devices)], batch[0]), args.ingest_n // 10
+    )
+    results["batch_of_10"]["readings_per_s"] = round(results["batch_of_10"]["throughput_per_s"] * 10, 2)
+
+    def evaluate(i):
+        for device_id in devices:  # one new reading each, so every window is due
+            telemetry.submit(device_id, single[i % len(single)])
+        telemetry.evaluate()
+    results["evaluate_1000_devices"] = run_serial(evaluate, 20, warmup=2)
+    results["readings_per_s"] = results["single_reading"]["throughput_per_s"]
+    return results
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _post(url, body):
+    request = urllib.request.Request(
+        url, data=json.dumps(body).encode(), method="POST",
+        headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.loads(response.read())
+
+
+def _get(url):
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return json.loads(response.read())
+
+
+def bench_http(args):
+    import uvicorn
+    from device_simulator import SimulatedDevice, start_embedded_broker
+    import main
+
+    start_embedded_broker("127.0.0.1", int(os.environ["MQTT_PORT"]))
+    device = SimulatedDevice(
+        main.DEFAULT_DEVICE_ID, "127.0.0.1", int(os.environ["MQTT_PORT"]),
+        drop_time=(0.01, 0.02), heating_time=(0.01, 0.02), failure_rate=0.0
+    ).start()
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while not server.started and time.time() < deadline:
+        time.sleep(0.1)
+    if not server.started:
+        return {"skipped": "server did not start"}
+
+    try:
+        for i in range(500):
+            main.add_log("BENCH", f"preloaded log line {i}")
+
+        results = {}
+        results["chat"] = run_concurrent(
+            lambda i: _post(f"{base}/chat", {
+                "user_message": f"{KEYWORD_MESSAGES[i % len(KEYWORD_MESSAGES)]} {i}",
+                "idempotency_key": f"bench-{time.time()}-{i}"
+            }),
+            args.n, args.concurrency
+        )
+        results["status_polling"] = run_concurrent(lambda i: _get(f"{base}/status"), args.n * 2, args.concurrency)
+        results["logs_polling"] = run_concurrent(lambda i: _get(f"{base}/logs"), args.n * 2, args.concurrency)
+        cursor = main.system_logs.last_seq
+        results["logs_incremental"] = run_concurrent(
+            lambda i: _get(f"{base}/logs?since={cursor}"), args.n * 2, args.concurrency
+        )
+        return results
+    finally:
+        server.should_exit = True
+        thread.join(10)
+        device.stop()
+
+
+# --- baseline comparison -------------------------------------------------------
+
+def _flatten(report):
+    """(section/name) -> metrics for every benchmark that ran"""
+    flat = {}
+    for section, benches in report["results"].items():
+        for name, metrics in benches.items():
+            if isinstance(metrics, dict) and "throughput_per_s" in metrics:
+                flat[f"{section}/{name}"] = metrics
+    return flat
+
+
+def compare(report, baseline, tolerance):
+    """Rows of (benchmark, metric, baseline, current, change %, regressed)"""
+    rows = []
+    current, previous = _flatten(report), _flatten(baseline)
+    for key in sorted(current.keys() & previous.keys()):
+        for metric, higher_is_worse in (("p95_ms", True), ("throughput_per_s", False)):
+            old, new = previous[key].get(metric), current[key].get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change > tolerance if higher_is_worse else change < -tolerance
+            rows.append((key, metric, old, new, round(change * 100, 1), regressed))
+    return rows
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chat, status and MQTT ingest hot paths")
+    parser.add_argument("--only", default=",".join(SECTIONS), help=f"comma-separated sections: {', '.join(SECTIONS)}")
+    parser.add_argument("--n", type=int, default=500, help="requests per HTTP benchmark (AI uses 10x)")
+    parser.add_argument("--ingest-n", type=int, default=20000, help="messages for the ingest benchmark")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--model", action="store_true", help="load the model and benchmark generation")
+    parser.add_argument("--model-n", type=int, default=10)
+    parser.add_argument("--model-timeout", type=float, default=300)
+    parser.add_argument("--log-level", default="WARNING", help="server log level while benchmarking")
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("--baseline", help="compare against this earlier --output file")
+    parser.add_argument("--save-baseline", help="also write the report here")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative change before flagging")
+    args = parser.parse_args()
+
+    sections = [s for s in args.only.split(",") if s]
+    # The server modules read their configuration at import time
+    os.environ.setdefault("MQTT_BROKER", "127.0.0.1")
+    os.environ.setdefault("MQTT_PORT", str(_free_port()))
+    # Nothing may be written into the tree: no journal, no history, no saved cooling model
+    os.environ["ORDER_JOURNAL_PATH"] = ""
+    os.environ["HISTORY_DB_PATH"] = ""
+    os.environ["COOLING_MODEL_PATH"] = ""
+    os.environ.setdefault("AI_SEMANTIC_CACHE", "1")  # opt-in on servers, benchmarked here
+    logging.basicConfig(level=args.log_level)
+    logging.getLogger().setLevel(args.log_level)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "log_level": args.log_level,
+            "args": vars(args),
+        },
+        "results": {},
+        "peak_rss_mb": {},
+    }
+    runners = {"ai": bench_ai, "ingest": bench_ingest, "telemetry": bench_telemetry, "http": bench_http}
+    for section in sections:
+        print(f"== {section}", file=sys.stderr)
+        try:
+            report["results"][section] = runners[section](args)
+        except ImportError as e:
+            report["results"][section] = {"skipped": f"missing dependency: {e}"}
+        logging.getLogger().setLevel(args.log_level)  # importing main resets it
+        report["peak_rss_mb"][section] = peak_rss_mb()
+
+    for section, benches in report["results"].items():
+        for name, metrics in benches.items():
+            if isinstance(metrics, dict) and "p95_ms" in metrics:
+                print(f"{section + '/' + name:<32} p50 {metrics['p50_ms']:>9} ms  p95 {metrics['p95_ms']:>9} ms  "
+                      f"p99 {metrics['p99_ms']:>9} ms  {metrics['throughput_per_s']:>10}/s")
+            elif isinstance(metrics, dict) and "throughput_per_s" in metrics:
+                print(f"{section + '/' + name:<32} {metrics['n']} in {metrics['elapsed_s']} s"
+                      f"{'':>29}{metrics['throughput_per_s']:>10}/s")
+            elif isinstance(metrics, dict) and "skipped" in metrics:
+                print(f"{section + '/' + name:<32} skipped: {metrics['skipped']}")
+            elif name == "skipped":
+                print(f"{section:<32} skipped: {metrics}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.tolerance)
+        report["comparison"] = {
+            "baseline": args.baseline,
+            "baseline_commit": baseline.get("meta", {}).get("commit"),
+            "tolerance": args.tolerance,
+            "rows": [dict(zip(("benchmark", "metric", "baseline", "current", "change_pct", "regressed"), r)) for r in rows],
+        }
+        regressions = [r for r in rows if r[5]]
+        print(f"\nvs {args.baseline}:")
+        for key, metric, old, new, change, regressed in rows:
+            print(f"{'REGRESSED' if regressed else 'ok':<10}{key:<32}{metric:<18}{old:>10} -> {new:<10} ({change:+}%)")
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    print(f"\nwrote {args.output}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# broadcaster.py - Fan out events from any thread to async WebSocket subscribers
+import asyncio
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sent to a subscriber whose queue overflowed; its connection should be closed
+DROPPED = {"type": "dropped", "reason": "client too slow"}
+
+
+class Broadcaster:
+    """Thread-safe publish, per-subscriber bounded asyncio queues.
+
+    `publish` may be called from the MQTT network thread; delivery is
+    handed to the event loop with call_soon_threadsafe. A subscriber whose
+    queue is full is dropped instead of slowing everyone else down.
+    """
+
+    def __init__(self, queue_size=256):
+        self.queue_size = max(1, int(queue_size))
+        self._loop = None
+        self._loop_thread_id = None
+        self._subscribers = set()
+        self._published = 0
+        self._dropped_clients = 0
+
+    def bind_loop(self, loop):
+        """Attach to the running event loop (call once at startup)"""
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+
+    def subscribe(self):
+        """Register a subscriber; must be called on the event loop"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, message):
+        """Send message (a JSON-serialisable dict) to every subscriber"""
+        if self._loop is None or not self._subscribers:
+            return
+        if threading.get_ident() == self._loop_thread_id:
+            self._fanout(message)
+        else:
+            try:
+                self._loop.call_soon_threadsafe(self._fanout, message)
+            except RuntimeError:
+                pass  # loop closed during shutdown
+
+    def _fanout(self, message):
+        self._published += 1
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Slowest client loses its backlog and is told to reconnect
+                self._subscribers.discard(queue)
+                self._dropped_clients += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(DROPPED)
+                logger.warning("⚠️ Dropped slow WebSocket subscriber")
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscribers),
+            "queue_size": self.queue_size,
+            "published": self._published,
+            "dropped_clients": self._dropped_clients,
+        }
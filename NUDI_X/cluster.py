@@ -0,0 +1,468 @@
+# cluster.py - Run the server as several worker processes with one controller
+#
+#   CLUSTER_MODE=1 uvicorn main:app --workers 4
+#
+# Every worker tries to take an exclusive file lock at startup. The worker
+# that holds it is the leader: the only one with the MQTT connections, the
+# AI model, the order queue and the timer tasks, so the machines see one
+# controller. The other workers are followers:
+#
+#   - State the leader changes (device status, MQTT link, liveness,
+#     locations, system and serial log lines) is published as events to a
+#     shared store. Followers tail the store and apply each event to their
+#     own copies, so /status, /logs, /devices and /ws are answered locally.
+#   - Every other request is forwarded over a unix socket to the leader,
+#     which runs it through its own app and streams the response back
+#     (server-sent events included).
+#
+# The lock is released by the OS when the leader exits, and a follower
+# retrying it becomes the new leader with state already replicated.
+#
+# Shared stores: SQLiteState (WAL file shared by the processes) and
+# MemoryState (same interface inside one process, for tests).
+import asyncio
+import json
+import os
+import sqlite3
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: no multi-worker support, every process leads
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+# --- leader election -----------------------------------------------------------
+
+class LeaderLock:
+    """Exclusive non-blocking flock on `path`; held until release() or process exit"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def try_acquire(self):
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            self._fd = -1
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        if self._fd >= 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
+
+
+# --- shared state ----------------------------------------------------------------
+
+class MemoryState:
+    """In-process event log with the SQLiteState interface.
+
+    `publish(event, key)` appends an event; keyed events also replace the
+    latest value for that key, so a follower that starts late can load
+    current state without replaying the whole log.
+    """
+
+    def __init__(self, capacity=50000):
+        self.capacity = capacity
+        self._events = deque(maxlen=capacity)  # (seq, key, event)
+        self._latest = {}  # key -> (seq, event)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def publish(self, event, key=None):
+        with self._lock:
+            self._seq += 1
+            self._events.append((self._seq, key, event))
+            if key is not None:
+                self._latest[key] = (self._seq, event)
+            self.published += 1
+
+    def flush(self):
+        return 0
+
+    def since(self, seq, limit=1000):
+        """(seq, event) pairs after seq, oldest first"""
+        with self._lock:
+            return [(s, e) for s, _, e in self._events if s > seq][:limit]
+
+    def snapshot(self, tail=20000):
+        """(last_seq, latest keyed events, newest `tail` unkeyed events) read together"""
+        with self._lock:
+            unkeyed = [(s, e) for s, k, e in self._events if k is None][-tail:]
+            latest = [e for _, e in sorted(self._latest.values(), key=lambda item: item[0])]
+            return self._seq, latest, unkeyed
+
+    async def run(self):
+        """Nothing to flush; kept so leaders treat both stores alike"""
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {"store": "memory", "last_seq": self._seq, "events": len(self._events),
+                "keys": len(self._latest), "published": self.published, "pending": 0}
+
+
+class SQLiteState:
+    """Event log in a WAL-mode SQLite file that every worker opens.
+
+    Only the leader writes. publish() buffers in memory and a writer
+    thread commits the buffer every `flush_interval` seconds in one
+    transaction, so MQTT callbacks never wait on the disk. The log is
+    trimmed to the newest `capacity` events.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, data TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS latest (key TEXT PRIMARY KEY, seq INTEGER NOT NULL, data TEXT NOT NULL);
+    """
+
+    def __init__(self, path, capacity=50000, flush_interval=0.02):
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cluster-state")
+        self._write_conn = None
+        self._read_conn = None
+        self._read_lock = threading.Lock()
+        self._closed = False
+        self.published = 0
+        self.written = 0
+        self.last_seq = 0
+        self._writer.submit(self._open).result()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+        self._write_conn = conn
+
+    def _reader(self):
+        if self._read_conn is None:
+            self._read_conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        return self._read_conn
+
+    def publish(self, event, key=None):
+        with self._lock:
+            self._pending.append((key, json.dumps(event)))
+            self.published += 1
+
+    def flush(self):
+        """Commit everything buffered; runs on the writer thread. Returns events written"""
+        with self._lock:
+            batch, self._pending = list(self._pending), deque()
+        if not batch:
+            return 0
+        conn = self._write_conn
+        try:
+            with conn:
+                for key, data in batch:
+                    seq = conn.execute("INSERT INTO events (key, data) VALUES (?, ?)", (key, data)).lastrowid
+                    if key is not None:
+                        conn.execute("INSERT OR REPLACE INTO latest (key, seq, data) VALUES (?, ?, ?)",
+                                     (key, seq, data))
+                if seq // 1000 != (seq - len(batch)) // 1000:  # trim about once per 1000 events
+                    conn.execute("DELETE FROM events WHERE seq <= ?", (seq - self.capacity,))
+        except sqlite3.Error as e:
+            logger.error(f"Cluster state write failed, {len(batch)} events lost: {e}")
+            return 0
+        self.last_seq = seq
+        self.written += len(batch)
+        return len(batch)
+
+    def since(self, seq, limit=1000):
+        with self._read_lock:
+            rows = self._reader().execute(
+                "SELECT seq, data FROM events WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)
+            ).fetchall()
+        return [(s, json.loads(data)) for s, data in rows]
+
+    def snapshot(self, tail=20000):
+        with self._read_lock:
+            conn = self._reader()
+            conn.execute("BEGIN")  # one read transaction: the three reads agree
+            try:
+                last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+                latest = conn.execute("SELECT data FROM latest ORDER BY seq").fetchall()
+                unkeyed = conn.execute(
+                    "SELECT seq, data FROM events WHERE key IS NULL ORDER BY seq DESC LIMIT ?", (tail,)
+                ).fetchall()
+            finally:
+                conn.execute("COMMIT")
+        return (last_seq, [json.loads(data) for (data,) in latest],
+                [(s, json.loads(data)) for s, data in reversed(unkeyed)])
+
+    async def run(self):
+        """Leader task: commit buffered events every `flush_interval`"""
+        loop = asyncio.get_running_loop()
+        while not self._closed:
+            await asyncio.sleep(self.flush_interval)
+            await loop.run_in_executor(self._writer, self.flush)
+
+    def close(self):
+        self._closed = True
+        self._writer.submit(self.flush).result()
+        self._writer.submit(self._write_conn.close).result()
+        self._writer.shutdown()
+        if self._read_conn is not None:
+            self._read_conn.close()
+
+    def stats(self):
+        return {"store": "sqlite", "path": self.path, "last_seq": self.last_seq,
+                "published": self.published, "written": self.written, "pending": len(self._pending)}
+
+
+class Follower:
+    """Applies the leader's events to local state: snapshot once, then tail the log"""
+
+    def __init__(self, state, apply, poll_interval=0.05, batch=1000):
+        self.state = state
+        self.apply = apply  # apply(event), called on the event loop
+        self.poll_interval = poll_interval
+        self.batch = batch
+        self.seq = 0
+        self.applied = 0
+        self.errors = 0
+        self._stopped = False
+
+    def _apply_all(self, events):
+        for event in events:
+            try:
+                self.apply(event)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Could not apply replicated {event.get('type')} event: {e}")
+            self.applied += 1
+
+    def sync(self):
+        """Load current state (latest keyed events, then recent log lines)"""
+        self.seq, latest, unkeyed = self.state.snapshot()
+        self._apply_all(latest)
+        self._apply_all(e for _, e in unkeyed)
+        logger.info(f"🔁 Replica synced at seq {self.seq} ({len(latest)} keys, {len(unkeyed)} log lines)")
+
+    def poll(self):
+        """Apply everything published since the last poll; returns the number applied"""
+        total = 0
+        while True:
+            rows = self.state.since(self.seq, self.batch)
+            if not rows:
+                return total
+            self.seq = rows[-1][0]
+            self._apply_all(e for _, e in rows)
+            total += len(rows)
+
+    async def run(self):
+        """Follower task: poll until stop() (promotion to leader)"""
+        loop = asyncio.get_running_loop()
+        while not self._stopped:
+            try:
+                rows = await loop.run_in_executor(None, self.state.since, self.seq, self.batch)
+                if rows:
+                    self.seq = rows[-1][0]
+                    self._apply_all(e for _, e in rows)
+                    continue
+            except Exception as e:
+                logger.error(f"Replica poll failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def stop(self):
+        self._stopped = True
+
+    def stats(self):
+        return {"seq": self.seq, "applied": self.applied, "errors": self.errors}
+
+
+# --- forwarding to the leader --------------------------------------------------------
+#
+# One unix-socket connection per request. Frames are a kind byte, a 4-byte
+# big-endian length and the payload:
+#   H  JSON head   request: method, path, query_string, headers, client
+#                  response: status, headers
+#   B  body bytes  (request: one frame; response: one per ASGI body message)
+#   E  end of response
+
+_FRAME = struct.Struct(">cI")
+HEAD, BODY, END = b"H", b"B", b"E"
+# Not meaningful across the hop; the follower's server sets its own
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length", "upgrade"}
+
+
+def _frame(kind, payload=b""):
+    return _FRAME.pack(kind, len(payload)) + payload
+
+
+async def _read_frame(reader):
+    kind, length = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+    return kind, await reader.readexactly(length)
+
+
+class LeaderServer:
+    """Leader side: run forwarded requests through the ASGI app"""
+
+    def __init__(self, app, path):
+        self.app = app
+        self.path = path
+        self._server = None
+        self.requests = 0
+        self.errors = 0
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left by a leader that died; we hold the lock now
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        logger.info(f"👑 Accepting forwarded requests on {self.path}")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _handle(self, reader, writer):
+        self.requests += 1
+        disconnected = None
+        try:
+            _, head = await _read_frame(reader)
+            _, body = await _read_frame(reader)
+            head = json.loads(head)
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": head["method"],
+                "scheme": "http",
+                "path": head["path"],
+                "raw_path": head["path"].encode(),
+                "root_path": "",
+                "query_string": head["query_string"].encode(),
+                "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in head["headers"]],
+                "client": tuple(head["client"]) if head.get("client") else None,
+                "server": ("leader", 0),
+            }
+            body_sent = False
+
+            async def receive():
+                nonlocal body_sent, disconnected
+                if not body_sent:
+                    body_sent = True
+                    return {"type": "http.request", "body": body, "more_body": False}
+                if disconnected is None:
+                    # One read shared by every waiter: middleware calls receive() concurrently
+                    disconnected = asyncio.ensure_future(reader.read())  # EOF: the client went away
+                await asyncio.shield(disconnected)
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    writer.write(_frame(HEAD, json.dumps({
+                        "status": message["status"],
+                        "headers": [(k.decode("latin-1"), v.decode("latin-1")) for k, v in message.get("headers", [])],
+                    }).encode()))
+                elif message["type"] == "http.response.body":
+                    writer.write(_frame(BODY, message.get("body", b"")))
+                    if not message.get("more_body", False):
+                        writer.write(_frame(END))
+                    await writer.drain()
+
+            await self.app(scope, receive, send)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Forwarded request failed: {e}")
+        finally:
+            if disconnected is not None:
+                disconnected.cancel()
+            writer.close()
+
+    def stats(self):
+        return {"socket": self.path, "requests": self.requests, "errors": self.errors}
+
+
+class LeaderUnavailable(Exception):
+    """Raised when no leader is accepting forwarded requests"""
+
+
+class LeaderClient:
+    """Follower side: send one request to the leader and stream the response"""
+
+    def __init__(self, path, connect_timeout=2.0):
+        self.path = path
+        self.connect_timeout = connect_timeout
+        self.forwarded = 0
+        self.failed = 0
+
+    async def request(self, method, path, query_string, headers, body, client=None):
+        """(status, headers, async body iterator); LeaderUnavailable if the leader cannot be reached"""
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.path), self.connect_timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            self.failed += 1
+            raise LeaderUnavailable(str(e))
+        head = {"method": method, "path": path, "query_string": query_string,
+                "headers": [(k, v) for k, v in headers if k.lower() not in HOP_HEADERS],
+                "client": list(client) if client else None}
+        try:
+            writer.write(_frame(HEAD, json.dumps(head).encode()) + _frame(BODY, body))
+            await writer.drain()
+            kind, payload = await _read_frame(reader)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            writer.close()
+            self.failed += 1
+            raise LeaderUnavailable(f"leader closed the connection ({e})")
+        response = json.loads(payload)
+        self.forwarded += 1
+
+        async def chunks():
+            try:
+                while True:
+                    kind, payload = await _read_frame(reader)
+                    if kind == END:
+                        return
+                    if payload:
+                        yield payload
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return
+            finally:
+                writer.close()
+
+        headers = [(k, v) for k, v in response["headers"] if k.lower() not in HOP_HEADERS]
+        return response["status"], headers, chunks()
+
+    def stats(self):
+        return {"socket": self.path, "forwarded": self.forwarded, "failed": self.failed}
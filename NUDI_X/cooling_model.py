@@ -0,0 +1,314 @@
+# cooling_model.py - Vectorized cooling_needed / no_cooling classifier for the Smart Cooling Wearable
+#
+#   python cooling_model.py                                   # train, evaluate on a held-out split, compare with Edge Impulse
+#   python cooling_model.py --score testing.csv --output scored.csv
+#   python cooling_model.py --synthetic-rows 5000000          # throughput on generated logs
+#
+# The model is a logistic regression on (external_temp, body_temp,
+# heart_rate). Standardization is folded into the weights, so scoring a
+# chunk is one matrix-vector product; CSVs are read and scored in chunks
+# of --chunk-rows, so memory stays flat however long the log is.
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv(
+    "COOLING_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Smart Cooling Wearable")
+)
+TRAINING_FILES = ("cooling_data.csv", "cooling_data_1.csv")
+EDGE_IMPULSE_METRICS = "ei-smart-cooling-wearable-0.1-classifier-model-evaluation-metrics-json-file-model.4.json"
+MODEL_PATH = os.getenv("COOLING_MODEL_PATH", "cooling_model.json")
+
+FEATURES = ("external_temp", "body_temp", "heart_rate")
+# Same order as the Edge Impulse class_names, so confusion matrices line up
+CLASS_NAMES = ("cooling_needed", "no_cooling")
+COOLING_NEEDED, NO_COOLING = 0, 1
+DEFAULT_CHUNK_ROWS = 65536
+HOLDOUT_FRACTION = 0.2  # newest rows, scored by a model trained without them
+
+
+class CoolingClassifier:
+    """Logistic regression; `predict_proba` returns P(cooling_needed) per row"""
+
+    def __init__(self, weights=None, bias=0.0, threshold=0.5):
+        self.weights = np.zeros(len(FEATURES)) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.bias = float(bias)
+        self.threshold = threshold
+
+    def fit(self, X, cooling, epochs=2000, learning_rate=0.5, l2=1e-3):
+        """Full-batch gradient descent on standardized features; `cooling` is 1 for cooling_needed"""
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(cooling, dtype=np.float64)
+        mean, std = X.mean(axis=0), X.std(axis=0)
+        std[std == 0] = 1.0
+        Z = (X - mean) / std
+        w, b = np.zeros(Z.shape[1]), 0.0
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-(Z @ w + b)))
+            error = p - y
+            w -= learning_rate * (Z.T @ error / len(y) + l2 * w)
+            b -= learning_rate * error.mean()
+        # Fold the standardization in: w.(x - mean)/std + b == (w/std).x + b'
+        self.weights = w / std
+        self.bias = float(b - np.sum(w * mean / std))
+        return self
+
+    def decision_function(self, X):
+        return X @ self.weights + self.bias
+
+    def predict_proba(self, X):
+        return 1.0 / (1.0 + np.exp(-self.decision_function(X)))
+
+    def predict(self, X):
+        """Class index per row (COOLING_NEEDED or NO_COOLING)"""
+        if self.threshold == 0.5:
+            cooling = self.decision_function(X) > 0.0  # no exp needed at the default threshold
+        else:
+            cooling = self.predict_proba(X) > self.threshold
+        return np.where(cooling, COOLING_NEEDED, NO_COOLING).astype(np.int8)
+
+    def to_dict(self):
+        return {
+            "features": list(FEATURES), "class_names": list(CLASS_NAMES),
+            "weights": self.weights.tolist(), "bias": self.bias, "threshold": self.threshold,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if tuple(data.get("features", FEATURES)) != FEATURES:
+            raise ValueError(f"model was trained on {data['features']}, expected {list(FEATURES)}")
+        return cls(data["weights"], data["bias"], data.get("threshold", 0.5))
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+# --- CSV streaming -----------------------------------------------------------
+
+def iter_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield (features float64 (n, 3), labels int8 (n,) or None) per chunk of rows.
+
+    Labels are read only when rows have a fourth column (testing.csv has a
+    label header but no label values).
+    """
+    with open(path, encoding="utf-8") as f:
+        header = [h.strip() for h in f.readline().split(",")]
+        if tuple(header[:3]) != FEATURES:
+            raise ValueError(f"{path}: expected columns {', '.join(FEATURES)}, got {', '.join(header)}")
+        while True:
+            lines = [line for line in itertools.islice(f, chunk_rows) if line.strip()]
+            if not lines:
+                return
+            X = np.loadtxt(lines, delimiter=",", usecols=(0, 1, 2), dtype=np.float64, ndmin=2)
+            labels = None
+            if lines[0].count(",") >= 3:
+                names = np.loadtxt(lines, delimiter=",", usecols=3, dtype=str, ndmin=1)
+                labels = np.where(np.char.strip(names) == CLASS_NAMES[COOLING_NEEDED], COOLING_NEEDED, NO_COOLING)
+                labels = labels.astype(np.int8)
+            yield X, labels
+
+
+def load_labeled(paths):
+    """All labeled rows from `paths` in file order (oldest first), exact duplicates removed.
+
+    cooling_data.csv repeats rows of cooling_data_1.csv; the first occurrence is kept.
+    """
+    X, y = [], []
+    for path in paths:
+        for features, labels in iter_chunks(path):
+            if labels is None:
+                raise ValueError(f"{path} has no labels")
+            X.append(features)
+            y.append(labels)
+    rows = np.column_stack([np.concatenate(X), np.concatenate(y)])
+    _, first = np.unique(rows, axis=0, return_index=True)
+    rows = rows[np.sort(first)]
+    return rows[:, :3], rows[:, 3].astype(np.int8)
+
+
+def split_holdout(X, y, fraction=HOLDOUT_FRACTION):
+    """((X, y) to train on, (X, y) held out): the newest `fraction` of rows, in time order"""
+    cut = len(y) - max(1, int(round(len(y) * fraction)))
+    return (X[:cut], y[:cut]), (X[cut:], y[cut:])
+
+
+def train(paths=None, rows=None):
+    """Fit on the labeled CSVs, or on (X, y) `rows` if given"""
+    if rows is None:
+        rows = load_labeled(paths or [os.path.join(DATA_DIR, name) for name in TRAINING_FILES])
+    X, y = rows
+    model = CoolingClassifier().fit(X, y == COOLING_NEEDED)
+    logger.info(f"Trained cooling classifier on {len(y)} rows")
+    return model
+
+
+def load_or_train(path=MODEL_PATH, training_paths=None):
+    """Saved model if `path` exists, otherwise train on the labeled CSVs and save it"""
+    if path and os.path.exists(path):
+        return CoolingClassifier.load(path)
+    model = train(training_paths)
+    if path:
+        model.save(path)
+    return model
+
+
+# --- scoring -----------------------------------------------------------------
+
+def confusion_matrix(labels, predictions):
+    """2x2 counts, rows = true class, columns = predicted class (CLASS_NAMES order)"""
+    return np.bincount(labels.astype(np.int64) * 2 + predictions, minlength=4).reshape(2, 2)
+
+
+def score_csv(model, path, chunk_rows=DEFAULT_CHUNK_ROWS, output=None):
+    """Score every row of `path` chunk by chunk.
+
+    Writes external_temp,body_temp,heart_rate,p_cooling,prediction rows to
+    `output` if given. Returns rows, per-class counts, the confusion matrix
+    (when the file is labeled) and throughput.
+    """
+    started = time.perf_counter()
+    rows = 0
+    predicted = np.zeros(2, dtype=np.int64)
+    confusion = np.zeros((2, 2), dtype=np.int64)
+    labeled = False
+    out = open(output, "w", encoding="utf-8") if output else None
+    try:
+        if out is not None:
+            out.write(",".join(FEATURES) + ",p_cooling,prediction\n")
+        for X, labels in iter_chunks(path, chunk_rows):
+            predictions = model.predict(X)
+            rows += len(X)
+            predicted += np.bincount(predictions, minlength=2)
+            if labels is not None:
+                labeled = True
+                confusion += confusion_matrix(labels, predictions)
+            if out is not None:
+                names = np.asarray(CLASS_NAMES, dtype=object)[predictions]
+                table = np.column_stack([X, model.predict_proba(X), names]).astype(object)
+                np.savetxt(out, table, fmt=["%g", "%g", "%g", "%.4f", "%s"], delimiter=",")
+    finally:
+        if out is not None:
+            out.close()
+    elapsed = time.perf_counter() - started
+    return {
+        "path": path,
+        "rows": rows,
+        "predicted": {CLASS_NAMES[i]: int(predicted[i]) for i in range(2)},
+        "confusion_matrix": confusion.tolist() if labeled else None,
+        "accuracy": round(float(np.trace(confusion) / confusion.sum()), 4) if labeled and rows else None,
+        "seconds": round(elapsed, 4),
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else None,
+    }
+
+
+def edge_impulse_agreement(confusion, metrics_path=None, variant="float32"):
+    """Compare our confusion matrix with the Edge Impulse validation metrics.
+
+    Edge Impulse's validation split is not shipped, so the comparison is
+    per-class recall and accuracy rather than a row-by-row match.
+    """
+    metrics_path = metrics_path or os.path.join(DATA_DIR, EDGE_IMPULSE_METRICS)
+    with open(metrics_path, encoding="utf-8") as f:
+        reference = json.load(f)["validation"][variant]
+    if tuple(reference["class_names"]) != CLASS_NAMES:
+        raise ValueError(f"Edge Impulse classes {reference['class_names']} != {list(CLASS_NAMES)}")
+    ours = np.asarray(confusion, dtype=np.float64)
+    theirs = np.asarray(reference["confusion_matrix"], dtype=np.float64)
+
+    def recall(matrix):
+        return np.diag(matrix) / np.maximum(matrix.sum(axis=1), 1)
+
+    our_recall, their_recall = recall(ours), recall(theirs)
+    return {
+        "variant": variant,
+        "edge_impulse_confusion_matrix": reference["confusion_matrix"],
+        "confusion_matrix": ours.astype(int).tolist(),
+        "edge_impulse_accuracy": round(float(np.trace(theirs) / theirs.sum()), 4),
+        "accuracy": round(float(np.trace(ours) / max(ours.sum(), 1)), 4),
+        "recall": {CLASS_NAMES[i]: round(float(our_recall[i]), 4) for i in range(2)},
+        "edge_impulse_recall": {CLASS_NAMES[i]: round(float(their_recall[i]), 4) for i in range(2)},
+        "max_recall_gap": round(float(np.max(np.abs(our_recall - their_recall))), 4),
+    }
+
+
+def synthesize_csv(path, rows, seed=0, chunk_rows=DEFAULT_CHUNK_ROWS, training_paths=None):
+    """Write `rows` labeled readings drawn per class from the training data's mean/std"""
+    training_paths = training_paths or [os.path.join(DATA_DIR, name) for name in TRAINING_FILES]
+    X, y = load_labeled(training_paths)
+    stats = [(X[y == c].mean(axis=0), X[y == c].std(axis=0)) for c in range(2)]
+    rng = np.random.default_rng(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(",".join(FEATURES) + ",label\n")
+        for start in range(0, rows, chunk_rows):
+            n = min(chunk_rows, rows - start)
+            classes = rng.integers(0, 2, n)
+            mean = np.stack([stats[c][0] for c in range(2)])[classes]
+            std = np.stack([stats[c][1] for c in range(2)])[classes]
+            values = np.round(rng.normal(mean, std), 1)
+            table = np.column_stack([values, np.asarray(CLASS_NAMES, dtype=object)[classes]]).astype(object)
+            np.savetxt(f, table, fmt=["%.0f", "%.1f", "%.0f", "%s"], delimiter=",")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score Smart Cooling Wearable CSVs with a vectorized classifier")
+    parser.add_argument("--model", default=MODEL_PATH, help="saved model (trained and written if missing)")
+    parser.add_argument("--retrain", action="store_true", help="train even if --model exists")
+    parser.add_argument("--score", nargs="*", default=[], help="CSV files to score")
+    parser.add_argument("--output", help="write scored rows here (single --score file)")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--synthetic-rows", type=int, default=0, help="also score N generated labeled rows")
+    parser.add_argument("--holdout", type=float, default=HOLDOUT_FRACTION,
+                        help="newest fraction of the training rows held out for the Edge Impulse comparison")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.output and len(args.score) != 1:
+        parser.error("--output needs exactly one --score file")
+
+    if args.retrain and os.path.exists(args.model):
+        os.remove(args.model)
+    model = load_or_train(args.model)
+    report = {"model": model.to_dict(), "results": []}
+
+    # The saved model saw every row, so agreement is measured with a model
+    # fitted on the older rows and scored on the newest ones it never saw
+    training = [os.path.join(DATA_DIR, name) for name in TRAINING_FILES]
+    fit_rows, (X_holdout, y_holdout) = split_holdout(*load_labeled(training), args.holdout)
+    holdout_model = train(rows=fit_rows)
+    report["edge_impulse"] = {
+        "train_rows": len(fit_rows[1]),
+        "holdout_rows": len(y_holdout),
+        **edge_impulse_agreement(confusion_matrix(y_holdout, holdout_model.predict(X_holdout))),
+    }
+
+    for path in args.score:
+        report["results"].append(score_csv(model, path, args.chunk_rows, args.output))
+
+    if args.synthetic_rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "synthetic.csv")
+            started = time.perf_counter()
+            synthesize_csv(path, args.synthetic_rows, chunk_rows=args.chunk_rows)
+            logger.info(f"Generated {args.synthetic_rows} rows in {time.perf_counter() - started:.1f} s")
+            result = score_csv(model, path, args.chunk_rows)
+            result["path"] = f"synthetic ({args.synthetic_rows} rows)"
+            report["results"].append(result)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# device_simulator.py - Simulated ESP32 vending machines speaking the esp32_main.ino protocol
+#
+#   python device_simulator.py --devices 20 --embedded-broker
+#   MQTT_BROKER=127.0.0.1 FLEET_MODE=1 uvicorn main:app
+#   python load_driver.py --rate 20 --duration 60
+#
+# Each device subscribes to its command and emergency topics, reports
+# dispensing_noodle_N / busy / ready / emergency_stop on its status topic,
+# publishes drop results, log chatter and heartbeats, and sets a retained
+# "offline" last will - the same as the firmware.
+#
+# --wearables N adds N cooling wearables on one connection, publishing
+# external_temp,body_temp,heart_rate readings to wearable/<id>/telemetry.
+import argparse
+import asyncio
+import random
+import threading
+import time
+import logging
+
+import paho.mqtt.client as mqtt
+
+from fleet import DEFAULT_DEVICE_ID, device_topic
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatedDevice:
+    """One machine: paho network thread plus a worker thread per dispense"""
+
+    def __init__(self, device_id, host="127.0.0.1", port=1883, drop_time=(2.0, 5.0),
+                 heating_time=(5.0, 10.0), failure_rate=0.05, heartbeat_interval=15.0,
+                 chatter_interval=1.0, location=None):
+        self.device_id = device_id
+        self.host = host
+        self.port = port
+        self.drop_time = drop_time
+        self.heating_time = heating_time
+        self.failure_rate = failure_rate
+        self.heartbeat_interval = heartbeat_interval
+        self.chatter_interval = chatter_interval
+        self.location = location
+        self.dispensing = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()  # emergency stop for the current dispense
+        self._closed = threading.Event()
+        self.counts = {"commands": 0, "dispensed": 0, "drop_timeouts": 0, "rejected_busy": 0, "emergency_stops": 0}
+
+        self.client = mqtt.Client(client_id=f"sim-{device_id}-{random.randrange(1 << 30)}")
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.will_set(self.topic("status"), "offline", qos=1, retain=True)
+
+    def topic(self, kind):
+        return device_topic(self.device_id, kind)
+
+    def publish(self, kind, message, retain=False):
+        self.client.publish(self.topic(kind), message, qos=0, retain=retain)
+
+    def start(self):
+        self.client.connect(self.host, self.port, 30)
+        self.client.loop_start()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        self._stop.set()
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    # --- MQTT ------------------------------------------------------------------
+
+    def _on_connect(self, client, userdata, flags, rc):
+        client.subscribe(self.topic("command"))
+        client.subscribe(self.topic("emergency"), qos=1)
+        self.publish("status", "ready", retain=True)
+        self.publish("log", "MQTT connected successfully")
+        if self.location is not None:
+            self.publish("location", f"{self.location[0]},{self.location[1]}", retain=True)
+
+    def _on_message(self, client, userdata, msg):
+        payload = msg.payload.decode().strip()
+        if msg.topic == self.topic("emergency"):
+            self._emergency_stop()
+            self.publish("emergency_ack", payload)
+            return
+        self.counts["commands"] += 1
+        with self._lock:
+            busy = self.dispensing
+            if payload.startswith("noodle_") and not busy:
+                self.dispensing = True
+        if payload.startswith("noodle_"):
+            if busy:
+                self.counts["rejected_busy"] += 1
+                self.publish("status", "busy", retain=True)
+                self.publish("log", "Rejected - Currently busy")
+                return
+            number = int(payload.rsplit("_", 1)[-1])
+            threading.Thread(target=self._dispense, args=(number,), daemon=True).start()
+        elif payload == "status":
+            self.publish("status", "busy" if busy else "ready", retain=True)
+        elif payload == "emergency_stop":
+            self._emergency_stop()
+        elif payload.startswith("test_motor_"):
+            self.publish("log", "Motor test complete")
+            self.publish("status", "ready", retain=True)
+
+    # --- behaviour -------------------------------------------------------------
+
+    def _emergency_stop(self):
+        self.counts["emergency_stops"] += 1
+        self._stop.set()
+        with self._lock:
+            self.dispensing = False
+        self.publish("log", "EMERGENCY STOP")
+        self.publish("status", "emergency_stop", retain=True)
+        time.sleep(0.2)
+        self.publish("status", "ready", retain=True)
+
+    def _wait(self, seconds, chatter=None):
+        """Sleep like the firmware's spin/heat loops; True if an emergency stop arrived"""
+        deadline = time.monotonic() + seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._stop.wait(min(remaining, self.chatter_interval)):
+                return True
+            if chatter:
+                self.publish("log", chatter())
+
+    def _dispense(self, number):
+        self._stop.clear()
+        self.publish("status", f"dispensing_noodle_{number}", retain=True)
+        self.publish("log", f"Dispensing noodle {number}")
+
+        if self._wait(random.uniform(*self.drop_time), lambda: f"📏 Distance: {random.uniform(8, 30):.1f} cm"):
+            return
+        if random.random() < self.failure_rate:
+            self.counts["drop_timeouts"] += 1
+            self.publish("drop_detected", f"timeout_noodle_{number}")
+            self.publish("log", f"Drop timeout for noodle {number} - L298N & Relay NOT activated")
+        else:
+            self.publish("drop_detected", f"success_noodle_{number}")
+            self.publish("log", f"Drop detected for noodle {number}")
+            if self._wait(random.uniform(*self.heating_time)):
+                return
+            self.counts["dispensed"] += 1
+            self.publish("log", f"Noodle {number} ready!")
+
+        with self._lock:
+            self.dispensing = False
+        self.publish("status", "ready", retain=True)
+
+    def _heartbeat(self):
+        while not self._closed.wait(self.heartbeat_interval):
+            self.client.publish(self.topic("heartbeat"), "busy" if self.dispensing else "ready")
+
+
+class SimulatedWearables:
+    """Many cooling wearables sharing one MQTT connection and one publishing thread.
+
+    Each wearable drifts between a resting and an overheated profile (the
+    two classes in cooling_data.csv); `batch` readings go in one message.
+    """
+
+    RESTING = (36.0, 37.2, 95.0)
+    HOT = (40.0, 39.2, 130.0)
+
+    def __init__(self, count, host="127.0.0.1", port=1883, rate=1.0, batch=1, prefix="wear"):
+        self.ids = [f"{prefix}-{i + 1:03d}" for i in range(count)]
+        self.rate = rate  # readings per second per wearable
+        self.batch = max(1, batch)
+        self.host = host
+        self.port = port
+        self.heat = [random.random() for _ in self.ids]  # 0 = resting, 1 = hot
+        self.published = 0
+        self._closed = threading.Event()
+        self.client = mqtt.Client(client_id=f"sim-wearables-{random.randrange(1 << 30)}")
+
+    def _reading(self, i, now):
+        self.heat[i] = min(1.0, max(0.0, self.heat[i] + random.uniform(-0.05, 0.05)))
+        h = self.heat[i]
+        values = [low + (high - low) * h + random.gauss(0, 0.1) for low, high in zip(self.RESTING, self.HOT)]
+        return f"{now:.3f},{values[0]:.1f},{values[1]:.1f},{values[2]:.0f}"
+
+    def start(self):
+        self.client.connect(self.host, self.port, 30)
+        self.client.loop_start()
+        threading.Thread(target=self._publish_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def _publish_loop(self):
+        period = self.batch / self.rate
+        while not self._closed.wait(period):
+            now = time.time()
+            for i, wearable_id in enumerate(self.ids):
+                lines = [self._reading(i, now - (self.batch - 1 - k) / self.rate) for k in range(self.batch)]
+                self.client.publish(f"wearable/{wearable_id}/telemetry", "\n".join(lines))
+                self.published += self.batch
+
+
+def start_embedded_broker(host, port):
+    """Run mini_broker.MiniBroker on a background thread"""
+    from mini_broker import MiniBroker
+
+    ready = threading.Event()
+
+    def run():
+        async def serve():
+            await MiniBroker(host, port).start()
+            ready.set()
+            await asyncio.Event().wait()
+        asyncio.run(serve())
+
+    threading.Thread(target=run, name="mini-broker", daemon=True).start()
+    if not ready.wait(5):
+        raise RuntimeError("embedded broker did not start")
+
+
+def _range(text):
+    low, _, high = text.partition(",")
+    return float(low), float(high or low)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate ESP32 noodle vending machines over MQTT")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--prefix", default="sim", help="fleet device ids are <prefix>-001, ...")
+    parser.add_argument("--legacy", action="store_true", help=f"first device uses the legacy '{DEFAULT_DEVICE_ID}' topics")
+    parser.add_argument("--broker", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--embedded-broker", action="store_true", help="start mini_broker in this process")
+    parser.add_argument("--drop-time", type=_range, default=(2.0, 5.0), help="seconds until drop, e.g. 2,5")
+    parser.add_argument("--heating-time", type=_range, default=(5.0, 10.0), help="seconds of heating, e.g. 5,10")
+    parser.add_argument("--failure-rate", type=float, default=0.05, help="fraction of drops that time out")
+    parser.add_argument("--heartbeat", type=float, default=15.0)
+    parser.add_argument("--wearables", type=int, default=0, help="also simulate N cooling wearables")
+    parser.add_argument("--wearable-rate", type=float, default=1.0, help="readings per second per wearable")
+    parser.add_argument("--wearable-batch", type=int, default=1, help="readings per telemetry message")
+    parser.add_argument("--duration", type=float, default=0, help="seconds to run (0 = until Ctrl+C)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.embedded_broker:
+        start_embedded_broker(args.broker, args.port)
+
+    devices = []
+    for i in range(args.devices):
+        device_id = DEFAULT_DEVICE_ID if args.legacy and i == 0 else f"{args.prefix}-{i + 1:03d}"
+        location = (6.9 + random.uniform(-0.1, 0.1), 79.86 + random.uniform(-0.1, 0.1))
+        devices.append(SimulatedDevice(
+            device_id, args.broker, args.port, args.drop_time, args.heating_time,
+            args.failure_rate, args.heartbeat, location=location
+        ).start())
+    wearables = None
+    if args.wearables:
+        wearables = SimulatedWearables(
+            args.wearables, args.broker, args.port, args.wearable_rate, args.wearable_batch
+        ).start()
+    logger.info(f"✅ {len(devices)} simulated devices running against {args.broker}:{args.port}")
+
+    started = time.time()
+    try:
+        while not args.duration or time.time() - started < args.duration:
+            time.sleep(5)
+            totals = {}
+            for d in devices:
+                for key, value in d.counts.items():
+                    totals[key] = totals.get(key, 0) + value
+            busy = sum(1 for d in devices if d.dispensing)
+            if wearables is not None:
+                totals["wearable_readings"] = wearables.published
+            print(f"[{time.strftime('%H:%M:%S')}] busy {busy}/{len(devices)} {totals}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for d in devices:
+            d.stop()
+        if wearables is not None:
+            wearables.stop()
+
+
+if __name__ == "__main__":
+    main()
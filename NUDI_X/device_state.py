@@ -0,0 +1,147 @@
+# device_state.py - Thread-safe, event-driven state for a vending machine
+import asyncio
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceState:
+    """Status of one device, written from the MQTT thread and read from async handlers.
+
+    Writes go through `set_status` under a lock and record a transition
+    history. Listeners are called synchronously on every transition and
+    async waiters (`await wait_for("ready")`) are woken on the bound event
+    loop via call_soon_threadsafe.
+
+    A registry of many devices can pass one `lock` and one `listeners` list
+    for all of them; the history deque and waiter list are only allocated
+    once a device actually changes status or is waited on.
+    """
+
+    __slots__ = (
+        "device_id", "_lock", "_status", "_last_update", "_version",
+        "_history", "_history_size", "_listeners", "_loop", "_waiters",
+    )
+
+    def __init__(self, device_id="default", status="disconnected", history_size=50,
+                 lock=None, listeners=None):
+        self.device_id = device_id
+        self._lock = lock if lock is not None else threading.Lock()
+        self._status = status
+        self._last_update = None
+        self._version = 0
+        self._history_size = history_size
+        self._history = None  # deque of (timestamp, old, new), created on the first transition
+        self._listeners = listeners if listeners is not None else []
+        self._loop = None
+        self._waiters = None  # list of (predicate, future), only touched on the loop
+
+    # --- reads -----------------------------------------------------------
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def last_update(self):
+        return self._last_update
+
+    def snapshot(self):
+        """Consistent copy of the current state"""
+        with self._lock:
+            return {
+                "device_id": self.device_id,
+                "status": self._status,
+                "last_update": self._last_update,
+                "version": self._version,
+            }
+
+    def history(self, limit=None):
+        with self._lock:
+            items = list(self._history or ())
+        if limit is not None:
+            items = items[-limit:]
+        return [{"time": t, "from": old, "to": new} for t, old, new in items]
+
+    # --- writes ----------------------------------------------------------
+
+    def set_status(self, status, timestamp=None):
+        """Record a status report; returns True if the status changed"""
+        timestamp = timestamp if timestamp is not None else time.time()
+        with self._lock:
+            old = self._status
+            self._last_update = timestamp
+            if status == old:
+                return False
+            self._status = status
+            self._version += 1
+            if self._history is None:
+                self._history = deque(maxlen=self._history_size)
+            self._history.append((timestamp, old, status))
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            try:
+                listener(self, old, status)
+            except Exception as e:
+                logger.error(f"Device state listener failed: {e}")
+
+        loop = self._loop
+        if loop is not None and self._waiters:
+            try:
+                loop.call_soon_threadsafe(self._wake_waiters)
+            except RuntimeError:
+                pass  # loop closed
+        return True
+
+    def add_listener(self, listener):
+        """listener(state, old_status, new_status), called from the writer's thread
+
+        With a shared `listeners` list this registers it for every device
+        sharing the list.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    # --- async waiting ---------------------------------------------------
+
+    def bind_loop(self, loop):
+        self._loop = loop
+
+    def _wake_waiters(self):
+        status = self._status
+        for waiter in list(self._waiters or ()):
+            predicate, future = waiter
+            if not future.done() and predicate(status):
+                future.set_result(status)
+
+    async def wait_for(self, status_or_predicate, timeout=None):
+        """Wait until the status matches; returns True, or False on timeout"""
+        if callable(status_or_predicate):
+            predicate = status_or_predicate
+        else:
+            predicate = lambda s: s == status_or_predicate
+
+        if predicate(self._status):
+            return True
+
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        future = self._loop.create_future()
+        waiter = (predicate, future)
+        if self._waiters is None:
+            self._waiters = []
+        self._waiters.append(waiter)
+        try:
+            # Re-check: the status may have changed before the waiter was registered
+            if predicate(self._status):
+                return True
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters.remove(waiter)
@@ -0,0 +1,194 @@
+# emergency.py - Priority lane for emergency stops
+#
+# Stops are published on noodle_vending/[<device_id>/]emergency with QoS 2 by a
+# dedicated thread and MQTT connection, and re-sent until the device answers
+# on .../emergency_ack (or reports status "emergency_stop") or the deadline
+# passes. Nothing here runs on the event loop or the inference pool; the
+# outcome reaches callers through listeners or an awaitable wait().
+import asyncio
+import itertools
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+PENDING, ACKED, EXPIRED = "pending", "acked", "expired"
+
+
+class StopRequest:
+    __slots__ = ("stop_id", "device_id", "state", "attempts", "sent", "started_at", "acked_at", "last_sent_at",
+                 "_done", "_waiters")
+
+    def __init__(self, stop_id, device_id):
+        self.stop_id = stop_id
+        self.device_id = device_id
+        self.state = PENDING
+        self.attempts = 0
+        self.sent = False  # at least one attempt was handed to an MQTT client
+        self.started_at = time.perf_counter()
+        self.acked_at = None
+        self.last_sent_at = None
+        self._done = threading.Event()
+        self._waiters = []  # (loop, future) from wait()
+
+    @property
+    def latency_ms(self):
+        if self.acked_at is None:
+            return None
+        return round((self.acked_at - self.started_at) * 1000, 2)
+
+    def to_dict(self):
+        return {
+            "stop_id": self.stop_id,
+            "device_id": self.device_id,
+            "state": self.state,
+            "attempts": self.attempts,
+            "sent": self.sent,
+            "latency_ms": self.latency_ms,
+        }
+
+
+class EmergencyStopper:
+    """Sends emergency stops and retries them until the device acknowledges.
+
+    `send(device_id, stop_id)` publishes one attempt and returns True if it
+    was handed to a client. It is called from the caller's thread for the
+    first attempt, then from the stopper's own thread for retries.
+    Listeners get the StopRequest once it is acked or expires.
+    """
+
+    def __init__(self, send, retry_interval=0.5, deadline=10.0, history_size=100):
+        self.send = send
+        self.retry_interval = retry_interval
+        self.deadline = deadline
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._active = {}  # stop_id -> StopRequest
+        self._history = deque(maxlen=history_size)
+        self._latencies = deque(maxlen=1000)
+        self._expired = 0
+        self._listeners = []
+        self._thread = threading.Thread(target=self._run, name="emergency-stop", daemon=True)
+        self._thread.start()
+
+    def _attempt(self, stop):
+        stop.attempts += 1
+        stop.last_sent_at = time.perf_counter()
+        try:
+            if self.send(stop.device_id, stop.stop_id):
+                stop.sent = True
+            else:
+                logger.error(f"🛑 Emergency stop {stop.stop_id} attempt {stop.attempts} not sent")
+        except Exception as e:
+            logger.error(f"🛑 Emergency stop {stop.stop_id} send failed: {e}")
+
+    def add_listener(self, listener):
+        """listener(stop) when a stop is acked or expires, called from the acking/stopper thread"""
+        self._listeners.append(listener)
+
+    def _finish(self, stop):
+        """Wake waiters and listeners; call with the stop already out of _active and without the lock"""
+        stop._done.set()
+        for loop, future in stop._waiters:
+            try:
+                loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(stop))
+            except RuntimeError:
+                pass  # loop closed
+        for listener in self._listeners:
+            try:
+                listener(stop)
+            except Exception as e:
+                logger.error(f"Emergency stop listener failed: {e}")
+
+    def trigger(self, device_id):
+        """Start an emergency stop for device_id; the first attempt is sent immediately"""
+        stop = StopRequest(f"stop-{next(self._ids)}-{int(time.time())}", device_id)
+        with self._cond:
+            self._active[stop.stop_id] = stop
+        self._attempt(stop)
+        with self._cond:
+            self._cond.notify()
+        return stop
+
+    def on_ack(self, device_id, stop_id=None):
+        """Device confirmed a stop; without a stop_id every pending stop for it is acked"""
+        now = time.perf_counter()
+        with self._cond:
+            if stop_id is not None and stop_id in self._active:
+                stops = [self._active[stop_id]]
+            else:
+                stops = [s for s in self._active.values() if s.device_id == device_id]
+            for stop in stops:
+                del self._active[stop.stop_id]
+                stop.state = ACKED
+                stop.acked_at = now
+                self._latencies.append(stop.latency_ms)
+                self._history.append(stop)
+                logger.info(f"🛑 Emergency stop {stop.stop_id} acknowledged in {stop.latency_ms} ms")
+        for stop in stops:
+            self._finish(stop)
+        return len(stops)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait(self.retry_interval / 2)
+                now = time.perf_counter()
+                due = []
+                expired = []
+                for stop in list(self._active.values()):
+                    if now - stop.started_at > self.deadline:
+                        del self._active[stop.stop_id]
+                        stop.state = EXPIRED
+                        self._expired += 1
+                        self._history.append(stop)
+                        expired.append(stop)
+                        logger.error(f"🛑 Emergency stop {stop.stop_id} NOT acknowledged by {stop.device_id}")
+                    elif now - stop.last_sent_at >= self.retry_interval:
+                        due.append(stop)
+            for stop in expired:
+                self._finish(stop)
+            for stop in due:
+                self._attempt(stop)
+
+    async def wait(self, stop, timeout=None):
+        """Wait until the stop is acked or expires; a loop future, no executor thread is held"""
+        loop = asyncio.get_running_loop()
+        if timeout is None:
+            timeout = self.deadline + self.retry_interval  # let the stopper thread expire it first
+        future = loop.create_future()
+        with self._cond:
+            pending = stop.state == PENDING
+            if pending:
+                stop._waiters.append((loop, future))
+        if pending:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return stop
+
+    def stats(self):
+        with self._cond:
+            latencies = sorted(self._latencies)
+            history = [s.to_dict() for s in list(self._history)[-10:]]
+            active = len(self._active)
+
+        def pct(q):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            "pending": active,
+            "acked": len(latencies),
+            "expired": self._expired,
+            "latency_p50_ms": pct(0.5),
+            "latency_p95_ms": pct(0.95),
+            "latency_max_ms": latencies[-1] if latencies else None,
+            "retry_interval": self.retry_interval,
+            "deadline": self.deadline,
+            "recent": history,
+        }
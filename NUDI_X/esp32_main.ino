@@ -17,6 +17,9 @@ const char* mqtt_server = "broker.hivemq.com";
 const char* mqtt_topic = "noodle_vending/command";
 const char* mqtt_status = "noodle_vending/status";
 const char* mqtt_drop = "noodle_vending/drop_detected";
+const char* mqtt_heartbeat = "noodle_vending/heartbeat";
+const char* mqtt_emergency = "noodle_vending/emergency";
+const char* mqtt_emergency_ack = "noodle_vending/emergency_ack";
 
 // Stepper Motor Pins (use safe GPIOs)
 #define IN1_1 19
@@ -54,9 +57,12 @@ PubSubClient mqttClient(espClient);
 
 String currentCommand = "";
 volatile bool dispensing = false;
+volatile bool emergencyRequested = false; // set by emergencyStop(), ends dispense loops
 
 unsigned long lastReconnectAttempt = 0;
 const unsigned long RECONNECT_INTERVAL = 5000;
+unsigned long lastHeartbeat = 0;
+const unsigned long HEARTBEAT_INTERVAL = 15000; // server marks us stale after 45 s of silence
 bool mqttInitialized = false;
 
 void setup() {
@@ -148,7 +154,11 @@ void mqttCallback(char* topic, byte* payload, unsigned int length) {
   Serial.print(topic);
   Serial.print("]: ");
   Serial.println(message);
-  if (String(topic) == mqtt_topic) {
+  if (String(topic) == mqtt_emergency) {
+    // Priority lane: stop first, then acknowledge with the server's stop id
+    emergencyStop();
+    mqttClient.publish(mqtt_emergency_ack, message.c_str());
+  } else if (String(topic) == mqtt_topic) {
     handleCommand(message);
   }
 }
@@ -253,6 +263,7 @@ void testMotor(int motorNumber) {
 }
 
 void emergencyStop() {
+  emergencyRequested = true;
   dispensing = false;
   mqttPublish("noodle_vending/log", "EMERGENCY STOP");
   mqttPublish(mqtt_status, "emergency_stop");
@@ -270,6 +281,7 @@ void emergencyStop() {
 
 void dispenseNoodle(int noodleNumber) {
   dispensing = true;
+  emergencyRequested = false;
   bool dropDetected = false;
   bool heatingComplete = false;
 
@@ -330,6 +342,8 @@ void dispenseNoodle(int noodleNumber) {
     delay(300); // small pause between spins
   }
 
+  if (emergencyRequested) return; // emergencyStop() already reported status
+
   if (!dropDetected) {
     Serial.println("DROP DETECTION TIMEOUT - NO L298N/RELAY ACTIVATION (Ultrasonic sensor did NOT detect drop)");
     mqttPublish(mqtt_drop, "timeout_noodle_" + String(noodleNumber));
@@ -377,6 +391,8 @@ void dispenseNoodle(int noodleNumber) {
     delay(1000);
   }
 
+  if (emergencyRequested) return;
+
   if (heatingComplete) {
     Serial.println("HEATING PROCESS COMPLETED - noodle ready");
     mqttPublish("noodle_vending/log", "Noodle " + String(noodleNumber) + " ready!");
@@ -419,7 +435,8 @@ bool reconnectMQTT() {
   String clientId = "ESP32-NoodleVending-";
   clientId += String(WiFi.macAddress());
 
-  bool connected = mqttClient.connect(clientId.c_str());
+  // Last will: broker publishes retained "offline" if this connection drops
+  bool connected = mqttClient.connect(clientId.c_str(), mqtt_status, 1, true, "offline");
   if (!connected) {
     Serial.print("failed, rc=");
     Serial.println(mqttClient.state());
@@ -428,6 +445,7 @@ bool reconnectMQTT() {
 
   Serial.println("connected to MQTT");
   mqttClient.subscribe(mqtt_topic);
+  mqttClient.subscribe(mqtt_emergency, 1); // PubSubClient subscribes at QoS 1 at most
   mqttClient.publish(mqtt_status, "ready", true);
   mqttClient.publish("noodle_vending/log", "MQTT connected successfully");
   return true;
@@ -436,6 +454,7 @@ bool reconnectMQTT() {
 bool emergencyStopFlag() {
   // simple helper to quickly check if Arduino reported emergency
   // We also check Serial2 for EMERGENCY_STOPPED messages
+  if (emergencyRequested) return true; // stop received over MQTT
   if (Serial2.available()) {
     String m = Serial2.readStringUntil('\n');
     m.trim();
@@ -480,6 +499,10 @@ void loop() {
   } else {
     digitalWrite(LED_BUILTIN, HIGH);
     mqttClient.loop();
+    if (millis() - lastHeartbeat > HEARTBEAT_INTERVAL) {
+      lastHeartbeat = millis();
+      mqttClient.publish(mqtt_heartbeat, dispensing ? "busy" : "ready");
+    }
   }
 
   // Read any asynchronous messages from Arduino and forward to logs if it's not handled elsewhere
@@ -0,0 +1,194 @@
+# fleet.py - Registry and MQTT topic routing for many vending machines
+#
+# Topic layout:
+#   noodle_vending/<topic>              legacy single machine, device id "default"
+#   noodle_vending/<device_id>/<topic>  fleet machines (status, log, command, location)
+import math
+import threading
+import logging
+
+from device_state import DeviceState
+
+logger = logging.getLogger(__name__)
+
+TOPIC_ROOT = "noodle_vending"
+DEFAULT_DEVICE_ID = "default"
+
+
+def device_topic(device_id, kind):
+    """Topic for device_id, e.g. device_topic("m42", "command") -> noodle_vending/m42/command"""
+    if device_id == DEFAULT_DEVICE_ID:
+        return f"{TOPIC_ROOT}/{kind}"
+    return f"{TOPIC_ROOT}/{device_id}/{kind}"
+
+
+def fleet_subscriptions(kinds):
+    """Wildcard subscriptions covering every fleet device"""
+    return [f"{TOPIC_ROOT}/+/{kind}" for kind in kinds]
+
+
+def parse_topic(topic):
+    """(device_id, kind) for a vending topic, or (None, None) if it is not one"""
+    parts = topic.split("/")
+    if parts[0] != TOPIC_ROOT:
+        return None, None
+    if len(parts) == 2:
+        return DEFAULT_DEVICE_ID, parts[1]
+    if len(parts) == 3:
+        return parts[1], parts[2]
+    return None, None
+
+
+class FleetRegistry:
+    """In-memory DeviceState per machine plus the set of machines that are ready.
+
+    Lookups on the MQTT hot path are a plain dict get; the registry lock is
+    taken only when a device is seen for the first time. All devices share
+    one state lock and one listener list, so a device costs a few slots
+    rather than its own lock and list.
+
+    Machines that can take an order (not offline, not stale) are also kept
+    in buckets keyed by queue depth, updated on every transition and depth
+    change, so `least_loaded()` does not scan or sort the fleet.
+    """
+
+    def __init__(self, history_size=10):
+        self.history_size = history_size
+        self._devices = {}
+        self._locations = {}  # device_id -> (lat, lon)
+        self._ready = set()
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()  # shared by every DeviceState
+        self._listeners = [self._on_transition]  # shared by every DeviceState
+
+        self._index_lock = threading.Lock()
+        self._depth = {}  # device_id -> queued orders
+        self._blocked = {}  # device_id -> reasons it cannot take orders ("status", "liveness")
+        self._by_depth = {}  # depth -> set of reachable device_ids, no empty sets
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, device_id):
+        return device_id in self._devices
+
+    def get(self, device_id):
+        return self._devices.get(device_id)
+
+    def get_or_create(self, device_id):
+        state = self._devices.get(device_id)
+        if state is not None:
+            return state
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is None:
+                state = DeviceState(device_id, history_size=self.history_size,
+                                    lock=self._state_lock, listeners=self._listeners)
+                self._devices[device_id] = state
+                with self._index_lock:
+                    self._place(device_id, self._depth.get(device_id, 0))
+                logger.info(f"🆕 Registered device '{device_id}'")
+        return state
+
+    def add_listener(self, listener):
+        """listener(state, old, new) for every current and future device"""
+        with self._state_lock:
+            self._listeners.append(listener)
+
+    def _on_transition(self, state, old, new):
+        if new == "ready":
+            self._ready.add(state.device_id)
+        else:
+            self._ready.discard(state.device_id)
+        if new == "offline" or old == "offline":
+            self.set_reachable(state.device_id, new != "offline", reason="status")
+
+    # --- least-loaded index ------------------------------------------------
+
+    def _place(self, device_id, old_depth):
+        """Move device_id out of old_depth's bucket and into its current one (index lock held)"""
+        ids = self._by_depth.get(old_depth)
+        if ids is not None:
+            ids.discard(device_id)
+            if not ids:
+                del self._by_depth[old_depth]
+        if device_id in self._devices and not self._blocked.get(device_id):
+            self._by_depth.setdefault(self._depth.get(device_id, 0), set()).add(device_id)
+
+    def set_queue_depth(self, device_id, depth):
+        """Record how many orders are queued for device_id"""
+        with self._index_lock:
+            old = self._depth.get(device_id, 0)
+            if old != depth:
+                self._depth[device_id] = depth
+                self._place(device_id, old)
+
+    def set_reachable(self, device_id, reachable, reason="liveness"):
+        """Mark a device as able (or not) to take orders.
+
+        Each reason ("status", "liveness") is tracked on its own; a device is
+        reachable only when no reason rules it out.
+        """
+        with self._index_lock:
+            reasons = self._blocked.setdefault(device_id, set())
+            if reachable:
+                reasons.discard(reason)
+            else:
+                reasons.add(reason)
+            if not reasons:
+                del self._blocked[device_id]
+            self._place(device_id, self._depth.get(device_id, 0))
+
+    def least_loaded(self, exclude=()):
+        """Reachable device with the fewest queued orders, or None"""
+        with self._index_lock:
+            for depth in sorted(self._by_depth):
+                for device_id in self._by_depth[depth]:
+                    if device_id not in exclude:
+                        return device_id
+        return None
+
+    def set_location(self, device_id, lat, lon):
+        self.get_or_create(device_id)
+        self._locations[device_id] = (float(lat), float(lon))
+
+    def location(self, device_id):
+        return self._locations.get(device_id)
+
+    def ready_ids(self):
+        return list(self._ready)
+
+    def nearest_ready(self, lat=None, lon=None, exclude=()):
+        """Closest ready device to (lat, lon); any ready device if no position is given"""
+        best_id, best_distance = None, math.inf
+        for device_id in list(self._ready):
+            if device_id in exclude:
+                continue
+            position = self._locations.get(device_id)
+            if lat is None or lon is None or position is None:
+                distance = math.inf
+            else:
+                # Equirectangular approximation, fine for picking the closest machine
+                x = math.radians(position[1] - lon) * math.cos(math.radians((position[0] + lat) / 2))
+                y = math.radians(position[0] - lat)
+                distance = x * x + y * y
+            if best_id is None or distance < best_distance:
+                best_id, best_distance = device_id, distance
+        return best_id
+
+    def list(self, offset=0, limit=100):
+        """Page of device snapshots ordered by id"""
+        ids = sorted(self._devices)[offset:offset + limit]
+        devices = []
+        for device_id in ids:
+            snapshot = self._devices[device_id].snapshot()
+            snapshot["location"] = self._locations.get(device_id)
+            devices.append(snapshot)
+        return devices
+
+    def stats(self):
+        return {
+            "devices": len(self._devices),
+            "ready": len(self._ready),
+            "with_location": len(self._locations),
+        }
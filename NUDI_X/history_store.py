@@ -0,0 +1,265 @@
+# history_store.py - Append-only SQLite history of orders, device status and serial output
+#
+# One `events` table in WAL mode, indexed by time, device and kind.
+# record() only appends to an in-memory buffer; the writer task flushes
+# the buffer in one transaction per batch on a dedicated thread, so MQTT
+# callbacks and request handlers never wait on the disk. Queries use a
+# second connection and thread; WAL lets them run alongside the writer.
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+logger = logging.getLogger(__name__)
+
+ORDER = "order"
+STATUS = "status"
+SERIAL = "serial"
+KINDS = (ORDER, STATUS, SERIAL)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    device_id TEXT,
+    kind TEXT NOT NULL,
+    message TEXT NOT NULL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts, id);
+CREATE INDEX IF NOT EXISTS events_device_ts ON events (device_id, ts, id);
+CREATE INDEX IF NOT EXISTS events_kind_ts ON events (kind, ts, id);
+"""
+
+
+def encode_cursor(ts, row_id):
+    return f"{ts!r}:{row_id}"
+
+
+def decode_cursor(cursor):
+    """(ts, id) from a cursor returned by query(); ValueError if malformed"""
+    ts, _, row_id = cursor.partition(":")
+    return float(ts), int(row_id)
+
+
+class HistoryStore:
+    """Batched writer plus paginated range queries over the events table.
+
+    If the writer falls behind by more than `max_pending` events, the
+    oldest unwritten events are dropped and counted rather than growing
+    memory without bound.
+    """
+
+    def __init__(self, path, batch_size=500, flush_interval=1.0, retention_days=90.0,
+                 max_pending=50000, compact_interval=3600.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.compact_interval = compact_interval
+
+        self._pending = deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-writer")
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-reader")
+        self._write_conn = None
+        self._read_conn = None
+        self._loop = None
+        self._wakeup = None
+        self._closed = False
+
+        # Metrics
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.deleted = 0
+        self.last_flush_ms = None
+        self.last_compact_at = None
+
+        self._writer.submit(self._open).result()
+
+    # --- connections (each used only by its own executor thread) ------------
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")  # only takes effect on a new file
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL: durable at checkpoints, never corrupt
+        conn.executescript(SCHEMA)
+        conn.commit()
+        self._write_conn = conn
+
+    def _reader_conn(self):
+        if self._read_conn is None:
+            self._read_conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._read_conn.row_factory = sqlite3.Row
+        return self._read_conn
+
+    # --- writing -----------------------------------------------------------
+
+    def record(self, kind, device_id, message, data=None, ts=None):
+        """Queue one event; never blocks on the database"""
+        event = (ts if ts is not None else time.time(), device_id, kind, message,
+                 json.dumps(data) if data is not None else None)
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(event)
+            self.recorded += 1
+            full = len(self._pending) == self.batch_size
+        if full:
+            self._wake()
+
+    def _wake(self):
+        if self._loop is not None and self._wakeup is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass  # loop closed
+
+    def flush(self):
+        """Write everything pending in batches; runs on the writer thread. Returns rows written"""
+        total = 0
+        while True:
+            with self._lock:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            if not batch:
+                return total
+            started = time.perf_counter()
+            try:
+                with self._write_conn:
+                    self._write_conn.executemany(
+                        "INSERT INTO events (ts, device_id, kind, message, data) VALUES (?, ?, ?, ?, ?)", batch
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"History write failed, {len(batch)} events lost: {e}")
+                self.dropped += len(batch)
+                return total
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+            self.written += len(batch)
+            self.batches += 1
+            total += len(batch)
+
+    def compact(self, now=None):
+        """Delete events older than the retention period and return the freed pages"""
+        if not self.retention_days:
+            return 0
+        cutoff = (now if now is not None else time.time()) - self.retention_days * 86400
+        deleted = 0
+        try:
+            while True:
+                # Small chunks keep each write transaction (and reader stalls) short
+                with self._write_conn:
+                    cursor = self._write_conn.execute(
+                        "DELETE FROM events WHERE id IN (SELECT id FROM events WHERE ts < ? ORDER BY ts LIMIT 5000)",
+                        (cutoff,)
+                    )
+                deleted += cursor.rowcount
+                if cursor.rowcount < 5000:
+                    break
+            self._write_conn.execute("PRAGMA incremental_vacuum")
+            self._write_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            logger.error(f"History compaction failed: {e}")
+        self.deleted += deleted
+        self.last_compact_at = time.time()
+        if deleted:
+            logger.info(f"🧹 History: removed {deleted} events older than {self.retention_days:g} days")
+        return deleted
+
+    async def run(self):
+        """Writer task: flush every `flush_interval` (sooner when a batch fills), compact periodically"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        next_compact = 0.0
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._loop.run_in_executor(self._writer, self.flush)
+            if time.monotonic() >= next_compact:
+                await self._loop.run_in_executor(self._writer, self.compact)
+                next_compact = time.monotonic() + self.compact_interval
+
+    def close(self):
+        """Write what is pending and close both connections"""
+        self._closed = True
+        self._writer.submit(self.flush).result()
+        self._writer.submit(self._write_conn.close).result()
+        if self._read_conn is not None:
+            self._reader.submit(self._read_conn.close).result()
+        self._writer.shutdown()
+        self._reader.shutdown()
+
+    # --- reading -----------------------------------------------------------
+
+    def query(self, start=None, end=None, device_id=None, kind=None, limit=100, cursor=None):
+        """Events with start <= ts < end, oldest first.
+
+        Keyset pagination: pass the returned `next_cursor` to get the next
+        page; it is None on the last page.
+        """
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("ts < ?")
+            params.append(end)
+        if device_id is not None:
+            clauses.append("device_id = ?")
+            params.append(device_id)
+        if kind is not None:
+            clauses.append("kind = ?")
+            params.append(kind)
+        if cursor is not None:
+            ts, row_id = decode_cursor(cursor)
+            clauses.append("(ts > ? OR (ts = ? AND id > ?))")
+            params.extend((ts, ts, row_id))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader_conn().execute(
+            f"SELECT id, ts, device_id, kind, message, data FROM events {where} ORDER BY ts, id LIMIT ?",
+            (*params, limit + 1)
+        ).fetchall()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        events = [{
+            "id": row["id"],
+            "ts": row["ts"],
+            "device_id": row["device_id"],
+            "kind": row["kind"],
+            "message": row["message"],
+            "data": json.loads(row["data"]) if row["data"] else None,
+        } for row in rows]
+        return {
+            "events": events,
+            "count": len(events),
+            "next_cursor": encode_cursor(rows[-1]["ts"], rows[-1]["id"]) if more else None,
+        }
+
+    async def query_async(self, *args, **kwargs):
+        """query() on the reader thread so the event loop never waits on SQLite"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader, lambda: self.query(*args, **kwargs))
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "pending": len(self._pending),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "last_flush_ms": self.last_flush_ms,
+            "retention_days": self.retention_days,
+            "deleted": self.deleted,
+            "last_compact_at": self.last_compact_at,
+        }
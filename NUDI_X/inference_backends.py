@@ -0,0 +1,141 @@
+# inference_backends.py - Selectable model backends for CPU/GPU inference
+#
+# AI_BACKEND:
+#   default - float32 weights, device_map="auto" (original behaviour, uses GPU if present)
+#   int8    - CPU, dynamic int8 quantization of all linear layers
+#   compile - CPU, float32 with torch.compile'd forward
+#   onnx    - CPU, ONNX Runtime via optimum (pip install optimum[onnxruntime])
+#
+# Compare them on this machine:
+#   python inference_backends.py
+import os
+import sys
+import time
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("default", "int8", "compile", "onnx")
+
+
+def configure_threads(num_threads):
+    """Set the intra-op thread count for CPU inference (0 = leave torch default)"""
+    if num_threads and num_threads > 0:
+        torch.set_num_threads(num_threads)
+    return torch.get_num_threads()
+
+
+def _linearize_conv1d(model):
+    """Swap GPT-2 style Conv1D layers for nn.Linear so dynamic quantization applies.
+
+    DialoGPT/GPT-2 implement their projections with transformers' Conv1D
+    (weight shape [in, out]) which quantize_dynamic does not recognise.
+    """
+    from transformers.pytorch_utils import Conv1D
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = torch.nn.Linear(in_features, out_features)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(parent, name, linear)
+    return model
+
+
+def _load_float32(model_name, device_map):
+    from transformers import AutoModelForCausalLM
+
+    kwargs = {"torch_dtype": torch.float32, "low_cpu_mem_usage": True}
+    if device_map:
+        kwargs["device_map"] = device_map
+    return AutoModelForCausalLM.from_pretrained(model_name, **kwargs)
+
+
+def load_model_backend(model_name, backend="default"):
+    """Load model_name with the requested backend.
+
+    Returns (model, active_backend). Falls back to "default" if the
+    requested backend cannot be set up here.
+    """
+    if backend not in BACKENDS:
+        logger.warning(f"⚠️ Unknown AI_BACKEND '{backend}', using default")
+        backend = "default"
+
+    try:
+        if backend == "int8":
+            model = _linearize_conv1d(_load_float32(model_name, None))
+            model.eval()
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif backend == "compile":
+            model = _load_float32(model_name, None)
+            model.eval()
+            model.forward = torch.compile(model.forward, dynamic=True)
+        elif backend == "onnx":
+            from optimum.onnxruntime import ORTModelForCausalLM
+            model = ORTModelForCausalLM.from_pretrained(model_name, export=True)
+        else:
+            model = _load_float32(model_name, "auto")
+            model.eval()
+        return model, backend
+    except Exception as e:
+        if backend == "default":
+            raise
+        logger.warning(f"⚠️ Backend '{backend}' unavailable ({e}), falling back to default")
+        model = _load_float32(model_name, "auto")
+        model.eval()
+        return model, "default"
+
+
+def rss_mb():
+    """Current resident set size of this process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, 1)
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KB on Linux, bytes on macOS
+        return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def compare_backends(backends=BACKENDS, rounds=3):
+    """Load each backend in turn and report latency, memory and reply validity"""
+    import ai_model
+
+    results = []
+    for backend in backends:
+        ai_model.AI_BACKEND = backend
+        ai_model.MODEL_STATE = "not_loaded"
+        rss_before = rss_mb()
+        if not ai_model.load_model():
+            results.append({"backend": backend, "error": ai_model.MODEL_ERROR})
+            continue
+
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            ai_model._generate_batch(["User: something warm please\nAssistant: I'll prepare "])
+            timings.append(time.perf_counter() - started)
+
+        results.append({
+            "backend": backend,
+            "active_backend": ai_model.ACTIVE_BACKEND,
+            "avg_reply_ms": round(sum(timings) / len(timings) * 1000, 1),
+            "rss_delta_mb": round(rss_mb() - rss_before, 1),
+            "check": ai_model.BACKEND_CHECK,
+        })
+        ai_model.model = None
+        ai_model.AI_LOADED = False
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    selected = sys.argv[1:] or BACKENDS
+    for row in compare_backends(selected):
+        print(row)
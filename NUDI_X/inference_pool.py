@@ -0,0 +1,159 @@
+# inference_pool.py - Run blocking model inference off the asyncio event loop
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the inference pool has no room for another request"""
+
+
+class InferencePool:
+    """Bounded executor for blocking inference calls.
+
+    At most `max_workers` calls run at once and at most `max_queue` more
+    wait behind them; anything beyond that is rejected immediately so the
+    caller can answer 429 instead of piling up work.
+    """
+
+    def __init__(self, kind="thread", max_workers=8, max_queue=16, timeout=30.0):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown inference executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self.timeout = timeout
+
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="inference"
+            )
+
+        self._stream_executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._failed = 0
+
+    @property
+    def capacity(self):
+        return self.max_workers + self.max_queue
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self._failed += 1
+            else:
+                self._completed += 1
+
+    async def run(self, fn, *args, timeout=None, executor=None):
+        """Run fn(*args) in the pool and await its result.
+
+        Raises InferenceQueueFull when the pool is saturated and
+        asyncio.TimeoutError when the call exceeds its timeout.
+        """
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self._rejected += 1
+                raise InferenceQueueFull(f"Inference queue full ({self._in_flight}/{self.capacity})")
+            self._in_flight += 1
+
+        try:
+            future = (executor or self._executor).submit(fn, *args)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        # The slot is held until the worker is actually done, even if the
+        # caller gives up earlier, so timed-out work still counts as load
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future),
+                timeout if timeout is not None else self.timeout
+            )
+        except asyncio.TimeoutError:
+            # Drops the call if it never started; a running call finishes in the background
+            future.cancel()
+            with self._lock:
+                self._timeouts += 1
+            raise
+
+    async def stream(self, gen_fn, *args, timeout=None):
+        """Async-iterate a blocking generator gen_fn(*args, cancelled=Event).
+
+        The generator runs on a pool thread and shares the same capacity
+        limits as `run`. Process pools cannot stream across processes, so
+        streaming always runs on a thread.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        cancelled = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for item in gen_fn(*args, cancelled=cancelled):
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        if self.kind == "process":
+            if self._stream_executor is None:
+                self._stream_executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="inference-stream"
+                )
+            executor = self._stream_executor
+        else:
+            executor = self._executor
+
+        task = asyncio.ensure_future(self.run(produce, timeout=timeout, executor=executor))
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                finished, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in finished:
+                    getter.cancel()
+                    await task  # raises the producer's error or timeout
+                    break
+                item = getter.result()
+                if item is done:
+                    await task
+                    break
+                yield item
+        finally:
+            cancelled.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "timeout_seconds": self.timeout,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._stream_executor is not None:
+            self._stream_executor.shutdown(wait=False, cancel_futures=True)
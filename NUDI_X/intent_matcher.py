@@ -0,0 +1,83 @@
+# intent_matcher.py - Single-pass keyword intent matching
+import re
+from typing import NamedTuple, Optional
+
+from menu import NOODLE_MAP
+
+
+class IntentMatch(NamedTuple):
+    reply: str
+    noodle_name: Optional[str]
+    noodle_code: Optional[str]
+    source: str  # "menu", "keyword", "model", "cache", "semantic", "fallback"
+    confidence: Optional[float] = None  # menu scoring: probability of the chosen item
+
+
+def _alternation(words):
+    # Longest first so "vegetarian" wins over "veg" at the same position
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+class IntentMatcher:
+    """Match a message against all keywords and menu names in one regex pass.
+
+    Keywords are matched on word boundaries (with an optional plural "s"/"es"),
+    so "hot" no longer fires on "hotel" while "noodle" still matches
+    "noodles". When several keywords appear, the one listed first in
+    `keyword_replies` wins; an explicit menu name beats any keyword.
+    """
+
+    def __init__(self, keyword_replies, noodle_map=NOODLE_MAP):
+        self.noodle_map = dict(noodle_map)
+
+        # Menu names resolve a reply to (name, code) without rescanning it
+        self._noodle_pattern = re.compile(
+            r"\b(" + _alternation(n.lower() for n in self.noodle_map) + r")\b",
+            re.IGNORECASE
+        )
+        self._noodle_by_lower = {n.lower(): n for n in self.noodle_map}
+
+        # keyword (lowercase) -> (priority, IntentMatch)
+        self._entries = {}
+        for priority, (keyword, reply) in enumerate(keyword_replies.items(), start=1):
+            noodle_name, noodle_code = self.find_noodle(reply)
+            self._entries.setdefault(keyword.lower(), (priority, IntentMatch(reply, noodle_name, noodle_code, "keyword")))
+
+        # Menu names get top priority and reuse the first keyword reply for that item
+        for name, code in self.noodle_map.items():
+            reply = next(
+                (intent.reply for _, intent in self._entries.values() if intent.noodle_code == code),
+                f"I'll prepare {name} for you!"
+            )
+            self._entries[name.lower()] = (0, IntentMatch(reply, name, code, "menu"))
+
+        self._pattern = re.compile(
+            r"\b(" + _alternation(self._entries) + r")(?:e?s)?\b",
+            re.IGNORECASE
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def match(self, message) -> Optional[IntentMatch]:
+        """Best intent for message, or None when nothing matches"""
+        best = None
+        for m in self._pattern.finditer(message):
+            priority, intent = self._entries[m.group(1).lower()]
+            if best is None or priority < best[0]:
+                best = (priority, intent)
+                if priority == 0:
+                    break
+        return best[1] if best else None
+
+    def menu_reply(self, noodle_name):
+        """Reply template used when noodle_name is chosen without a keyword"""
+        return self._entries[noodle_name.lower()][1].reply
+
+    def find_noodle(self, text):
+        """(noodle_name, noodle_code) of the first menu item named in text"""
+        m = self._noodle_pattern.search(text)
+        if not m:
+            return None, None
+        name = self._noodle_by_lower[m.group(1).lower()]
+        return name, self.noodle_map[name]
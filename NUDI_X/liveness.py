@@ -0,0 +1,163 @@
+# liveness.py - Heartbeat deadlines: alive -> stale -> offline without polling
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+ALIVE, STALE, OFFLINE = "alive", "stale", "offline"
+
+
+class LivenessTracker:
+    """Tracks when each device was last heard from.
+
+    Every heartbeat (or any other message) pushes the device's next deadline
+    onto a heap; one timer task sleeps until the earliest deadline, so cost
+    does not grow with the number of devices. Older heap entries are left in
+    place and skipped when popped (their generation no longer matches).
+
+    Listeners get (device_id, old, new, last_seen) on every transition,
+    from whichever thread caused it.
+    """
+
+    def __init__(self, stale_after=45.0, offline_after=120.0, max_sleep=5.0):
+        self.stale_after = stale_after
+        self.offline_after = offline_after
+        self.max_sleep = max_sleep
+        self._lock = threading.Lock()
+        self._heap = []  # (deadline, seq, device_id, generation)
+        self._seq = itertools.count()
+        self._generation = {}
+        self._last_seen = {}
+        self._grace = {}
+        self._state = {}
+        self._listeners = []
+        self._transitions = 0
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _emit(self, changes):
+        for device_id, old, new, last_seen in changes:
+            self._transitions += 1
+            for listener in self._listeners:
+                try:
+                    listener(device_id, old, new, last_seen)
+                except Exception as e:
+                    logger.error(f"Liveness listener failed: {e}")
+
+    def _schedule(self, device_id, deadline):
+        heapq.heappush(self._heap, (deadline, next(self._seq), device_id, self._generation[device_id]))
+
+    def beat(self, device_id, now=None, grace=0.0):
+        """Record a sign of life; `grace` extends the deadline (e.g. while dispensing)"""
+        now = now if now is not None else time.time()
+        changes = []
+        with self._lock:
+            self._generation[device_id] = self._generation.get(device_id, 0) + 1
+            self._last_seen[device_id] = now
+            self._grace[device_id] = grace
+            old = self._state.get(device_id)
+            if old != ALIVE:
+                self._state[device_id] = ALIVE
+                changes.append((device_id, old, ALIVE, now))
+            self._schedule(device_id, now + self.stale_after + grace)
+        self._emit(changes)
+
+    def mark_offline(self, device_id):
+        """Device announced it is gone (e.g. its MQTT last will)"""
+        changes = []
+        with self._lock:
+            self._generation[device_id] = self._generation.get(device_id, 0) + 1
+            old = self._state.get(device_id)
+            if old != OFFLINE:
+                self._state[device_id] = OFFLINE
+                changes.append((device_id, old, OFFLINE, self._last_seen.get(device_id)))
+        self._emit(changes)
+
+    def restore(self, device_id, state, last_seen):
+        """Set a replicated state without notifying listeners.
+
+        The deadline is scheduled as if the leader had applied it, so a
+        follower promoted to leader carries on ageing the device.
+        """
+        with self._lock:
+            self._generation[device_id] = self._generation.get(device_id, 0) + 1
+            self._state[device_id] = state
+            self._grace[device_id] = 0.0
+            if last_seen is None:
+                return
+            self._last_seen[device_id] = last_seen
+            if state == ALIVE:
+                self._schedule(device_id, last_seen + self.stale_after)
+            elif state == STALE:
+                self._schedule(device_id, last_seen + self.offline_after)
+
+    def check(self, now=None):
+        """Apply every deadline that has passed; returns seconds until the next one"""
+        now = now if now is not None else time.time()
+        changes = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, device_id, generation = heapq.heappop(self._heap)
+                if generation != self._generation.get(device_id):
+                    continue  # superseded by a newer heartbeat
+                state = self._state.get(device_id)
+                last_seen = self._last_seen[device_id]
+                if state == ALIVE:
+                    self._state[device_id] = STALE
+                    changes.append((device_id, ALIVE, STALE, last_seen))
+                    self._schedule(device_id, last_seen + self.offline_after + self._grace[device_id])
+                elif state == STALE:
+                    self._state[device_id] = OFFLINE
+                    changes.append((device_id, STALE, OFFLINE, last_seen))
+            delay = self._heap[0][0] - now if self._heap else None
+        self._emit(changes)
+        return delay
+
+    def state(self, device_id):
+        return self._state.get(device_id)
+
+    def last_seen(self, device_id):
+        return self._last_seen.get(device_id)
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            return {
+                device_id: {
+                    "state": state,
+                    "seconds_since_seen": round(now - self._last_seen[device_id], 2)
+                    if device_id in self._last_seen else None
+                }
+                for device_id, state in self._state.items()
+            }
+
+    def stats(self):
+        with self._lock:
+            counts = {ALIVE: 0, STALE: 0, OFFLINE: 0}
+            for state in self._state.values():
+                counts[state] += 1
+            return {
+                **counts,
+                "tracked": len(self._state),
+                "pending_deadlines": len(self._heap),
+                "transitions": self._transitions,
+                "stale_after": self.stale_after,
+                "offline_after": self.offline_after,
+            }
+
+    async def run(self):
+        """Timer task: sleep until the earliest deadline and apply it"""
+        while True:
+            try:
+                delay = self.check()
+            except Exception as e:
+                logger.error(f"Error in liveness tracker: {e}")
+                delay = None
+            if delay is None:
+                delay = self.max_sleep
+            await asyncio.sleep(min(max(delay, 0.05), self.max_sleep))
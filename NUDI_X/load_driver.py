@@ -0,0 +1,187 @@
+# load_driver.py - Generate /chat and /manual_dispense traffic against a running server
+#
+#   python load_driver.py --url http://127.0.0.1:8000 --rate 20 --duration 60
+#
+# Open-loop: requests start on a Poisson schedule at --rate per second no
+# matter how slowly the server answers, so queueing shows up as latency
+# instead of being hidden by a fixed number of clients.
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+CHAT_MESSAGES = [
+    "I'm freezing, something hot please",
+    "I want something spicy",
+    "chicken noodles please",
+    "I'd like cheese noodles",
+    "something light and vegetarian",
+    "I'm exhausted after work",
+    "what do you recommend?",
+    "I'm starving",
+    "give me the creamy one",
+    "veg soup",
+]
+
+
+def _post(url, body, headers=None, timeout=60.0):
+    data = json.dumps(body).encode()
+    request = urllib.request.Request(
+        url, data=data, method="POST",
+        headers={"Content-Type": "application/json", **(headers or {})}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status, json.loads(response.read() or b"null")
+
+
+def _get(url, timeout=10.0):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class LoadDriver:
+    def __init__(self, url, rate=10.0, duration=30.0, manual_share=0.2, double_tap_rate=0.1,
+                 devices=None, concurrency=256):
+        self.url = url.rstrip("/")
+        self.rate = rate
+        self.duration = duration
+        self.manual_share = manual_share
+        self.double_tap_rate = double_tap_rate
+        self.devices = devices or []
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self.results = {}  # endpoint -> list of (latency_s, status, success)
+
+    def _record(self, endpoint, latency, status, success):
+        with self._lock:
+            self.results.setdefault(endpoint, []).append((latency, status, success))
+
+    def _timed(self, endpoint, url, body, headers=None):
+        started = time.perf_counter()
+        try:
+            status, data = _post(url, body, headers)
+            success = bool(data and data.get("success"))
+        except urllib.error.HTTPError as e:
+            status, success = e.code, False
+        except Exception:
+            status, success = 0, False
+        self._record(endpoint, time.perf_counter() - started, status, success)
+
+    def _chat(self):
+        body = {"user_message": random.choice(CHAT_MESSAGES)}
+        if self.devices:
+            body["device_id"] = random.choice(self.devices)
+        else:
+            body["latitude"] = 6.9 + random.uniform(-0.1, 0.1)
+            body["longitude"] = 79.86 + random.uniform(-0.1, 0.1)
+        self._timed("chat", f"{self.url}/chat", body)
+
+    def _manual(self):
+        body = {"noodle_number": random.randint(1, 4), "idempotency_key": uuid.uuid4().hex}
+        if self.devices:
+            body["device_id"] = random.choice(self.devices)
+        self._timed("manual_dispense", f"{self.url}/manual_dispense", body)
+
+    def _manual_double_tap(self, pool):
+        """Same key sent twice in quick succession; the server should create one order"""
+        body = {"noodle_number": random.randint(1, 4), "idempotency_key": uuid.uuid4().hex}
+        if self.devices:
+            body["device_id"] = random.choice(self.devices)
+        for _ in range(2):
+            pool.submit(self._timed, "manual_double_tap", f"{self.url}/manual_dispense", body)
+
+    def run(self):
+        started = time.perf_counter()
+        sent = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            next_at = started
+            while next_at - started < self.duration:
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if random.random() < self.manual_share:
+                    if random.random() < self.double_tap_rate:
+                        self._manual_double_tap(pool)
+                    else:
+                        pool.submit(self._manual)
+                else:
+                    pool.submit(self._chat)
+                sent += 1
+                next_at += random.expovariate(self.rate)
+        return self.report(time.perf_counter() - started, sent)
+
+    def report(self, elapsed, sent):
+        endpoints = {}
+        for endpoint, rows in self.results.items():
+            latencies = sorted(r[0] * 1000 for r in rows)
+            statuses = {}
+            for _, status, _ in rows:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            endpoints[endpoint] = {
+                "requests": len(rows),
+                "success": sum(1 for r in rows if r[2]),
+                "status_codes": statuses,
+                "p50_ms": round(percentile(latencies, 0.50), 1),
+                "p95_ms": round(percentile(latencies, 0.95), 1),
+                "p99_ms": round(percentile(latencies, 0.99), 1),
+                "max_ms": round(latencies[-1], 1),
+            }
+        completed = sum(len(rows) for rows in self.results.values())
+        return {
+            "target_rate": self.rate,
+            "scheduled": sent,
+            "completed": completed,
+            "elapsed_seconds": round(elapsed, 2),
+            "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop HTTP load for the noodle server")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rate", type=float, default=10.0, help="requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--manual-share", type=float, default=0.2, help="fraction of requests that are /manual_dispense")
+    parser.add_argument("--double-tap-rate", type=float, default=0.1, help="fraction of manual requests sent twice with one key")
+    parser.add_argument("--devices", default="", help="comma-separated device ids (default: route by location)")
+    parser.add_argument("--drain", type=float, default=0, help="seconds to wait for the order queue to empty afterwards")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    devices = [d for d in args.devices.split(",") if d]
+    driver = LoadDriver(args.url, args.rate, args.duration, args.manual_share, args.double_tap_rate, devices)
+    report = driver.run()
+
+    deadline = time.time() + args.drain
+    while True:
+        try:
+            report["orders"] = _get(f"{args.url.rstrip('/')}/orders?limit=1")["stats"]
+        except Exception as e:
+            report["orders"] = {"error": str(e)}
+            break
+        if time.time() >= deadline or not report["orders"].get("depth"):
+            break
+        time.sleep(1)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# log_store.py - Fixed-capacity ring buffer for log lines with sequence numbers
+import threading
+
+
+class LogStore:
+    """Ring buffer of log lines, each tagged with a monotonically increasing seq.
+
+    Appends are O(1) and overwrite the oldest entry once full. Readers use
+    `since(seq)` to fetch only entries newer than the last one they saw.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = max(1, int(capacity))
+        self._buf = [None] * self.capacity
+        self._next_seq = 1  # seq of the next appended entry
+        self._start_seq = 1  # seq of the first entry since creation or a replica gap
+        self._lock = threading.Lock()
+
+    def append(self, entry, seq=None):
+        """Store entry and return its sequence number.
+
+        Replicas pass the leader's `seq` so cursors are valid on every
+        worker; a seq that is not the next one (entries were missed)
+        drops what is held and continues from there.
+        """
+        with self._lock:
+            if seq is not None and seq != self._next_seq:
+                self._buf = [None] * self.capacity
+                self._next_seq = self._start_seq = seq
+            seq = self._next_seq
+            self._buf[seq % self.capacity] = entry
+            self._next_seq = seq + 1
+            return seq
+
+    @property
+    def last_seq(self):
+        """Sequence number of the newest entry (0 when empty)"""
+        return self._next_seq - 1
+
+    @property
+    def first_seq(self):
+        """Sequence number of the oldest entry still held"""
+        return max(self._start_seq, self._next_seq - self.capacity)
+
+    def __len__(self):
+        return min(self._next_seq - self._start_seq, self.capacity)
+
+    def since(self, seq=0, limit=None):
+        """Entries with sequence number > seq, oldest first, as (seq, entry) pairs"""
+        with self._lock:
+            start = max(seq + 1, self.first_seq)
+            end = self._next_seq
+            if limit is not None:
+                end = min(end, start + max(0, limit))
+            return [(s, self._buf[s % self.capacity]) for s in range(start, end)]
+
+    def tail(self, n):
+        """Newest n entries, oldest first, as (seq, entry) pairs"""
+        with self._lock:
+            start = max(self._next_seq - n, self.first_seq)
+            return [(s, self._buf[s % self.capacity]) for s in range(start, self._next_seq)]
+
+    def stats(self):
+        return {
+            "count": len(self),
+            "capacity": self.capacity,
+            "first_seq": self.first_seq if len(self) else None,
+            "last_seq": self.last_seq,
+        }
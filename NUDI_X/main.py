@@ -1,15 +1,36 @@
 # main.py (UPDATED with better MQTT and error handling)
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
+from typing import Optional
 import paho.mqtt.client as mqtt
 import json
+import os
 import asyncio
 import threading
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 
+from inference_pool import InferencePool, InferenceQueueFull
+from log_store import LogStore
+from broadcaster import Broadcaster, DROPPED
+from fleet import FleetRegistry, DEFAULT_DEVICE_ID, device_topic, fleet_subscriptions, parse_topic
+from order_queue import OrderQueue, Dispatcher, SENT, FAILED
+from liveness import LivenessTracker, ALIVE, STALE, OFFLINE
+from mqtt_publisher import AckPublisher, PublishResult
+from emergency import EmergencyStopper, ACKED
+from history_store import HistoryStore, KINDS as HISTORY_KINDS, ORDER, STATUS, SERIAL
+from mqtt_ingest import IngestQueue, TopicClassifier, ClockText, RateLimitedLog, SERIAL_PATTERN
+from cluster import LeaderLock, LeaderServer, LeaderClient, LeaderUnavailable, Follower, SQLiteState
+from metrics import (
+    REGISTRY, HTTP_REQUEST_SECONDS, MQTT_MESSAGES_IN, MQTT_MESSAGES_OUT, MQTT_ON_MESSAGE_SECONDS, MQTT_INGEST_SECONDS,
+    monitor_event_loop_lag, uptime_seconds
+)
+from menu import NOODLE_MAP, NOODLE_REVERSE_MAP
+from intent_matcher import IntentMatcher, IntentMatch
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,101 +46,443 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Per-route latency histogram (route template, so /orders/{order_id} is one series)"""
+    started = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(
+            getattr(route, "path", "unmatched"), request.method, status
+        ).observe(time.perf_counter() - started)
+
+async def forward_to_leader(request: Request, call_next):
+    """Followers answer replicated reads themselves and forward everything else to the leader"""
+    if IS_LEADER or request.url.path in FOLLOWER_LOCAL_ROUTES:
+        return await call_next(request)
+    try:
+        status, headers, body = await leader_client.request(
+            request.method, request.url.path, request.url.query, request.headers.items(), await request.body(),
+            (request.client.host, request.client.port) if request.client else None
+        )
+    except LeaderUnavailable as e:
+        return JSONResponse({"detail": f"Leader unavailable, retry shortly ({e})"}, status_code=503)
+    response = StreamingResponse(body, status_code=status)  # SSE chunks pass straight through
+    response.raw_headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+    return response
+
+# Wearable telemetry needs numpy; the vending server runs without it
+try:
+    from cooling_model import load_or_train as load_cooling_model
+    from wearable_telemetry import TelemetryIngest, wearable_subscriptions, wearable_topic, parse_wearable_topic
+    WEARABLE_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"⚠️ Wearable telemetry not available: {e}")
+    WEARABLE_AVAILABLE = False
+
+# Runtime files (order journal, history, trained cooling model, cluster lock and
+# state) default to DATA_DIR. They are opened at startup, never on import
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
 # MQTT Configuration - USE SAME BROKER AS ESP32
-MQTT_BROKER = "broker.hivemq.com"  # Public broker, works better than EMQX
-MQTT_PORT = 1883
+# Set MQTT_BROKER=127.0.0.1 to use mini_broker.py / device_simulator.py offline
+MQTT_BROKER = os.getenv("MQTT_BROKER", "broker.hivemq.com")  # Public broker, works better than EMQX
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 MQTT_TOPIC_COMMAND = "noodle_vending/command"
 MQTT_TOPIC_STATUS = "noodle_vending/status"
 MQTT_TOPIC_LOG = "noodle_vending/log"
+MQTT_TOPIC_DROP = "noodle_vending/drop_detected"
+MQTT_TOPIC_HEARTBEAT = "noodle_vending/heartbeat"
+# Server presence: "online" / "server_disconnected" (last will), retained. Kept off
+# the status topic so it never overwrites a device's "offline" will or reads as a heartbeat
+MQTT_TOPIC_SERVER_STATUS = "noodle_vending/server_status"
+
+# Emergency stop priority lane: own connection, QoS 2, retried until the
+# device answers on noodle_vending/[<device_id>/]emergency_ack
+EMERGENCY_RETRY_INTERVAL = float(os.getenv("EMERGENCY_RETRY_INTERVAL", "0.5"))
+EMERGENCY_DEADLINE = float(os.getenv("EMERGENCY_DEADLINE", "10"))
+
+# Publish acknowledgement tracking (PUBACK), see mqtt_publisher.py
+MQTT_INFLIGHT_WINDOW = int(os.getenv("MQTT_INFLIGHT_WINDOW", "32"))
+MQTT_ACK_TIMEOUT = float(os.getenv("MQTT_ACK_TIMEOUT", "5"))
+MQTT_PUBLISH_RETRIES = int(os.getenv("MQTT_PUBLISH_RETRIES", "2"))
+
+# Inbound MQTT is queued off paho's network thread, see mqtt_ingest.py
+MQTT_INGEST_QUEUE_SIZE = int(os.getenv("MQTT_INGEST_QUEUE_SIZE", "10000"))
+MQTT_LOG_RATE = int(os.getenv("MQTT_LOG_RATE", "5"))  # "📨 MQTT" INFO lines per second
+
+# Liveness: devices publish a heartbeat (their status) every ~15 s and set
+# a retained "offline" last will; silence moves them to stale, then offline
+HEARTBEAT_STALE_AFTER = float(os.getenv("HEARTBEAT_STALE_AFTER", "45"))
+HEARTBEAT_OFFLINE_AFTER = float(os.getenv("HEARTBEAT_OFFLINE_AFTER", "120"))
+# Statuses the server sets itself; replaced once the machine reports
+SERVER_PLACEHOLDER_STATUSES = ("disconnected", "connecting", "mqtt_error", "mqtt_disconnected")
+
+# Fleet mode: also serve machines on noodle_vending/<device_id>/<topic>
+FLEET_MODE = os.getenv("FLEET_MODE", "0") == "1"
+FLEET_TOPIC_KINDS = ["status", "log", "location", "drop_detected", "heartbeat"]
+
+# Cooling wearables: wearable/<device_id>/telemetry in, wearable/<device_id>/cooling out
+WEARABLE_TELEMETRY = os.getenv("WEARABLE_TELEMETRY", "1") == "1"
+WEARABLE_WINDOW = int(os.getenv("WEARABLE_WINDOW", "60"))  # readings per sliding window
+WEARABLE_EVAL_INTERVAL = float(os.getenv("WEARABLE_EVAL_INTERVAL", "1"))  # seconds between classifications
+WEARABLE_MIN_SWITCH_SECONDS = float(os.getenv("WEARABLE_MIN_SWITCH_SECONDS", "10"))
+COOLING_MODEL_PATH = os.getenv("COOLING_MODEL_PATH", os.path.join(DATA_DIR, "cooling_model.json"))  # "" = train, don't save
+
+# Log buffers (ring buffers, oldest entries are overwritten)
+SYSTEM_LOG_CAPACITY = int(os.getenv("SYSTEM_LOG_CAPACITY", "5000"))
+SERIAL_LOG_CAPACITY = int(os.getenv("SERIAL_LOG_CAPACITY", "10000"))
+
+# WebSocket push: per-client queue size before a slow client is dropped
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+WS_PING_INTERVAL = 20  # seconds
+
+# Order queue: orders wait here until their machine reports "ready"
+ORDER_JOURNAL_PATH = os.getenv("ORDER_JOURNAL_PATH", os.path.join(DATA_DIR, "orders.jsonl"))  # "" = in-memory only
+ORDER_ACK_TIMEOUT = float(os.getenv("ORDER_ACK_TIMEOUT", "10"))  # sent -> dispensing
+ORDER_DISPENSE_TIMEOUT = float(os.getenv("ORDER_DISPENSE_TIMEOUT", "300"))  # dispensing -> ready
+ORDER_JOURNAL_COMPACT_AFTER = int(os.getenv("ORDER_JOURNAL_COMPACT_AFTER", "1000"))  # finished orders between rewrites
+MANUAL_DEDUPE_SECONDS = 3.0  # repeated manual taps for the same noodle count once
+
+# History: orders, status transitions and serial output in SQLite, see history_store.py
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", os.path.join(DATA_DIR, "history.db"))  # "" = disabled
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "90"))
+
+# Multi-worker: CLUSTER_MODE=1 uvicorn main:app --workers N (see cluster.py)
+# One worker leads (MQTT, model, orders, timers); the others serve reads
+# from replicated state and forward every other request to it
+CLUSTER_MODE = os.getenv("CLUSTER_MODE", "0") == "1"
+CLUSTER_DIR = os.getenv("CLUSTER_DIR", os.path.join(DATA_DIR, "cluster"))  # lock file, leader socket, shared state
+CLUSTER_RETRY_SECONDS = float(os.getenv("CLUSTER_RETRY_SECONDS", "1"))  # followers retry the lock
+CLUSTER_SOCKET = os.path.join(CLUSTER_DIR, "leader.sock")
+# Answered by followers from replicated state; /ws is always local
+FOLLOWER_LOCAL_ROUTES = {
+    "/", "/status", "/wait_for_status", "/devices", "/logs", "/serial-logs", "/history",
+    "/metrics", "/cluster", "/test-cors",
+}
+if CLUSTER_MODE:  # single-process servers skip the extra middleware
+    app.middleware("http")(forward_to_leader)
+
+# Inference executor - keeps model generation off the event loop
+# INFERENCE_EXECUTOR: "thread" or "process"
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "8"))  # >= AI_BATCH_MAX_SIZE so batches can fill
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "16"))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "30"))
+
+inference_pool = InferencePool(
+    kind=INFERENCE_EXECUTOR,
+    max_workers=INFERENCE_WORKERS,
+    max_queue=INFERENCE_QUEUE_SIZE,
+    timeout=INFERENCE_TIMEOUT
+)
 
 # Global state
 mqtt_client = None
-mqtt_connected = False
-device_status = "disconnected"
-last_status_update = None
-system_logs = []
-active_connections = []
-serial_logs = []  # Store serial monitor output
+mqtt_link = threading.Event()  # set while the server is connected to the broker
+publisher = AckPublisher(MQTT_INFLIGHT_WINDOW, MQTT_ACK_TIMEOUT, MQTT_PUBLISH_RETRIES)
+control_client = None  # dedicated connection for emergency stops
+control_link = threading.Event()
+control_publisher = AckPublisher(window=8, timeout=EMERGENCY_DEADLINE, retries=0)
+fleet = FleetRegistry()  # DeviceState per machine, written by MQTT callbacks
+device = fleet.get_or_create(DEFAULT_DEVICE_ID)  # legacy single machine
+system_logs = LogStore(SYSTEM_LOG_CAPACITY)
+broadcaster = Broadcaster(WS_QUEUE_SIZE)  # Pushes status/log events to /ws clients
+serial_logs = LogStore(SERIAL_LOG_CAPACITY)  # Store serial monitor output
+order_queue = OrderQueue(
+    journal_path=None,  # opened by the leader in start_controller
+    ack_timeout=ORDER_ACK_TIMEOUT,
+    dispense_timeout=ORDER_DISPENSE_TIMEOUT,
+    compact_after=ORDER_JOURNAL_COMPACT_AFTER
+)
+liveness = LivenessTracker(HEARTBEAT_STALE_AFTER, HEARTBEAT_OFFLINE_AFTER)
+history = None  # HistoryStore, opened at startup
+
+# Cluster roles; without CLUSTER_MODE this process is the only one and leads
+IS_LEADER = not CLUSTER_MODE
+leader_lock = LeaderLock(os.path.join(CLUSTER_DIR, "leader.lock")) if CLUSTER_MODE else None
+shared_state = None  # SQLiteState, opened at startup
+leader_server = None  # leader: runs requests forwarded by followers
+leader_client = None  # follower: forwards requests to the leader
+replica = None  # follower: applies the leader's state changes
 
 # MQTT Callbacks
 def on_connect(client, userdata, flags, rc):
-    global mqtt_connected, device_status, last_status_update
     if rc == 0:
         logger.info("✅ Connected to MQTT Broker!")
-        mqtt_connected = True
-        device_status = "ready"  # Initialize status
-        last_status_update = time.time()  # Set initial timestamp
+        set_mqtt_link(True)
+        if device.status in SERVER_PLACEHOLDER_STATUSES:
+            # Only the machine says it is ready: its retained status or a probe reply
+            device.set_status("waiting_for_device")
         client.subscribe(MQTT_TOPIC_STATUS)
         client.subscribe(MQTT_TOPIC_LOG)
-        # Publish initial status
-        client.publish(MQTT_TOPIC_STATUS, "ready", qos=1, retain=True)
+        client.subscribe(MQTT_TOPIC_DROP)
+        client.subscribe(MQTT_TOPIC_HEARTBEAT)
+        if FLEET_MODE:
+            for topic in fleet_subscriptions(FLEET_TOPIC_KINDS):
+                client.subscribe(topic)
+        if telemetry is not None:
+            for topic in wearable_subscriptions():
+                client.subscribe(topic)
+        # Announce the server on its own topic
+        client.publish(MQTT_TOPIC_SERVER_STATUS, "online", qos=1, retain=True)
     else:
         logger.error(f"❌ Failed to connect to MQTT, return code {rc}")
-        mqtt_connected = False
-        device_status = "mqtt_error"
+        set_mqtt_link(False)
+        if not device.set_status("mqtt_error"):
+            publish_status()
 
 def on_disconnect(client, userdata, rc):
-    global mqtt_connected
     logger.warning(f"MQTT disconnected, rc={rc}")
-    mqtt_connected = False
+    set_mqtt_link(False)
+    publish_status()
+
+def set_mqtt_link(connected):
+    if connected:
+        mqtt_link.set()
+    else:
+        mqtt_link.clear()
+    replicate({"type": "link", "connected": connected}, "link")
+
+def topic_pattern(device_id, kind):
+    """Metric label for a topic; fleet devices share one series per kind"""
+    if device_id is None:
+        return "other"
+    return device_topic(device_id if device_id == DEFAULT_DEVICE_ID else "+", kind)
 
 def on_message(client, userdata, msg):
-    global device_status, last_status_update, system_logs
+    """paho network thread: classify, timestamp and queue; handle_message does the rest"""
+    started = time.perf_counter()
+    route = topics.classify(msg.topic)
+    route.counter.inc()
+    ingest.put(route, msg.payload, time.time(), retained=bool(msg.retain))
+    MQTT_ON_MESSAGE_SECONDS.observe(time.perf_counter() - started)
+
+def handle_message(route, raw, received_at, retained=False):
+    """Ingest worker: apply one device message (status, log, drop, heartbeat, location).
     
+    A retained message is the broker replaying the last known value on
+    subscribe, not the device talking now, so it never counts as a heartbeat.
+    """
+    started = time.perf_counter()
     try:
-        topic = msg.topic
-        payload = msg.payload.decode()
-        timestamp = datetime.now().strftime("%H:%M:%S")
+        payload = raw.decode()
+        timestamp = clock_text(received_at)
+        
+        skipped = mqtt_log_limit.allow()
+        if skipped is not None:
+            note = f" ({skipped} messages not logged)" if skipped else ""
+            logger.info(f"📨 MQTT: [{route.topic}] {payload}{note}")
         
-        logger.info(f"📨 MQTT: [{topic}] {payload}")
+        device_id, kind, prefix = route.device_id, route.kind, route.prefix
         
-        if topic == MQTT_TOPIC_STATUS:
-            device_status = payload
-            last_status_update = time.time()
+        if kind == "status" and payload == "offline":
+            # Retained last will: the broker lost the device's connection
+            liveness.mark_offline(device_id)
+            fleet.get_or_create(device_id).set_status("offline")
+            add_log("DEVICE", prefix + "offline (last will)", timestamp)
+            return
+        if kind == "status" and payload == "server_disconnected":
+            return  # retained will of servers that announced themselves on the status topic
+        live = device_id is not None and not retained
+        if live and kind not in ("status", "heartbeat"):
+            record_heartbeat(device_id)  # any message is a sign of life
+        
+        if kind == "heartbeat":
+            # Heartbeats carry the current status, so a missed transition heals itself
+            fleet.get_or_create(device_id).set_status(payload)
+            if live:
+                record_heartbeat(device_id)
+            return
+        
+        if kind == "status":
+            if payload.startswith("emergency"):
+                stopper.on_ack(device_id)  # firmware without emergency_ack
+            fleet.get_or_create(device_id).set_status(payload)  # listeners push the change to /ws
+            if live:
+                record_heartbeat(device_id)
             
             # Log status changes
             if "dispensing" in payload or "ready" in payload or "busy" in payload:
-                add_log("DEVICE", payload)
+                add_log("DEVICE", prefix + payload, timestamp)
                 
-        elif topic == MQTT_TOPIC_LOG:
-            add_log("SYSTEM", payload)
+        elif kind == "log":
+            add_log("SYSTEM", prefix + payload, timestamp)
+        
+        elif kind == "drop_detected":
+            order_queue.on_drop_event(device_id, payload)
+            add_log("DROP", prefix + payload, timestamp)
             
-        # Capture all serial output from ESP32 (any topic containing debug/serial info)
-        if any(x in payload for x in ["✅", "❌", "📨", "📡", "📏", "🍜", "⚠️", "Dispensing", "Distance:", "DROP", "connected"]):
-            add_serial_log(payload)
+        elif kind == "location" and device_id != DEFAULT_DEVICE_ID:
+            lat, lon = payload.split(",", 1)
+            set_location(device_id, lat, lon)
+            return
             
-    except Exception as e:
-        logger.error(f"Error processing MQTT message: {e}")
+        # Capture all serial output from ESP32 (any topic containing debug/serial info)
+        if SERIAL_PATTERN.search(payload):
+            add_serial_log(payload, timestamp)
+            if history is not None:
+                history.record(SERIAL, device_id, payload, ts=received_at)
+    finally:
+        MQTT_INGEST_SECONDS.observe(time.perf_counter() - started)
+
+topics = TopicClassifier(topic_pattern, MQTT_MESSAGES_IN)
+ingest = IngestQueue(handle_message, MQTT_INGEST_QUEUE_SIZE)
+mqtt_log_limit = RateLimitedLog(MQTT_LOG_RATE)
+clock_text = ClockText()
+
+def record_heartbeat(device_id):
+    """Push the device's liveness deadline; dispensing blocks the ESP32 loop, so allow longer"""
+    state = fleet.get(device_id)
+    dispensing = state is not None and str(state.status).startswith("dispensing")
+    liveness.beat(device_id, grace=ORDER_DISPENSE_TIMEOUT if dispensing else 0.0)
+
+def probe_device(device_id):
+    """Fallback probe: ask one device to report its status"""
+    return mqtt_publish(device_topic(device_id, "command"), "status")
+
+def on_liveness(device_id, old, new, last_seen):
+    """Liveness transitions become log lines and /ws events"""
+    event = {
+        "type": "liveness", "device_id": device_id,
+        "from": old, "to": new, "last_seen": last_seen
+    }
+    broadcaster.publish(event)
+    replicate(event, f"liveness/{device_id}")
+    fleet.set_reachable(device_id, new == ALIVE)
+    if old is None:
+        return  # first sighting
+    add_log("LIVENESS", f"{device_id}: {old} -> {new}")
+    if new == STALE or (new == ALIVE and old == OFFLINE):
+        probe_device(device_id)
+    elif new == OFFLINE:
+        fleet.get_or_create(device_id).set_status("offline")
+
+liveness.add_listener(on_liveness)
+
+def status_snapshot(target=None):
+    """Current device/MQTT status (shared by /status and /ws)"""
+    state = (target or device).snapshot()
+    last_update = state["last_update"]
+    time_since_update = time.time() - last_update if last_update is not None else None
+    
+    return {
+        "device_status": str(state["status"]) if state["status"] else "disconnected",
+        "mqtt_connected": mqtt_link.is_set(),
+        "last_update": last_update,
+        "last_update_seconds_ago": round(time_since_update, 2) if time_since_update is not None else None,
+        "server_time": datetime.now().isoformat(),
+        "system_logs_count": len(system_logs),
+        "device_id": state["device_id"],
+        "liveness": liveness.state(state["device_id"]),
+        "last_seen": liveness.last_seen(state["device_id"]),
+        "status": "ok"
+    }
+
+def publish_status(target=None):
+    """Push the current status to WebSocket clients"""
+    if target is None or target is device:
+        broadcaster.publish({"type": "status", **status_snapshot()})
+    else:
+        broadcaster.publish({"type": "device", **target.snapshot()})
 
-def add_log(log_type, message):
+def add_log(log_type, message, timestamp=None):
     """Add log entry and broadcast to connected clients"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
+    timestamp = timestamp or clock_text()
     log_entry = f"[{timestamp}] [{log_type}] {message}"
-    system_logs.append(log_entry)
+    seq = system_logs.append(log_entry)
     
-    # Keep only last 50 logs
-    if len(system_logs) > 50:
-        system_logs.pop(0)
-    
-    # Broadcast to WebSocket connections (if implemented)
-    for connection in active_connections:
-        try:
-            connection.put_nowait(log_entry)
-        except:
-            pass
+    # Broadcast to WebSocket connections (and follower workers)
+    event = {"type": "log", "seq": seq, "line": log_entry}
+    broadcaster.publish(event)
+    replicate(event)
 
-def add_serial_log(message):
+def add_serial_log(message, timestamp=None):
     """Add serial monitor output"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
+    timestamp = timestamp or clock_text()
     serial_entry = f"[{timestamp}] {message}"
-    serial_logs.append(serial_entry)
-    
-    # Keep only last 100 serial logs
-    if len(serial_logs) > 100:
-        serial_logs.pop(0)
+    seq = serial_logs.append(serial_entry)
+    event = {"type": "serial", "seq": seq, "line": serial_entry}
+    broadcaster.publish(event)
+    replicate(event)
     
     # Also add to main logs
-    add_log("SERIAL", message)
+    add_log("SERIAL", message, timestamp)
+
+def set_location(device_id, lat, lon):
+    fleet.set_location(device_id, lat, lon)
+    replicate({"type": "location", "device_id": device_id, "location": fleet.location(device_id)},
+              f"location/{device_id}")
+
+def replicate(event, key=None):
+    """Leader: publish a state change for the follower workers (no-op without CLUSTER_MODE).
+    
+    Keyed events replace the previous value for the key, so a follower
+    that starts late loads current state without replaying every event.
+    """
+    if shared_state is not None and IS_LEADER:
+        shared_state.publish(event, key)
+
+def replicate_status(state, old, new):
+    replicate({"type": "device_status", "device_id": state.device_id, "status": new, "ts": state.last_update},
+              f"status/{state.device_id}")
+
+def apply_replicated(event):
+    """Follower: apply one state change published by the leader"""
+    kind = event["type"]
+    if kind == "device_status":
+        fleet.get_or_create(event["device_id"]).set_status(event["status"], event["ts"])  # listeners push to /ws
+    elif kind == "link":
+        set_link = mqtt_link.set if event["connected"] else mqtt_link.clear
+        set_link()
+        publish_status()
+    elif kind == "log":
+        system_logs.append(event["line"], event["seq"])
+        broadcaster.publish(event)
+    elif kind == "serial":
+        serial_logs.append(event["line"], event["seq"])
+        broadcaster.publish(event)
+    elif kind == "liveness":
+        liveness.restore(event["device_id"], event["to"], event["last_seen"])
+        broadcaster.publish(event)
+    elif kind == "emergency":
+        broadcaster.publish(event)
+    elif kind == "location" and event["location"] is not None:
+        fleet.set_location(event["device_id"], *event["location"])
+
+def record_status_history(state, old, new):
+    history.record(STATUS, state.device_id, str(new), {"from": str(old) if old is not None else None})
+
+def record_order_history(order):
+    history.record(ORDER, order["device_id"], f"{order['order_id']} {order['state']}", order)
+
+def track_queue_depth(order):
+    """Keep the fleet's least-loaded index in step with the order queue"""
+    fleet.set_queue_depth(order["device_id"], order_queue.depth(order["device_id"]))
+
+order_queue.add_listener(track_queue_depth)
+
+def on_device_transition(state, old, new):
+    """Advance the active order and wake the dispatcher when a machine frees up"""
+    order_queue.on_device_status(state.device_id, new)
+    if new == "ready":
+        dispatcher.wake()
+
+def send_order(order):
+    """Dispatcher callback: publish the order's command, returns the ack future (None on failure)"""
+    add_log("ORDER", f"Dispatching {order.order_id}: {order.noodle_name} ({order.device_id})")
+    return mqtt_publish_nowait(device_topic(order.device_id, "command"), order.noodle_code)
+
+def is_device_ready(device_id):
+    state = fleet.get(device_id)
+    return state is not None and state.status == "ready" and mqtt_link.is_set()
+
+dispatcher = Dispatcher(order_queue, is_device_ready, send_order)
 
 def connect_mqtt():
     """Connect to MQTT broker in background thread"""
@@ -129,9 +492,13 @@ def connect_mqtt():
     mqtt_client.on_connect = on_connect
     mqtt_client.on_disconnect = on_disconnect
     mqtt_client.on_message = on_message
+    if telemetry is not None:
+        for topic in wearable_subscriptions():
+            mqtt_client.message_callback_add(topic, on_wearable_message)
+    publisher.set_client(mqtt_client)  # on_publish resolves acks
     
     # Set last will testament
-    mqtt_client.will_set(MQTT_TOPIC_STATUS, "server_disconnected", qos=1, retain=True)
+    mqtt_client.will_set(MQTT_TOPIC_SERVER_STATUS, "server_disconnected", qos=1, retain=True)
     
     try:
         mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
@@ -142,97 +509,321 @@ def connect_mqtt():
         logger.error(f"Cannot connect to MQTT: {e}")
         return False
 
-def mqtt_publish(topic, message, qos=1):
-    """Publish message to MQTT with error handling"""
-    if mqtt_connected and mqtt_client:
+def on_control_connect(client, userdata, flags, rc):
+    if rc == 0:
+        logger.info("✅ Emergency control channel connected")
+        control_link.set()
+        client.subscribe(device_topic(DEFAULT_DEVICE_ID, "emergency_ack"), qos=1)
+        if FLEET_MODE:
+            for topic in fleet_subscriptions(["emergency_ack"]):
+                client.subscribe(topic, qos=1)
+    else:
+        logger.error(f"❌ Emergency control channel failed, return code {rc}")
+        control_link.clear()
+
+def on_control_disconnect(client, userdata, rc):
+    logger.warning(f"Emergency control channel disconnected, rc={rc}")
+    control_link.clear()
+
+def on_control_message(client, userdata, msg):
+    device_id, kind = parse_topic(msg.topic)
+    if kind == "emergency_ack":
+        stopper.on_ack(device_id, msg.payload.decode().strip() or None)
+
+def connect_control_mqtt():
+    """Second MQTT connection used only for emergency stops"""
+    global control_client
+    
+    control_client = mqtt.Client(client_id=f"noodle-control-{int(time.time())}")
+    control_client.on_connect = on_control_connect
+    control_client.on_disconnect = on_control_disconnect
+    control_client.on_message = on_control_message
+    control_publisher.set_client(control_client)
+    
+    try:
+        control_client.connect(MQTT_BROKER, MQTT_PORT, 30)
+        control_client.loop_start()
+        return True
+    except Exception as e:
+        logger.error(f"Cannot connect emergency control channel: {e}")
+        return False
+
+def send_stop(device_id, stop_id):
+    """One emergency stop attempt; falls back to the main connection if needed"""
+    topic = device_topic(device_id, "emergency")
+    if control_link.is_set() and control_publisher.publish_nowait(topic, stop_id, qos=2) is not None:
+        MQTT_MESSAGES_OUT.labels(topic_pattern(*parse_topic(topic))).inc()
+        return True
+    return mqtt_publish(topic, stop_id, qos=2)
+
+stopper = EmergencyStopper(send_stop, EMERGENCY_RETRY_INTERVAL, EMERGENCY_DEADLINE)
+
+def on_stop_finished(stop):
+    """Report the device's ack (or its absence) to /ws clients after /emergency_stop returned"""
+    event = {"type": "emergency", **stop.to_dict()}
+    broadcaster.publish(event)
+    replicate(event)
+    if stop.state == ACKED:
+        add_log("EMERGENCY", f"Emergency stop {stop.stop_id} acknowledged by {stop.device_id} in {stop.latency_ms} ms")
+    else:
+        add_log("EMERGENCY", f"Emergency stop {stop.stop_id} NOT acknowledged by {stop.device_id}")
+
+stopper.add_listener(on_stop_finished)
+
+def mqtt_publish_nowait(topic, message, qos=1):
+    """Publish without waiting; returns a Future of the broker ack, or None if not sent"""
+    if mqtt_link.is_set() and mqtt_client:
         try:
-            result = mqtt_client.publish(topic, message, qos=qos, retain=False)
-            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+            future = publisher.publish_nowait(topic, message, qos=qos)
+            if future is not None:
+                MQTT_MESSAGES_OUT.labels(topic_pattern(*parse_topic(topic))).inc()
                 logger.info(f"📤 Published to {topic}: {message}")
-                return True
-            else:
-                logger.error(f"Failed to publish to {topic}, rc={result.rc}")
-                return False
+            return future
         except Exception as e:
             logger.error(f"Exception publishing to MQTT: {e}")
-            return False
+            return None
     else:
         logger.warning("MQTT not connected, cannot publish")
-        return False
+        return None
+
+def mqtt_publish(topic, message, qos=1):
+    """Publish message to MQTT with error handling (True once queued by the client)"""
+    return mqtt_publish_nowait(topic, message, qos) is not None
+
+async def mqtt_publish_acked(topic, message, qos=1, timeout=None, retries=None):
+    """Publish and wait for the broker's acknowledgement; returns a PublishResult"""
+    if not (mqtt_link.is_set() and mqtt_client):
+        logger.warning("MQTT not connected, cannot publish")
+        return PublishResult(False, 0, None, "MQTT not connected")
+    result = await publisher.publish(topic, message, qos=qos, timeout=timeout, retries=retries)
+    if result.delivered:
+        logger.info(f"📤 Published to {topic}: {message} (ack {result.latency_ms} ms)")
+    else:
+        logger.error(f"Publish to {topic} not acknowledged: {result.error}")
+    return result
+
+def send_cooling(device_id, state):
+    """TelemetryIngest callback: "on" / "off" to one wearable"""
+    return mqtt_publish(wearable_topic(device_id, "cooling"), state)
+
+def on_wearable_message(client, userdata, msg):
+    """Network thread: numpy-parse the readings straight into the device's window"""
+    started = time.perf_counter()
+    device_id, _ = parse_wearable_topic(msg.topic)
+    WEARABLE_MESSAGES_IN.inc()
+    if device_id is not None:
+        telemetry.submit(device_id, msg.payload)
+    MQTT_ON_MESSAGE_SECONDS.observe(time.perf_counter() - started)
+
+telemetry = None  # TelemetryIngest, created by the leader in start_controller
+
+def start_telemetry():
+    """Load (or train and save) the cooling model; None if wearables are off or it can't be had"""
+    if not (WEARABLE_AVAILABLE and WEARABLE_TELEMETRY):
+        return None
+    try:
+        model = load_cooling_model(data_path(COOLING_MODEL_PATH))
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Wearable telemetry disabled, no cooling model: {e}")
+        return None
+    return TelemetryIngest(
+        model, send_cooling,
+        window=WEARABLE_WINDOW, interval=WEARABLE_EVAL_INTERVAL, min_switch_interval=WEARABLE_MIN_SWITCH_SECONDS
+    )
+
+def data_path(path):
+    """Create the parent directory of a runtime file (DATA_DIR by default); returns path"""
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    return path
+
+if WEARABLE_AVAILABLE:
+    WEARABLE_MESSAGES_IN = MQTT_MESSAGES_IN.labels(wearable_topic("+", "telemetry"))
 
 # Start MQTT connection on startup
 @app.on_event("startup")
 async def startup_event():
-    global device_status
+    global shared_state, leader_client, replica, history
     logger.info("🚀 Starting Noodle Vending Machine Server...")
+    if HISTORY_DB_PATH:  # every worker answers /history
+        history = HistoryStore(data_path(HISTORY_DB_PATH), retention_days=HISTORY_RETENTION_DAYS)
+    
+    # MQTT callbacks run on paho's thread and hand events to this loop
+    loop = asyncio.get_running_loop()
+    broadcaster.bind_loop(loop)
+    device.bind_loop(loop)
+    fleet.add_listener(lambda state, old, new: publish_status(state))
+    asyncio.create_task(monitor_event_loop_lag())
+    
+    if not CLUSTER_MODE:
+        await start_controller()
+        return
+    
+    os.makedirs(CLUSTER_DIR, exist_ok=True)
+    shared_state = SQLiteState(os.path.join(CLUSTER_DIR, "state.db"))
+    if leader_lock.try_acquire():
+        await start_controller()
+        return
+    
+    # Follower: serve reads from a replica, forward the rest, wait to take over
+    leader_client = LeaderClient(CLUSTER_SOCKET)
+    replica = Follower(shared_state, apply_replicated)
+    replica.sync()
+    asyncio.create_task(replica.run())
+    asyncio.create_task(await_leadership())
+    logger.info(f"🧩 Worker {os.getpid()} is a follower")
+
+async def await_leadership():
+    """Follower task: become the leader once the current one exits (the OS drops its lock)"""
+    while not leader_lock.try_acquire():
+        await asyncio.sleep(CLUSTER_RETRY_SECONDS)
+    replica.stop()
+    replica.poll()  # whatever the old leader committed last
+    logger.warning(f"👑 Leader gone, worker {os.getpid()} taking over")
+    await start_controller()
+
+async def start_controller():
+    """Leader duties: MQTT, AI model, order dispatch and timers (one worker only)"""
+    global IS_LEADER, leader_server, telemetry
+    IS_LEADER = True
+    loop = asyncio.get_running_loop()
+    fleet.add_listener(on_device_transition)
+    if history is not None:
+        fleet.add_listener(record_status_history)
+        order_queue.add_listener(record_order_history)
+    if ORDER_JOURNAL_PATH:
+        order_queue.open_journal(data_path(ORDER_JOURNAL_PATH))
+        for device_id in order_queue.devices_with_work():
+            fleet.set_queue_depth(device_id, order_queue.depth(device_id))  # replayed orders
+    telemetry = start_telemetry()  # before connect_mqtt, which subscribes its topics
+    if shared_state is not None:
+        fleet.add_listener(replicate_status)
+        asyncio.create_task(shared_state.run())
+        leader_server = LeaderServer(app, CLUSTER_SOCKET)
+        await leader_server.start()
+        logger.info(f"👑 Worker {os.getpid()} is the leader")
+    dispatcher.bind_loop(loop)
     
     # Set initial device status
-    device_status = "connecting"
+    device.set_status("connecting")
+    
+    # Load the AI model in the background; keyword/cached replies work meanwhile
+    start_model_loading()
     
-    # Connect to MQTT in background
+    # Connect to MQTT in background; the ingest worker handles its messages
+    ingest.start()
     mqtt_thread = threading.Thread(target=connect_mqtt, daemon=True)
     mqtt_thread.start()
+    threading.Thread(target=connect_control_mqtt, daemon=True).start()
     
     # Wait for MQTT connection
     for i in range(10):
-        if mqtt_connected:
+        if mqtt_link.is_set():
             break
         logger.info(f"Waiting for MQTT connection... ({i+1}/10)")
         await asyncio.sleep(1)
     
-    if mqtt_connected:
+    if mqtt_link.is_set():
         logger.info("✅ Server startup complete!")
-        device_status = "ready"
     else:
         logger.warning("⚠️ Server started but MQTT not connected")
-        device_status = "mqtt_disconnected"
+        device.set_status("mqtt_disconnected")
     
-    # Start background status check task
-    asyncio.create_task(status_checker())
+    # Deadline timer for heartbeats; a one-off probe picks up the current status
+    asyncio.create_task(liveness.run())
+    if mqtt_link.is_set():
+        probe_device(DEFAULT_DEVICE_ID)
+    asyncio.create_task(dispatcher.run())
+    if telemetry is not None:
+        asyncio.create_task(telemetry.run())
+    if history is not None:
+        asyncio.create_task(history.run())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    ingest.stop()
+    inference_pool.shutdown()
+    if IS_LEADER:
+        save_response_cache()  # a follower's cache never saw a request
+    order_queue.close()
+    if history is not None:
+        history.close()
+    if leader_server is not None:
+        await leader_server.close()
+    if shared_state is not None:
+        shared_state.close()
+    if leader_lock is not None:
+        leader_lock.release()
 
 
 # Pydantic models
 class ChatRequest(BaseModel):
     user_message: str
+    device_id: Optional[str] = None  # fleet: order from this machine
+    latitude: Optional[float] = None  # fleet: otherwise route to the nearest ready machine
+    longitude: Optional[float] = None
+    idempotency_key: Optional[str] = None  # resending the same key returns the original order
 
 class ManualDispenseRequest(BaseModel):
     noodle_number: int
+    device_id: Optional[str] = None
+    idempotency_key: Optional[str] = None
 
-# Noodle mapping
-NOODLE_MAP = {
-    "Hot Spicy Ramen": "noodle_1",
-    "Chicken Noodles": "noodle_2",
-    "Cheese Noodles": "noodle_3",
-    "Veg Clear Soup": "noodle_4"
-}
-
-NOODLE_REVERSE_MAP = {v: k for k, v in NOODLE_MAP.items()}
+class DeviceLocation(BaseModel):
+    latitude: float
+    longitude: float
 
 # AI Model Import (with fallback)
 try:
-    from ai_model import get_ai_reply
+    from ai_model import (
+        get_ai_reply, get_ai_decision, stream_ai_decision, get_ai_stats, save_response_cache,
+        start_model_loading, get_model_status
+    )
     AI_ENABLED = True
-    logger.info("✅ AI model loaded successfully")
+    logger.info("✅ AI module imported, model will load in the background")
 except ImportError as e:
     logger.warning(f"⚠️ AI model not available: {e}")
     AI_ENABLED = False
     
+    def get_ai_stats():
+        return {"ai_loaded": False}
+    
+    def save_response_cache():
+        return False
+    
+    def start_model_loading():
+        return False
+    
+    def get_model_status():
+        return {"state": "unavailable", "ready": False}
+    
     # Mock AI function
+    MOCK_RESPONSES = {
+        "spicy": "I'll prepare Hot Spicy Ramen for you! This is our spiciest option.",
+        "hot": "I'll prepare Hot Spicy Ramen for you! This is our spiciest option.",
+        "chicken": "I'll prepare Chicken Noodles for you! This has tender chicken pieces.",
+        "cheese": "I'll prepare Cheese Noodles for you! This is our creamiest option.",
+        "creamy": "I'll prepare Cheese Noodles for you! This is our creamiest option.",
+        "vegetarian": "I'll prepare Veg Clear Soup for you! This is a light vegetarian soup.",
+        "veg": "I'll prepare Veg Clear Soup for you! This is a light vegetarian soup.",
+        "light": "I'll prepare Veg Clear Soup for you! This is a light vegetarian soup.",
+        "test": "I'll prepare Hot Spicy Ramen for you! This is our test option.",
+    }
+    mock_matcher = IntentMatcher(MOCK_RESPONSES)
+    MOCK_DEFAULT = IntentMatch(
+        "I'll prepare Hot Spicy Ramen for you! This is our most popular option.",
+        "Hot Spicy Ramen", NOODLE_MAP["Hot Spicy Ramen"], "fallback"
+    )
+    
+    def get_ai_decision(user_message: str) -> IntentMatch:
+        return mock_matcher.match(user_message) or MOCK_DEFAULT
+    
     def get_ai_reply(user_message: str) -> str:
-        user_lower = user_message.lower()
-        
-        if "spicy" in user_lower or "hot" in user_lower:
-            return "I'll prepare Hot Spicy Ramen for you! This is our spiciest option."
-        elif "chicken" in user_lower:
-            return "I'll prepare Chicken Noodles for you! This has tender chicken pieces."
-        elif "cheese" in user_lower or "creamy" in user_lower:
-            return "I'll prepare Cheese Noodles for you! This is our creamiest option."
-        elif "vegetarian" in user_lower or "veg" in user_lower or "light" in user_lower:
-            return "I'll prepare Veg Clear Soup for you! This is a light vegetarian soup."
-        elif "test" in user_lower:
-            return "I'll prepare Hot Spicy Ramen for you! This is our test option."
-        else:
-            return "I'll prepare Hot Spicy Ramen for you! This is our most popular option."
+        return get_ai_decision(user_message).reply
+    
+    def stream_ai_decision(user_message: str, cancelled=None):
+        yield "decision", get_ai_decision(user_message)
 
 # API Routes
 @app.get("/")
@@ -240,33 +831,25 @@ def read_root():
     return {
         "message": "Noodle Vending Machine API",
         "status": "running",
-        "mqtt_connected": mqtt_connected,
-        "device_status": device_status,
+        "mqtt_connected": mqtt_link.is_set(),
+        "device_status": device.status,
         "ai_enabled": AI_ENABLED,
         "timestamp": datetime.now().isoformat()
     }
 
 @app.get("/status")
-async def get_status():
-    """Get current system status"""
+async def get_status(device_id: Optional[str] = None):
+    """Get current system status (?device_id= for one fleet machine)"""
     try:
-        # Calculate time since last update
-        time_since_update = None
-        if last_status_update is not None:
-            try:
-                time_since_update = time.time() - float(last_status_update)
-            except (TypeError, ValueError):
-                time_since_update = None
-        
-        return {
-            "device_status": str(device_status) if device_status else "disconnected",
-            "mqtt_connected": bool(mqtt_connected),
-            "last_update": float(last_status_update) if last_status_update else None,
-            "last_update_seconds_ago": round(time_since_update, 2) if time_since_update is not None else None,
-            "server_time": datetime.now().isoformat(),
-            "system_logs_count": len(system_logs),
-            "status": "ok"
-        }
+        target = fleet.get(device_id) if device_id else device
+        if target is None:
+            raise HTTPException(status_code=404, detail=f"Unknown device '{device_id}'")
+        data = status_snapshot(target)
+        if FLEET_MODE:
+            data["fleet"] = fleet.stats()
+        return data
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in /status endpoint: {e}", exc_info=True)
         return {
@@ -277,65 +860,265 @@ async def get_status():
             "status": "error"
         }
 
-@app.get("/logs")
-def get_logs():
+@app.get("/wait_for_status")
+async def wait_for_status(status: str = "ready", timeout: float = 10.0, device_id: str = DEFAULT_DEVICE_ID):
+    """Long-poll until the device reports `status` (or timeout, max 60 s)"""
+    target = fleet.get(device_id)
+    if target is None:
+        raise HTTPException(status_code=404, detail=f"Unknown device '{device_id}'")
+    reached = await target.wait_for(status, timeout=min(max(timeout, 0.0), 60.0))
     return {
-        "logs": system_logs[-20:],  # Return last 20 logs
-        "count": len(system_logs)
+        "reached": reached,
+        "device_id": device_id,
+        "device_status": target.status,
+        "timestamp": datetime.now().isoformat()
     }
 
-@app.get("/serial-logs")
-def get_serial_logs():
-    """Get ESP32 serial monitor output"""
+@app.get("/devices")
+async def list_devices(offset: int = 0, limit: int = 100):
+    """Fleet registry: one page of machines with status and location"""
+    limit = min(max(limit, 1), 1000)
     return {
-        "serial_logs": serial_logs[-50:],  # Return last 50 serial logs
-        "count": len(serial_logs),
-        "total_available": len(serial_logs),
+        "fleet_mode": FLEET_MODE,
+        **fleet.stats(),
+        "offset": offset,
+        "limit": limit,
+        "items": [
+            {**item, "liveness": liveness.state(item["device_id"]), "last_seen": liveness.last_seen(item["device_id"])}
+            for item in fleet.list(offset, limit)
+        ],
+        "liveness": liveness.stats(),
+        "ready_ids": fleet.ready_ids()[:limit],
         "timestamp": datetime.now().isoformat()
     }
 
-@app.post("/chat")
-async def chat_agent(req: ChatRequest):
+@app.get("/wearables")
+async def list_wearables():
+    """Cooling wearables: latest window aggregates, classification and commanded state"""
+    if telemetry is None:
+        raise HTTPException(status_code=503, detail="Wearable telemetry is disabled")
+    return {**telemetry.stats(), "items": telemetry.snapshots(), "timestamp": datetime.now().isoformat()}
+
+@app.get("/wearables/{device_id}")
+async def get_wearable(device_id: str):
+    if telemetry is None:
+        raise HTTPException(status_code=503, detail="Wearable telemetry is disabled")
+    snapshot = telemetry.snapshot(device_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail=f"Unknown wearable '{device_id}'")
+    return snapshot
+
+@app.post("/devices/{device_id}/probe")
+async def probe(device_id: str):
+    """On-demand status request, for devices that do not send heartbeats"""
+    sent = probe_device(device_id)
+    return {
+        "success": sent,
+        "device_id": device_id,
+        "liveness": liveness.state(device_id),
+        "last_seen": liveness.last_seen(device_id),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.post("/devices/{device_id}/location")
+async def set_device_location(device_id: str, loc: DeviceLocation):
+    """Register where a machine is, used to route /chat orders to the nearest one"""
+    set_location(device_id, loc.latitude, loc.longitude)
+    return {"success": True, "device_id": device_id, "location": fleet.location(device_id)}
+
+@app.websocket("/ws")
+async def websocket_updates(websocket: WebSocket):
+    """Push channel: snapshot on connect, then status/log/serial events"""
+    await websocket.accept()
+    queue = broadcaster.subscribe()
     try:
-        # Get AI response
-        ai_reply = get_ai_reply(req.user_message)
-        
-        # Extract noodle selection from AI response
-        selected_noodle = None
-        for noodle_name, noodle_code in NOODLE_MAP.items():
-            if noodle_name.lower() in ai_reply.lower():
-                selected_noodle = (noodle_name, noodle_code)
+        await websocket.send_json({
+            "type": "snapshot",
+            "status": status_snapshot(),
+            "logs": [{"seq": s, "line": l} for s, l in system_logs.tail(20)],
+            "serial_logs": [{"seq": s, "line": l} for s, l in serial_logs.tail(50)]
+        })
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), WS_PING_INTERVAL)
+            except asyncio.TimeoutError:
+                message = {"type": "ping", "server_time": datetime.now().isoformat()}
+            await websocket.send_json(message)
+            if message is DROPPED:
+                await websocket.close(code=1013)  # try again later
                 break
-        
-        response_data = {
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        broadcaster.unsubscribe(queue)
+
+@app.get("/ready")
+async def readiness():
+    """Readiness check - server is up, reports AI model loading state"""
+    model_status = get_model_status()
+    return {
+        "server": "ready",
+        "model_state": model_status["state"],
+        "model_ready": model_status["ready"],
+        "model": model_status,
+        "mqtt_connected": mqtt_link.is_set(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+def _read_logs(store, since, limit, default_tail):
+    """Cursor read: entries after `since`, or the newest `default_tail` without a cursor"""
+    if since is None:
+        entries = store.tail(default_tail)
+    else:
+        entries = store.since(since, limit)
+    return {
+        "entries": [{"seq": seq, "line": line} for seq, line in entries],
+        "lines": [line for _, line in entries],
+        "next_since": entries[-1][0] if entries else (since if since is not None else store.last_seq),
+        "count": len(store),
+        "capacity": store.capacity
+    }
+
+@app.get("/logs")
+def get_logs(since: int = None, limit: int = 500):
+    """System logs; pass ?since=<next_since> to fetch only new entries"""
+    page = _read_logs(system_logs, since, limit, 20)  # Last 20 logs without a cursor
+    return {
+        "logs": page["lines"],
+        "entries": page["entries"],
+        "next_since": page["next_since"],
+        "count": page["count"],
+        "capacity": page["capacity"]
+    }
+
+@app.get("/serial-logs")
+def get_serial_logs(since: int = None, limit: int = 500):
+    """Get ESP32 serial monitor output; ?since=<next_since> for new lines only"""
+    page = _read_logs(serial_logs, since, limit, 50)  # Last 50 serial logs without a cursor
+    return {
+        "serial_logs": page["lines"],
+        "entries": page["entries"],
+        "next_since": page["next_since"],
+        "count": page["count"],
+        "total_available": page["count"],
+        "capacity": page["capacity"],
+        "timestamp": datetime.now().isoformat()
+    }
+
+def resolve_device(device_id=None, latitude=None, longitude=None):
+    """DeviceState an order should go to (None if device_id is unknown)"""
+    if device_id:
+        return fleet.get(device_id)
+    if FLEET_MODE:
+        nearest = fleet.nearest_ready(latitude, longitude)
+        if nearest is not None:
+            return fleet.get(nearest)
+        # Every machine is busy: queue on the live one with the shortest queue
+        least = fleet.least_loaded()
+        if least is not None:
+            return fleet.get(least)
+    return device
+
+def submit_order(target, noodle_name, noodle_code, source, idempotency_key=None, key_ttl=600.0):
+    """Queue an order and send it straight away if the machine is free.
+    
+    Returns (order, created, ack) where ack is the publish-ack future when
+    the order was sent right now, else None.
+    """
+    order, created = order_queue.submit(
+        target.device_id, noodle_code, noodle_name, source, idempotency_key, key_ttl
+    )
+    ack = None
+    if created:
+        add_log("ORDER", f"{order.order_id} queued: {noodle_name} ({target.device_id})")
+        for sent, receipt in dispatcher.dispatch(target.device_id):
+            if sent is order:
+                ack = receipt
+    return order, created, ack
+
+def order_fields(order, created=True):
+    """Order details included in /chat and /manual_dispense responses"""
+    return {
+        "order_id": order.order_id,
+        "order_state": order.state,
+        "queue_position": order_queue.position(order),
+        "queue_depth": order_queue.depth(order.device_id),
+        "duplicate": not created
+    }
+
+async def _chat_response(decision, req, idempotency_key=None):
+    """Build the /chat response for an AI decision and queue the order"""
+    # Noodle selection comes back with the reply, no need to rescan it
+    ai_reply = decision.reply
+    selected_noodle = (decision.noodle_name, decision.noodle_code) if decision.noodle_code else None
+    
+    target = resolve_device(req.device_id, req.latitude, req.longitude)
+    if target is None:
+        return {
             "reply": ai_reply,
-            "device_status": device_status,
+            "error": f"Unknown device '{req.device_id}'",
+            "success": False,
             "timestamp": datetime.now().isoformat()
         }
+    
+    device_status = target.status
+    response_data = {
+        "reply": ai_reply,
+        "device_id": target.device_id,
+        "device_status": device_status,
+        "timestamp": datetime.now().isoformat()
+    }
+    if decision.confidence is not None:
+        response_data["confidence"] = decision.confidence  # menu scoring
+    
+    # Orders are queued while the device is busy and sent once it reports ready
+    if selected_noodle:
+        noodle_name, noodle_code = selected_noodle
+        order, created, _ = submit_order(
+            target, noodle_name, noodle_code, "chat",
+            idempotency_key or req.idempotency_key
+        )
+        await order_queue.synced()  # journaled before the client hears about it
+        response_data.update(order_fields(order, created))
         
-        # If a noodle is selected and device is ready, send command
-        if selected_noodle and device_status == "ready":
-            noodle_name, noodle_code = selected_noodle
-            
-            # Add log
-            add_log("ORDER", f"User ordered: {noodle_name}")
-            
-            if mqtt_publish(MQTT_TOPIC_COMMAND, noodle_code):
-                response_data["action"] = f"Dispensing {noodle_name}"
-                response_data["command_sent"] = noodle_code
-                response_data["success"] = True
-            else:
-                response_data["error"] = "Failed to send command to device"
-                response_data["success"] = False
-        elif selected_noodle:
-            response_data["warning"] = f"Device is busy ({device_status}), please wait"
+        if order.state == FAILED:
+            response_data["error"] = order.error or "Failed to send command to device"
             response_data["success"] = False
+        elif order.state == SENT:
+            response_data["action"] = f"Dispensing {noodle_name}"
+            response_data["command_sent"] = noodle_code
+            response_data["success"] = True
         else:
-            response_data["info"] = "No noodle selected from your request"
-            response_data["success"] = False
+            response_data["action"] = (
+                f"Queued {noodle_name} (position {response_data['queue_position']}), "
+                f"it will be dispensed when the machine is ready"
+                if response_data["queue_position"] else f"{noodle_name}: order {order.state}"
+            )
+            response_data["success"] = True
+    else:
+        response_data["info"] = "No noodle selected from your request"
+        response_data["success"] = False
+    
+    return response_data
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat")
+async def chat_agent(req: ChatRequest, idempotency_key: Optional[str] = Header(None)):
+    try:
+        # Get AI response without blocking the event loop
+        try:
+            decision = await inference_pool.run(get_ai_decision, req.user_message)
+        except InferenceQueueFull:
+            raise HTTPException(status_code=429, detail="AI is busy, please retry shortly")
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="AI reply timed out")
         
-        return response_data
+        return await _chat_response(decision, req, idempotency_key)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}")
         return {
@@ -344,30 +1127,89 @@ async def chat_agent(req: ChatRequest):
             "success": False
         }
 
-@app.post("/manual_dispense/{noodle_number}")
-async def manual_dispense_path(noodle_number: int):
-    """Dispense noodle via path parameter"""
+@app.post("/chat/stream")
+async def chat_agent_stream(req: ChatRequest, idempotency_key: Optional[str] = Header(None)):
+    """Streaming /chat: server-sent events with tokens as they are generated.
+    
+    Events: "token" ({"text"}), then "done" (same body as /chat) or "error".
+    Generation stops as soon as a menu item appears and the order is
+    queued right away.
+    """
+    async def events():
+        try:
+            async for kind, payload in inference_pool.stream(stream_ai_decision, req.user_message):
+                if kind == "token":
+                    yield _sse("token", {"text": payload})
+                else:
+                    yield _sse("done", await _chat_response(payload, req, idempotency_key))
+        except InferenceQueueFull:
+            yield _sse("error", {"error": "AI is busy, please retry shortly", "status": 429, "success": False})
+        except asyncio.TimeoutError:
+            yield _sse("error", {"error": "AI reply timed out", "status": 504, "success": False})
+        except Exception as e:
+            logger.error(f"Error in chat stream: {e}")
+            yield _sse("error", {"error": str(e), "success": False})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _manual_dispense(noodle_number, device_id=None, idempotency_key=None):
+    """Queue a dispense order for noodle 1-4 on a device"""
     try:
         if 1 <= noodle_number <= 4:
             command = f"noodle_{noodle_number}"
             noodle_name = NOODLE_REVERSE_MAP.get(command, f"Noodle {noodle_number}")
             
-            # Add log
-            add_log("MANUAL", f"Manual dispense: {noodle_name}")
-            
-            if mqtt_publish(MQTT_TOPIC_COMMAND, command):
+            target = fleet.get(device_id or DEFAULT_DEVICE_ID)
+            if target is None:
                 return {
-                    "success": True,
-                    "message": f"Command sent: {command}",
-                    "noodle_name": noodle_name,
+                    "success": False,
+                    "message": f"Unknown device '{device_id}'",
                     "timestamp": datetime.now().isoformat()
                 }
+            
+            # Without a client key, quick repeated taps collapse into one order
+            if idempotency_key:
+                order, created, ack = submit_order(target, noodle_name, command, "manual", idempotency_key)
             else:
+                order, created, ack = submit_order(
+                    target, noodle_name, command, "manual",
+                    f"manual:{target.device_id}:{command}", MANUAL_DEDUPE_SECONDS
+                )
+            if created:
+                add_log("MANUAL", f"Manual dispense: {noodle_name} ({target.device_id})")
+            await order_queue.synced()  # journaled before the client hears about it
+            
+            if order.state == FAILED:
                 return {
                     "success": False,
-                    "message": "Failed to send command to device",
+                    "message": order.error or "Failed to send command to device",
+                    **order_fields(order, created),
                     "timestamp": datetime.now().isoformat()
                 }
+            delivery = {}
+            if ack is not None:
+                # Report whether the broker actually took the command
+                result = await publisher.wait(ack, MQTT_ACK_TIMEOUT)
+                delivery = {"delivered": result.delivered, "ack_latency_ms": result.latency_ms}
+            if order.state == SENT:
+                message = f"Command sent: {command}" if delivery.get("delivered") else f"Command queued for delivery: {command}"
+            else:
+                message = f"Order {order.order_id} {order.state}"
+                if order_queue.position(order):
+                    message += f" (position {order_queue.position(order)})"
+            return {
+                "success": True,
+                "message": message,
+                "noodle_name": noodle_name,
+                "device_id": target.device_id,
+                **order_fields(order, created),
+                **delivery,
+                "timestamp": datetime.now().isoformat()
+            }
         else:
             return {
                 "success": False,
@@ -382,62 +1224,48 @@ async def manual_dispense_path(noodle_number: int):
             "message": f"Error: {str(e)}"
         }
 
+@app.post("/manual_dispense/{noodle_number}")
+async def manual_dispense_path(noodle_number: int, device_id: Optional[str] = None,
+                               idempotency_key: Optional[str] = Header(None)):
+    """Dispense noodle via path parameter"""
+    return await _manual_dispense(noodle_number, device_id, idempotency_key)
+
 @app.post("/manual_dispense")
-async def manual_dispense(req: ManualDispenseRequest):
+async def manual_dispense(req: ManualDispenseRequest, idempotency_key: Optional[str] = Header(None)):
     """Dispense noodle via JSON body"""
+    return await _manual_dispense(req.noodle_number, req.device_id, req.idempotency_key or idempotency_key)
+
+@app.post("/emergency_stop")
+async def emergency_stop(device_id: str = DEFAULT_DEVICE_ID, wait: bool = False):
+    """Emergency stop all operations.
+    
+    Goes out on the priority lane first, then cancels queued orders, and
+    returns once the stop is published. The device's ack arrives later as
+    an "emergency" event on /ws; with ?wait=1 the response waits for it.
+    """
     try:
-        noodle_number = req.noodle_number
+        stop = stopper.trigger(device_id)
+        # Queued orders must not start dispensing once the machine recovers
+        cancelled = order_queue.cancel_all(device_id, "emergency stop")
+        # Firmware without the emergency topic still listens on the command topic
+        mqtt_publish(device_topic(device_id, "command"), "emergency_stop")
+        add_log("EMERGENCY", f"Emergency stop {stop.stop_id} activated ({device_id}), {cancelled} orders cancelled")
         
-        if 1 <= noodle_number <= 4:
-            command = f"noodle_{noodle_number}"
-            noodle_name = NOODLE_REVERSE_MAP.get(command, f"Noodle {noodle_number}")
-            
-            # Add log
-            add_log("MANUAL", f"Manual dispense: {noodle_name}")
-            
-            if mqtt_publish(MQTT_TOPIC_COMMAND, command):
-                return {
-                    "success": True,
-                    "message": f"Command sent: {command}",
-                    "noodle_name": noodle_name,
-                    "timestamp": datetime.now().isoformat()
-                }
-            else:
-                return {
-                    "success": False,
-                    "message": "Failed to send command to device",
-                    "timestamp": datetime.now().isoformat()
-                }
+        if wait:
+            await stopper.wait(stop)
+            acked = stop.state == ACKED
+            success, message = acked, "Emergency stop acknowledged by device" if acked else f"Emergency stop {stop.state}"
         else:
-            return {
-                "success": False,
-                "message": "Invalid noodle number (must be 1-4)",
-                "timestamp": datetime.now().isoformat()
-            }
-            
-    except Exception as e:
-        logger.error(f"Error in manual dispense: {e}")
+            success = stop.sent
+            message = "Emergency stop published, waiting for the device" if stop.sent else "Emergency stop not sent, retrying"
         return {
-            "success": False,
-            "message": f"Error: {str(e)}"
+            "success": success,
+            "message": message,
+            "device_id": device_id,
+            "orders_cancelled": cancelled,
+            **stop.to_dict(),
+            "timestamp": datetime.now().isoformat()
         }
-
-@app.post("/emergency_stop")
-async def emergency_stop():
-    """Emergency stop all operations"""
-    try:
-        if mqtt_publish(MQTT_TOPIC_COMMAND, "emergency_stop"):
-            add_log("EMERGENCY", "Emergency stop activated")
-            return {
-                "success": True,
-                "message": "Emergency stop command sent",
-                "timestamp": datetime.now().isoformat()
-            }
-        else:
-            return {
-                "success": False,
-                "message": "Failed to send emergency stop"
-            }
     except Exception as e:
         logger.error(f"Error in emergency stop: {e}")
         return {
@@ -445,13 +1273,22 @@ async def emergency_stop():
             "message": f"Error: {str(e)}"
         }
 
+@app.get("/emergency_stats")
+async def emergency_stats():
+    """Emergency stop latency (trigger to device ack), retries and expired stops"""
+    return {
+        "control_connected": control_link.is_set(),
+        **stopper.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
 @app.post("/test_motor/{motor_number}")
-async def test_motor(motor_number: int):
+async def test_motor(motor_number: int, device_id: str = DEFAULT_DEVICE_ID):
     """Test a specific motor"""
     try:
         if 1 <= motor_number <= 4:
             command = f"test_motor_{motor_number}"
-            if mqtt_publish(MQTT_TOPIC_COMMAND, command):
+            if mqtt_publish(device_topic(device_id, "command"), command):
                 add_log("TEST", f"Testing motor {motor_number}")
                 return {
                     "success": True,
@@ -468,6 +1305,163 @@ async def test_motor(motor_number: int):
         }
 
 
+@app.get("/orders")
+async def list_orders(state: Optional[str] = None, device_id: Optional[str] = None, limit: int = 50):
+    """Recent orders (newest first) plus queue depth and wait-time metrics"""
+    return {
+        "orders": order_queue.recent(state, device_id, min(max(limit, 1), 500)),
+        "stats": order_queue.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/orders/{order_id}")
+async def get_order(order_id: str):
+    """Lifecycle of one order: queued, sent, dispensing, done or failed"""
+    order = order_queue.get(order_id)
+    if order is None:
+        raise HTTPException(status_code=404, detail=f"Unknown order '{order_id}'")
+    return {**order.to_dict(), "queue_position": order_queue.position(order)}
+
+def _parse_time(value, name):
+    """Unix seconds or ISO 8601 -> unix seconds"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"'{name}' must be unix seconds or ISO 8601, got '{value}'")
+
+@app.get("/history")
+async def get_history(start: Optional[str] = Query(None, alias="from"), end: Optional[str] = Query(None, alias="to"),
+                      device: Optional[str] = None, kind: Optional[str] = None,
+                      limit: int = 100, cursor: Optional[str] = None):
+    """Stored orders, status transitions and serial lines in [from, to), oldest first.
+
+    Pass `next_cursor` from the response as `cursor` for the next page.
+    """
+    if history is None:
+        raise HTTPException(status_code=503, detail="History storage is disabled (HISTORY_DB_PATH is empty)")
+    if kind is not None and kind not in HISTORY_KINDS:
+        raise HTTPException(status_code=400, detail=f"'kind' must be one of {', '.join(HISTORY_KINDS)}")
+    try:
+        page = await history.query_async(
+            _parse_time(start, "from"), _parse_time(end, "to"), device, kind,
+            min(max(limit, 1), 1000), cursor
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor '{cursor}'")
+    return {**page, "timestamp": datetime.now().isoformat()}
+
+@app.get("/mqtt_stats")
+async def mqtt_stats():
+    """Publish acknowledgements (in-flight window, timeouts, per-topic ack latency) and the inbound ingest queue"""
+    return {
+        "connected": mqtt_link.is_set(),
+        **publisher.stats(),
+        "ingest": {**ingest.stats(), "topics": len(topics), "log_lines_suppressed": mqtt_log_limit.suppressed_total},
+        "timestamp": datetime.now().isoformat()
+    }
+
+def _server_collector():
+    """Scrape-time gauges read from the existing stats() of each component"""
+    ai = get_ai_stats()
+    cache = ai.get("cache", {})
+    semantic = ai.get("semantic_cache") or {}
+    orders = order_queue.stats()
+    publish = publisher.stats()
+    pool = inference_pool.stats()
+    live = liveness.stats()
+    return [
+        ("log_buffer_entries", "gauge", "Entries held in each log ring buffer",
+         [({"buffer": "system"}, len(system_logs)), ({"buffer": "serial"}, len(serial_logs))]),
+        ("log_buffer_capacity", "gauge", "Capacity of each log ring buffer",
+         [({"buffer": "system"}, system_logs.capacity), ({"buffer": "serial"}, serial_logs.capacity)]),
+        ("ai_cache_hit_ratio", "gauge", "Response cache hits / lookups", [({}, cache.get("hit_rate"))]),
+        ("ai_cache_entries", "gauge", "Response cache entries", [({}, cache.get("entries"))]),
+        ("ai_semantic_cache_hit_ratio", "gauge", "Semantic cache hits / lookups",
+         [({}, semantic.get("hit_rate"))]),
+        ("ai_semantic_cache_entries", "gauge", "Semantic cache entries", [({}, semantic.get("entries"))]),
+        ("inference_in_flight", "gauge", "Inference jobs queued or running", [({}, pool["in_flight"])]),
+        ("inference_rejected_total", "counter", "Inference jobs rejected with 429", [({}, pool["rejected"])]),
+        ("order_queue_depth", "gauge", "Orders waiting for a machine", [({}, orders["depth"])]),
+        ("order_wait_seconds_avg", "gauge", "Average queued -> sent wait", [({}, orders["avg_wait_seconds"])]),
+        ("order_transitions_total", "counter", "Order lifecycle transitions",
+         [({"state": k}, v) for k, v in orders["transitions"].items()]),
+        ("mqtt_publish_in_flight", "gauge", "Publishes waiting for a broker ack", [({}, publish["in_flight"])]),
+        ("mqtt_publish_timeouts_total", "counter", "Publishes never acknowledged", [({}, publish["timeouts"])]),
+        ("mqtt_ingest_queue_depth", "gauge", "Inbound messages waiting for the ingest worker", [({}, len(ingest))]),
+        ("mqtt_ingest_dropped_total", "counter", "Inbound chatter dropped because the ingest queue was full",
+         [({}, ingest.dropped)]),
+        ("mqtt_log_lines_suppressed_total", "counter", "Per-message log lines skipped by the rate limit",
+         [({}, mqtt_log_limit.suppressed_total)]),
+        ("history_events_pending", "gauge", "History events waiting for the writer",
+         [({}, history.stats()["pending"] if history is not None else None)]),
+        ("history_events_dropped_total", "counter", "History events lost (writer behind or write error)",
+         [({}, history.dropped if history is not None else None)]),
+        ("wearable_readings_total", "counter", "Wearable telemetry readings parsed",
+         [({}, telemetry.readings if telemetry is not None else None)]),
+        ("wearable_windows_evaluated_total", "counter", "Wearable windows classified",
+         [({}, telemetry.windows_evaluated if telemetry is not None else None)]),
+        ("wearable_cooling_on", "gauge", "Wearables currently commanded to cool",
+         [({}, telemetry.stats()["cooling_on"] if telemetry is not None else None)]),
+        ("mqtt_connected", "gauge", "1 while connected to the broker", [({}, int(mqtt_link.is_set()))]),
+        ("websocket_subscribers", "gauge", "Connected /ws clients", [({}, broadcaster.stats()["subscribers"])]),
+        ("devices_by_liveness", "gauge", "Devices per liveness state",
+         [({"state": k}, live[k]) for k in (ALIVE, STALE, OFFLINE)]),
+        ("cluster_leader", "gauge", "1 if this worker owns MQTT, the model and orders", [({}, int(IS_LEADER))]),
+        ("cluster_forwarded_total", "counter", "Requests this follower forwarded to the leader",
+         [({}, leader_client.forwarded if leader_client is not None and not IS_LEADER else None)]),
+        ("cluster_replica_seq", "gauge", "Last leader event applied by this follower",
+         [({}, replica.seq if replica is not None and not IS_LEADER else None)]),
+    ]
+
+REGISTRY.add_collector(_server_collector)
+
+def cluster_stats():
+    return {
+        "enabled": CLUSTER_MODE,
+        "role": "leader" if IS_LEADER else "follower",
+        "pid": os.getpid(),
+        "state": shared_state.stats() if shared_state is not None else None,
+        "replica": replica.stats() if replica is not None and not IS_LEADER else None,
+        "forwarding": (leader_server or leader_client).stats() if (leader_server or leader_client) else None,
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of all server metrics"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cluster")
+async def cluster_info():
+    """Role of the worker that answered (leader or follower) and replication/forwarding counters"""
+    return {**cluster_stats(), "timestamp": datetime.now().isoformat()}
+
+@app.get("/ai_stats")
+async def ai_stats():
+    """AI inference statistics (batching, executor queue)"""
+    return {
+        "ai_enabled": AI_ENABLED,
+        **get_ai_stats(),
+        "executor": inference_pool.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """AI response cache and semantic cache hits, misses, evictions and memory"""
+    ai = get_ai_stats()
+    return {
+        "cache": ai.get("cache", {}),
+        "semantic_cache": ai.get("semantic_cache"),
+        "semantic_calibration": ai.get("semantic_calibration"),
+        "timestamp": datetime.now().isoformat()
+    }
+
 @app.get("/test-cors")
 async def test_cors():
     return {
@@ -479,18 +1473,19 @@ async def test_cors():
 @app.get("/debug")
 async def debug_info():
     """Debug endpoint to check all variables"""
+    state = device.snapshot()
     return {
-        "device_status": device_status,
-        "device_status_type": type(device_status).__name__,
-        "mqtt_connected": mqtt_connected,
-        "mqtt_connected_type": type(mqtt_connected).__name__,
-        "last_status_update": last_status_update,
-        "last_status_update_type": type(last_status_update).__name__ if last_status_update else "None",
+        "device_status": state["status"],
+        "device_status_type": type(state["status"]).__name__,
+        "mqtt_connected": mqtt_link.is_set(),
+        "last_status_update": state["last_update"],
+        "last_status_update_type": type(state["last_update"]).__name__ if state["last_update"] else "None",
+        "device_state_version": state["version"],
+        "device_history": device.history(20),
         "current_time": time.time(),
         "variables_defined": {
-            "device_status": "device_status" in globals(),
-            "mqtt_connected": "mqtt_connected" in globals(),
-            "last_status_update": "last_status_update" in globals(),
+            "device": "device" in globals(),
+            "mqtt_link": "mqtt_link" in globals(),
             "system_logs": "system_logs" in globals(),
         }
     }
@@ -501,18 +1496,30 @@ async def system_info():
     return {
         "server": {
             "status": "running",
-            "uptime": "N/A",  # Could implement with startup time
+            "uptime": str(timedelta(seconds=int(uptime_seconds()))),
+            "uptime_seconds": round(uptime_seconds(), 1),
             "ai_enabled": AI_ENABLED,
             "timestamp": datetime.now().isoformat()
         },
+        "ai": get_model_status(),
+        "websocket": broadcaster.stats(),
+        "fleet": {"enabled": FLEET_MODE, **fleet.stats()},
+        "orders": order_queue.stats(),
+        "liveness": liveness.stats(),
+        "emergency": stopper.stats(),
+        "history": history.stats() if history is not None else None,
+        "wearables": telemetry.stats() if telemetry is not None else None,
+        "cluster": cluster_stats(),
         "mqtt": {
-            "connected": mqtt_connected,
+            "connected": mqtt_link.is_set(),
             "broker": MQTT_BROKER,
-            "port": MQTT_PORT
+            "port": MQTT_PORT,
+            "publish": publisher.stats()
         },
         "device": {
-            "status": device_status,
-            "last_update": last_status_update
+            "status": device.status,
+            "last_update": device.last_update,
+            "history": device.history(10)
         },
         "noodles": [
             {"id": 1, "name": "Hot Spicy Ramen", "code": "noodle_1"},
@@ -521,17 +1528,3 @@ async def system_info():
             {"id": 4, "name": "Veg Clear Soup", "code": "noodle_4"}
         ]
     }
-
-# Background task to periodically check device status
-async def status_checker():
-    """Periodically check device status"""
-    while True:
-        try:
-            if mqtt_connected:
-                mqtt_publish(MQTT_TOPIC_COMMAND, "status")
-        except Exception as e:
-            logger.error(f"Error in status checker: {e}")
-        await asyncio.sleep(10)  # Check every 10 seconds
-
-
-
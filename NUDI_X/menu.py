@@ -0,0 +1,11 @@
+# menu.py - Noodle menu shared by the API and the AI model
+
+# Noodle mapping
+NOODLE_MAP = {
+    "Hot Spicy Ramen": "noodle_1",
+    "Chicken Noodles": "noodle_2",
+    "Cheese Noodles": "noodle_3",
+    "Veg Clear Soup": "noodle_4"
+}
+
+NOODLE_REVERSE_MAP = {v: k for k, v in NOODLE_MAP.items()}
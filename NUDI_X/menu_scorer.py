@@ -0,0 +1,127 @@
+# menu_scorer.py - Pick a menu item by scoring it, instead of generating free text
+#
+# For a prompt ending in "Assistant: I'll prepare", every menu item is a
+# candidate continuation (" Hot Spicy Ramen", " Chicken Noodles", ...).
+# Its log-likelihood under the model is the sum of its tokens' log
+# probabilities. The prompt is run once with use_cache=True; its key/value
+# cache is then shared by all candidates, which are scored together in one
+# batched forward pass. The result is deterministic (no sampling) and the
+# softmax over the candidates' log-likelihoods gives a confidence.
+import logging
+
+import torch
+
+from menu import NOODLE_MAP
+
+logger = logging.getLogger(__name__)
+
+
+def _repeat_cache(past, repeats):
+    """Expand a prompt's key/value cache so each prompt row serves `repeats` candidates"""
+    if hasattr(past, "batch_repeat_interleave"):  # transformers Cache object
+        past.batch_repeat_interleave(repeats)
+        return past
+    return tuple(tuple(t.repeat_interleave(repeats, dim=0) for t in layer) for layer in past)
+
+
+class MenuScorer:
+    """Batched log-likelihood of each menu item as the continuation of a prompt"""
+
+    def __init__(self, tokenizer, model, noodle_map=NOODLE_MAP, max_prompt_tokens=100):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.max_prompt_tokens = max_prompt_tokens
+        self.names = list(noodle_map)
+        self.codes = [noodle_map[n] for n in self.names]
+        self.use_cache = True  # turned off if the backend cannot take past_key_values
+
+        # Candidate token ids are fixed, so tokenize them once (right-padded)
+        pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+        ids = [tokenizer(" " + name, add_special_tokens=False)["input_ids"] for name in self.names]
+        width = max(len(i) for i in ids)
+        self.candidate_ids = torch.full((len(ids), width), pad_id, dtype=torch.long)
+        self.candidate_mask = torch.zeros((len(ids), width), dtype=torch.long)
+        for k, token_ids in enumerate(ids):
+            self.candidate_ids[k, :len(token_ids)] = torch.tensor(token_ids)
+            self.candidate_mask[k, :len(token_ids)] = 1
+
+    @property
+    def device(self):
+        return getattr(self.model, "device", torch.device("cpu"))
+
+    def score(self, prompts):
+        """Per prompt: (noodle_name, noodle_code, confidence, {name: log-likelihood})"""
+        log_likelihoods = self.log_likelihoods(prompts)  # (B, K)
+        probabilities = torch.softmax(log_likelihoods, dim=-1)
+        best = probabilities.argmax(dim=-1).tolist()
+        results = []
+        for row, k in enumerate(best):
+            scores = {name: round(float(v), 4) for name, v in zip(self.names, log_likelihoods[row])}
+            results.append((self.names[k], self.codes[k], round(float(probabilities[row, k]), 4), scores))
+        return results
+
+    def log_likelihoods(self, prompts):
+        """(len(prompts), len(menu)) tensor of summed candidate token log-probabilities"""
+        encoded = self.tokenizer(prompts, return_tensors="pt", padding=True)
+        device = self.device
+        # Keep the end of long prompts: the candidates must follow "I'll prepare"
+        input_ids = encoded["input_ids"][:, -self.max_prompt_tokens:].to(device)
+        mask = encoded["attention_mask"][:, -self.max_prompt_tokens:].to(device)
+        if self.use_cache:
+            try:
+                return self._score_cached(input_ids, mask)
+            except Exception as e:
+                self.use_cache = False
+                logger.warning(f"⚠️ Cached-prefix scoring unavailable on this backend ({e}), scoring full sequences")
+        return self._score_full(input_ids, mask)
+
+    def _score_cached(self, input_ids, mask):
+        """Prompt pass with use_cache, then all candidates in one pass over the shared cache"""
+        K = len(self.names)
+        device = input_ids.device
+        candidate_ids = self.candidate_ids.to(device)
+        candidate_mask = self.candidate_mask.to(device)
+        width = candidate_ids.shape[1]
+
+        # Left padding: positions count real tokens only
+        positions = (mask.cumsum(-1) - 1).clamp(min=0)
+        with torch.no_grad():
+            prompt = self.model(input_ids=input_ids, attention_mask=mask, position_ids=positions, use_cache=True)
+            first = torch.log_softmax(prompt.logits[:, -1, :].float(), dim=-1)  # next-token dist per prompt
+
+            B = input_ids.shape[0]
+            ids = candidate_ids.repeat(B, 1)  # row b*K + k = prompt b, candidate k
+            lengths = mask.sum(dim=1).repeat_interleave(K)
+            rows = self.model(
+                input_ids=ids,
+                attention_mask=torch.cat([mask.repeat_interleave(K, dim=0), candidate_mask.repeat(B, 1)], dim=1),
+                position_ids=lengths[:, None] + torch.arange(width, device=device),
+                past_key_values=_repeat_cache(prompt.past_key_values, K),
+                use_cache=False,
+            )
+            later = torch.log_softmax(rows.logits[:, :-1, :].float(), dim=-1)
+
+        # Token 0 comes from the prompt's last position, token j from candidate position j-1
+        token0 = first.repeat_interleave(K, dim=0).gather(1, ids[:, :1])
+        rest = later.gather(2, ids[:, 1:, None]).squeeze(-1)
+        token_scores = torch.cat([token0, rest], dim=1) * candidate_mask.repeat(B, 1)
+        return token_scores.sum(dim=1).view(B, K)
+
+    def _score_full(self, input_ids, mask):
+        """Fallback without a cache: prompt + candidate for every pair in one pass"""
+        K = len(self.names)
+        device = input_ids.device
+        candidate_ids = self.candidate_ids.to(device)
+        candidate_mask = self.candidate_mask.to(device)
+        B, L = input_ids.shape
+        width = candidate_ids.shape[1]
+
+        ids = torch.cat([input_ids.repeat_interleave(K, dim=0), candidate_ids.repeat(B, 1)], dim=1)
+        full_mask = torch.cat([mask.repeat_interleave(K, dim=0), candidate_mask.repeat(B, 1)], dim=1)
+        positions = (full_mask.cumsum(-1) - 1).clamp(min=0)
+        with torch.no_grad():
+            logits = self.model(input_ids=ids, attention_mask=full_mask, position_ids=positions).logits
+        # Logits at L-1 .. L+width-2 predict the candidate tokens
+        log_probs = torch.log_softmax(logits[:, L - 1:L + width - 1, :].float(), dim=-1)
+        token_scores = log_probs.gather(2, ids[:, L:, None]).squeeze(-1) * candidate_mask.repeat(B, 1)
+        return token_scores.sum(dim=1).view(B, K)
@@ -0,0 +1,264 @@
+# metrics.py - Low-overhead counters/gauges/histograms in Prometheus text format
+#
+# No client library needed: metrics live in a module-level REGISTRY and
+# GET /metrics renders them. Hot paths only do a dict lookup (cached
+# label child), one lock and an add; anything that can be read from an
+# existing stats() is exported by a collector at scrape time instead.
+import asyncio
+import bisect
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers sub-millisecond handlers up to slow generation
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+PROCESS_START_TIME = time.time()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class _Metric:
+    kind = None
+    child_class = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        return self.child_class()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+    child_class = _CounterChild
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    child_class = _GaugeChild
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _render_child(self, values, child):
+        with child._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            le = 'le="' + _format_value(float(bound)) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(float(total))}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Metrics plus scrape-time collectors.
+
+    A collector is a function returning (name, kind, help, samples) tuples
+    where samples is a list of (labels dict, value).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    label_text = _format_labels(labels.keys(), labels.values()) if labels else ""
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- shared metrics --------------------------------------------------------------
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("route", "method", "status")
+)
+AI_STAGE_SECONDS = Histogram(
+    "ai_inference_stage_seconds", "Model inference time per stage (tokenize, generate, decode)", ("stage",)
+)
+AI_BATCH_SIZE = Histogram(
+    "ai_generate_batch_size", "Prompts per generate() call", buckets=(1, 2, 4, 8, 16, 32)
+)
+AI_DECISIONS = Counter("ai_decisions_total", "AI decisions by source (cache, semantic, menu, keyword, model, fallback)", ("source",))
+MQTT_MESSAGES_IN = Counter("mqtt_messages_received_total", "MQTT messages received by topic pattern", ("topic",))
+MQTT_MESSAGES_OUT = Counter("mqtt_messages_published_total", "MQTT messages published by topic pattern", ("topic",))
+MQTT_ON_MESSAGE_SECONDS = Histogram(
+    "mqtt_on_message_seconds", "Time spent in on_message on the MQTT network thread",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+)
+MQTT_INGEST_SECONDS = Histogram(
+    "mqtt_ingest_handle_seconds", "Time the ingest worker spends applying one MQTT message",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds", "Delay of a periodic asyncio timer beyond its schedule",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+EVENT_LOOP_LAG_LAST = Gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample")
+
+
+def _resident_memory_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak, KB on Linux
+        except ImportError:
+            return None
+
+
+def _process_collector():
+    times = os.times()
+    return [
+        ("process_cpu_seconds_total", "counter", "User and system CPU time", [({}, times.user + times.system)]),
+        ("process_resident_memory_bytes", "gauge", "Resident memory size", [({}, _resident_memory_bytes())]),
+        ("process_start_time_seconds", "gauge", "Start time of the process (unix seconds)", [({}, PROCESS_START_TIME)]),
+        ("process_uptime_seconds", "gauge", "Seconds since the process started", [({}, time.time() - PROCESS_START_TIME)]),
+        ("process_threads", "gauge", "Python threads", [({}, threading.active_count())]),
+    ]
+
+
+REGISTRY.add_collector(_process_collector)
+
+
+def uptime_seconds():
+    return time.time() - PROCESS_START_TIME
+
+
+async def monitor_event_loop_lag(interval=0.5):
+    """Sleep `interval` repeatedly; any extra delay is time the loop was blocked"""
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - scheduled)
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
+        EVENT_LOOP_LAG_LAST.set(lag)
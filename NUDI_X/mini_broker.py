@@ -0,0 +1,288 @@
+# mini_broker.py - Small asyncio MQTT 3.1.1 broker for offline testing
+#
+# Stand-in for broker.hivemq.com when load testing on a laptop:
+#   python mini_broker.py --port 1883
+#   MQTT_BROKER=127.0.0.1 uvicorn main:app
+#
+# Supports what the server, the ESP32 firmware and device_simulator.py use:
+# QoS 0/1/2 publish, + and # wildcards, retained messages, last will,
+# keepalive and clean sessions. No persistence, auth or bridging.
+import argparse
+import asyncio
+import struct
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def topic_matches(topic_filter, topic):
+    """MQTT filter matching with + (one level) and # (rest of the topic)"""
+    filter_parts = topic_filter.split("/")
+    topic_parts = topic.split("/")
+    for i, part in enumerate(filter_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != "+" and part != topic_parts[i]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+def _encode_length(n):
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
+
+
+def _packet(kind, flags, body):
+    return bytes([(kind << 4) | flags]) + _encode_length(len(body)) + body
+
+
+def _string(data, offset):
+    (length,) = struct.unpack_from("!H", data, offset)
+    start = offset + 2
+    return data[start:start + length], start + length
+
+
+def _encode_string(value):
+    return struct.pack("!H", len(value)) + value
+
+
+class _Session:
+    __slots__ = ("client_id", "writer", "subscriptions", "will", "next_pid", "inbound_qos2", "clean_exit")
+
+    def __init__(self, writer):
+        self.client_id = None
+        self.writer = writer
+        self.subscriptions = {}  # filter -> granted qos
+        self.will = None  # (topic, payload, qos, retain)
+        self.next_pid = 0
+        self.inbound_qos2 = set()
+        self.clean_exit = False
+
+    def packet_id(self):
+        self.next_pid = self.next_pid % 65535 + 1
+        return self.next_pid
+
+
+class MiniBroker:
+    """Single event loop broker; every session is one reader task"""
+
+    def __init__(self, host="127.0.0.1", port=1883):
+        self.host = host
+        self.port = port
+        self._sessions = {}  # client_id -> _Session
+        self._retained = {}  # topic -> (payload, qos)
+        self._server = None
+        self.messages_in = 0
+        self.messages_out = 0
+        self.connections = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"✅ Mini broker listening on {self.host}:{self.port}")
+        return self
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for session in list(self._sessions.values()):
+            session.writer.close()
+
+    def stats(self):
+        return {
+            "clients": len(self._sessions),
+            "connections": self.connections,
+            "retained": len(self._retained),
+            "messages_in": self.messages_in,
+            "messages_out": self.messages_out,
+        }
+
+    # --- delivery ------------------------------------------------------------
+
+    def _send(self, session, topic, payload, qos, retain=False):
+        flags = (qos << 1) | (1 if retain else 0)
+        body = _encode_string(topic)
+        if qos:
+            body += struct.pack("!H", session.packet_id())
+        session.writer.write(_packet(PUBLISH, flags, body + payload))
+        self.messages_out += 1
+
+    def _route(self, topic, payload, qos, retain):
+        self.messages_in += 1
+        name = topic.decode("utf-8", "replace")
+        if retain:
+            if payload:
+                self._retained[name] = (payload, qos)
+            else:
+                self._retained.pop(name, None)
+        for session in list(self._sessions.values()):
+            granted = max(
+                (q for f, q in session.subscriptions.items() if topic_matches(f, name)),
+                default=None
+            )
+            if granted is not None:
+                self._send(session, topic, payload, min(qos, granted))
+
+    # --- connection handling -------------------------------------------------
+
+    async def _read_packet(self, reader, timeout):
+        header = await asyncio.wait_for(reader.readexactly(1), timeout)
+        multiplier, length = 1, 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        body = await reader.readexactly(length) if length else b""
+        return header[0] >> 4, header[0] & 0x0F, body
+
+    async def _handle(self, reader, writer):
+        session = _Session(writer)
+        keepalive = 60
+        try:
+            kind, _, body = await self._read_packet(reader, 10)
+            if kind != CONNECT:
+                return
+            keepalive = self._connect(session, body)
+            self.connections += 1
+
+            while True:
+                # Spec: drop the client after 1.5x keepalive without any packet
+                kind, flags, body = await self._read_packet(reader, keepalive * 1.5 if keepalive else None)
+                if kind == PUBLISH:
+                    self._publish(session, flags, body)
+                elif kind == PUBREL:
+                    (pid,) = struct.unpack_from("!H", body)
+                    session.inbound_qos2.discard(pid)
+                    writer.write(_packet(PUBCOMP, 0, struct.pack("!H", pid)))
+                elif kind == PUBREC:
+                    writer.write(_packet(PUBREL, 2, body[:2]))
+                elif kind == SUBSCRIBE:
+                    self._subscribe(session, body)
+                elif kind == UNSUBSCRIBE:
+                    (pid,) = struct.unpack_from("!H", body)
+                    offset = 2
+                    while offset < len(body):
+                        topic_filter, offset = _string(body, offset)
+                        session.subscriptions.pop(topic_filter.decode(), None)
+                    writer.write(_packet(UNSUBACK, 0, struct.pack("!H", pid)))
+                elif kind == PINGREQ:
+                    writer.write(_packet(PINGRESP, 0, b""))
+                elif kind == DISCONNECT:
+                    session.clean_exit = True
+                    break
+                # PUBACK / PUBCOMP from subscribers need no action (no redelivery)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Mini broker session error: {e}")
+        finally:
+            if session.client_id is not None and self._sessions.get(session.client_id) is session:
+                del self._sessions[session.client_id]
+                if session.will and not session.clean_exit:
+                    self._route(*session.will)
+            writer.close()
+
+    def _connect(self, session, body):
+        _, offset = _string(body, 0)  # "MQTT" (3.1.1) or "MQIsdp" (3.1)
+        offset += 1  # protocol level
+        flags = body[offset]
+        (keepalive,) = struct.unpack_from("!H", body, offset + 1)
+        offset += 3
+        client_id, offset = _string(body, offset)
+        client_id = client_id.decode() or f"anon-{id(session)}"
+        if flags & 0x04:
+            will_topic, offset = _string(body, offset)
+            will_payload, offset = _string(body, offset)
+            session.will = (will_topic, will_payload, (flags >> 3) & 0x03, bool(flags & 0x20))
+
+        previous = self._sessions.get(client_id)
+        if previous is not None:
+            previous.clean_exit = True  # taken over, no last will
+            previous.writer.close()
+        session.client_id = client_id
+        self._sessions[client_id] = session
+        session.writer.write(_packet(CONNACK, 0, b"\x00\x00"))
+        return keepalive
+
+    def _publish(self, session, flags, body):
+        qos = (flags >> 1) & 0x03
+        retain = bool(flags & 0x01)
+        topic, offset = _string(body, 0)
+        pid = None
+        if qos:
+            (pid,) = struct.unpack_from("!H", body, offset)
+            offset += 2
+        payload = body[offset:]
+
+        if qos == 1:
+            session.writer.write(_packet(PUBACK, 0, struct.pack("!H", pid)))
+        elif qos == 2:
+            session.writer.write(_packet(PUBREC, 0, struct.pack("!H", pid)))
+            if pid in session.inbound_qos2:
+                return  # duplicate before PUBREL, already routed
+            session.inbound_qos2.add(pid)
+        self._route(topic, payload, qos, retain)
+
+    def _subscribe(self, session, body):
+        (pid,) = struct.unpack_from("!H", body)
+        offset = 2
+        granted = []
+        new_filters = []
+        while offset < len(body):
+            topic_filter, offset = _string(body, offset)
+            qos = min(body[offset] & 0x03, 2)
+            offset += 1
+            session.subscriptions[topic_filter.decode()] = qos
+            new_filters.append((topic_filter.decode(), qos))
+            granted.append(qos)
+        session.writer.write(_packet(SUBACK, 0, struct.pack("!H", pid) + bytes(granted)))
+        for topic, (payload, qos) in list(self._retained.items()):
+            for topic_filter, granted_qos in new_filters:
+                if topic_matches(topic_filter, topic):
+                    self._send(session, topic.encode(), payload, min(qos, granted_qos), retain=True)
+                    break
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local MQTT broker for offline load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--stats-every", type=float, default=0, help="print stats every N seconds (0 = off)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def run():
+        broker = await MiniBroker(args.host, args.port).start()
+        if args.stats_every:
+            while True:
+                await asyncio.sleep(args.stats_every)
+                print(f"[{time.strftime('%H:%M:%S')}] {broker.stats()}")
+        else:
+            await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
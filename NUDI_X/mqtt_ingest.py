@@ -0,0 +1,222 @@
+# mqtt_ingest.py - Fast path for inbound MQTT messages
+#
+# paho calls on_message on its single network thread, so anything slow
+# there delays every other message (and keepalives). The network thread
+# now only classifies the topic (a dict lookup after the first message on
+# it), takes one timestamp and appends to a bounded queue; a worker thread
+# drains the queue in batches and runs the server's handler.
+#
+# Per-message work that used to be repeated is done once:
+#   - topic -> (device_id, kind, metric label) is cached per topic
+#   - the serial-monitor markers are one compiled regex instead of an any() scan
+#   - "%H:%M:%S" is formatted once per second, not per log line
+#   - per-message INFO logging is rate limited, with a count of what was skipped
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import logging
+
+from fleet import DEFAULT_DEVICE_ID, parse_topic
+
+logger = logging.getLogger(__name__)
+
+# Payloads containing any of these are ESP32 serial output worth showing in the serial monitor
+SERIAL_MARKERS = ("✅", "❌", "📨", "📡", "📏", "🍜", "⚠️", "Dispensing", "Distance:", "DROP", "connected")
+SERIAL_PATTERN = re.compile("|".join(re.escape(m) for m in SERIAL_MARKERS))
+
+# Never dropped when the queue is full; the network thread waits for room instead
+CRITICAL_KINDS = frozenset(("status", "heartbeat", "drop_detected"))
+
+
+def is_serial_output(payload):
+    return SERIAL_PATTERN.search(payload) is not None
+
+
+class Route:
+    """Classification of one topic, computed once and reused for every message on it"""
+    __slots__ = ("topic", "device_id", "kind", "label", "prefix", "critical", "counter")
+
+    def __init__(self, topic, device_id, kind, label, counter=None):
+        self.topic = topic
+        self.device_id = device_id
+        self.kind = kind
+        self.label = label
+        # Log prefix so fleet lines say which machine they came from
+        self.prefix = "" if device_id in (None, DEFAULT_DEVICE_ID) else f"[{device_id}] "
+        self.critical = kind in CRITICAL_KINDS
+        self.counter = counter  # pre-resolved metric child, or None
+
+
+class TopicClassifier:
+    """topic -> Route cache; `label_for(device_id, kind)` names the metric series"""
+
+    def __init__(self, label_for, counter=None, max_topics=10000):
+        self.label_for = label_for
+        self.counter = counter
+        self.max_topics = max_topics
+        self._routes = {}
+
+    def classify(self, topic):
+        route = self._routes.get(topic)
+        if route is None:
+            device_id, kind = parse_topic(topic)
+            label = self.label_for(device_id, kind)
+            route = Route(topic, device_id, kind, label,
+                          self.counter.labels(label) if self.counter is not None else None)
+            if len(self._routes) >= self.max_topics:
+                self._routes.clear()  # bogus topics must not grow this without bound
+            self._routes[topic] = route
+        return route
+
+    def __len__(self):
+        return len(self._routes)
+
+
+class ClockText:
+    """time.time() -> "%H:%M:%S", reformatted only when the second changes"""
+
+    def __init__(self):
+        self._second = None
+        self._text = ""
+
+    def __call__(self, ts=None):
+        ts = time.time() if ts is None else ts
+        second = int(ts)
+        if second != self._second:
+            # A racing thread at worst formats the same second twice
+            self._text = datetime.fromtimestamp(second).strftime("%H:%M:%S")
+            self._second = second
+        return self._text
+
+
+class RateLimitedLog:
+    """Allow at most `per_second` lines per second; reports how many were skipped"""
+
+    def __init__(self, per_second=5):
+        self.per_second = per_second
+        self._window = 0
+        self._used = 0
+        self._suppressed = 0
+        self.suppressed_total = 0
+
+    def allow(self):
+        """None if this line should be skipped, otherwise the count skipped since the last one"""
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window = window
+            self._used = 0
+        if self._used >= self.per_second:
+            self._suppressed += 1
+            self.suppressed_total += 1
+            return None
+        self._used += 1
+        skipped, self._suppressed = self._suppressed, 0
+        return skipped
+
+
+class IngestQueue:
+    """Bounded hand-off from the MQTT network thread to one worker thread.
+
+    A single worker keeps messages in arrival order. When the queue is full,
+    log/location chatter is dropped and counted; status, heartbeat and drop
+    events make the network thread wait (up to `block_timeout`), which slows
+    the broker connection down instead of losing a state change.
+    """
+
+    def __init__(self, handler, maxsize=10000, block_timeout=1.0, name="mqtt-ingest"):
+        self.handler = handler  # handler(route, payload_bytes, timestamp, retained)
+        self.maxsize = max(1, int(maxsize))
+        self.block_timeout = block_timeout
+        self.name = name
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._busy = False
+        self._thread = None
+        self._closed = False
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._closed = False
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def put(self, route, payload, timestamp, block=None, retained=False):
+        """Queue one message; False if it was dropped. block=None decides by route.critical"""
+        block = route.critical if block is None else block
+        with self._lock:
+            self.received += 1
+            if len(self._items) >= self.maxsize:
+                if not block or not self._not_full.wait_for(
+                    lambda: len(self._items) < self.maxsize or self._closed, self.block_timeout
+                ):
+                    self.dropped += 1
+                    return False
+            self._items.append((route, payload, timestamp, retained))
+            depth = len(self._items)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            if depth == 1:
+                self._not_empty.notify()
+        return True
+
+    def wait_idle(self, timeout=None):
+        """Block until everything queued so far has been handled"""
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._items and not self._busy, timeout)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._items and not self._closed:
+                    self._busy = False
+                    self._idle.notify_all()
+                    self._not_empty.wait()
+                if self._closed and not self._items:
+                    self._busy = False
+                    self._idle.notify_all()
+                    return
+                batch, self._items = self._items, deque()
+                self._busy = True
+                self._not_full.notify_all()
+            for route, payload, timestamp, retained in batch:
+                try:
+                    self.handler(route, payload, timestamp, retained)
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"Error processing MQTT message on {route.topic}: {e}")
+            self.processed += len(batch)
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        return {
+            "depth": len(self._items),
+            "max_depth": self.max_depth,
+            "capacity": self.maxsize,
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "running": self._thread is not None,
+        }
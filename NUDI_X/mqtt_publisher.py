@@ -0,0 +1,212 @@
+# mqtt_publisher.py - MQTT publish that completes on broker acknowledgement
+import asyncio
+import bisect
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import NamedTuple, Optional
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+# Publish-to-ack latency histogram bucket upper bounds (ms)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class PublishResult(NamedTuple):
+    delivered: bool
+    attempts: int
+    latency_ms: Optional[float] = None
+    error: Optional[str] = None
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram; the last bucket counts everything above the bounds"""
+
+    __slots__ = ("counts", "count", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS_MS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max_ms, 2),
+            "buckets": dict(zip([f"le_{b}" for b in LATENCY_BUCKETS_MS] + ["inf"], self.counts)),
+        }
+
+
+class AckPublisher:
+    """Tracks paho message ids until the broker acknowledges them.
+
+    `publish_nowait` may be called from any thread and returns a
+    concurrent Future resolved by `on_publish` (PUBACK for QoS 1,
+    PUBCOMP for QoS 2). `publish` is the awaitable form with a bounded
+    in-flight window, an ack timeout and retries.
+
+    paho calls on_publish while holding its own message lock, so our lock
+    is never held across client.publish(); acks that arrive before the
+    mid is registered are parked in `_early`.
+    """
+
+    def __init__(self, window=32, timeout=5.0, retries=2):
+        self.window = max(1, int(window))
+        self.timeout = timeout
+        self.retries = retries
+        self.client = None
+        self._lock = threading.Lock()
+        self._pending = {}  # mid -> (future, topic, sent_at)
+        self._early = OrderedDict()  # mid -> ack time, for acks seen before registration
+        self._semaphore = None
+        self._histograms = {}
+        self._published = 0
+        self._acked = 0
+        self._timeouts = 0
+        self._retries = 0
+        self._rejected = 0
+
+    def set_client(self, client):
+        self.client = client
+        client.on_publish = self.on_publish
+        client.max_inflight_messages_set(self.window)
+
+    # --- paho callback (network thread) ------------------------------------
+
+    def on_publish(self, client, userdata, mid):
+        now = time.perf_counter()
+        with self._lock:
+            entry = self._pending.pop(mid, None)
+            if entry is None:
+                self._early[mid] = now
+                while len(self._early) > 1024:
+                    self._early.popitem(last=False)
+                return
+            self._record(entry, now)
+
+    def _record(self, entry, acked_at):
+        future, topic, sent_at = entry
+        latency_ms = (acked_at - sent_at) * 1000
+        self._acked += 1
+        histogram = self._histograms.get(topic)
+        if histogram is None:
+            histogram = self._histograms[topic] = LatencyHistogram()
+        histogram.add(latency_ms)
+        if not future.done():
+            future.set_result(latency_ms)
+
+    # --- publishing ----------------------------------------------------------
+
+    def _expire(self, now):
+        """Fail futures whose ack is overdue (called with the lock held)"""
+        for mid, (future, topic, sent_at) in list(self._pending.items()):
+            if now - sent_at > self.timeout:
+                del self._pending[mid]
+                self._timeouts += 1
+                if not future.done():
+                    future.set_exception(TimeoutError(f"no ack for {topic} after {self.timeout}s"))
+
+    def publish_nowait(self, topic, payload, qos=1, retain=False):
+        """Publish and return a Future of the ack latency (ms), or None if not sent"""
+        client = self.client
+        if client is None:
+            return None
+        with self._lock:
+            self._expire(time.perf_counter())
+            if len(self._pending) >= self.window:
+                self._rejected += 1
+                return None
+
+        sent_at = time.perf_counter()
+        result = client.publish(topic, payload, qos=qos, retain=retain)
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.error(f"Failed to publish to {topic}, rc={result.rc}")
+            return None
+
+        future = Future()
+        with self._lock:
+            self._published += 1
+            entry = (future, topic, sent_at)
+            acked_at = self._early.pop(result.mid, None)
+            if acked_at is not None:
+                self._record(entry, acked_at)
+            else:
+                self._pending[result.mid] = entry
+        return future
+
+    async def publish(self, topic, payload, qos=1, retain=False, timeout=None, retries=None):
+        """Publish and wait for the broker ack, retrying on timeout"""
+        timeout = timeout if timeout is not None else self.timeout
+        retries = retries if retries is not None else self.retries
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.window)
+
+        attempts = 0
+        error = None
+        async with self._semaphore:
+            while attempts <= retries:
+                attempts += 1
+                if attempts > 1:
+                    self._retries += 1
+                future = self.publish_nowait(topic, payload, qos, retain)
+                if future is None:
+                    error = "not sent (disconnected or in-flight window full)"
+                    await asyncio.sleep(min(0.1 * attempts, 1.0))
+                    continue
+                try:
+                    latency_ms = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+                    return PublishResult(True, attempts, round(latency_ms, 2))
+                except (asyncio.TimeoutError, TimeoutError):
+                    error = f"no ack after {timeout}s"
+        return PublishResult(False, attempts, None, error)
+
+    @staticmethod
+    async def wait(future, timeout):
+        """Await a publish_nowait future; PublishResult with a single attempt"""
+        if future is None:
+            return PublishResult(False, 1, None, "not sent")
+        try:
+            latency_ms = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+            return PublishResult(True, 1, round(latency_ms, 2))
+        except (asyncio.TimeoutError, TimeoutError):
+            return PublishResult(False, 1, None, f"no ack after {timeout}s")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "published": self._published,
+                "acked": self._acked,
+                "in_flight": len(self._pending),
+                "window": self.window,
+                "timeouts": self._timeouts,
+                "retries": self._retries,
+                "rejected": self._rejected,
+                "ack_latency": {topic: h.to_dict() for topic, h in self._histograms.items()},
+            }
@@ -0,0 +1,559 @@
+# order_queue.py - Durable order queue and dispatcher for vending machines
+#
+# Lifecycle: queued -> sent -> dispensing -> done
+#                         \-> failed (publish error, no ack, busy too often,
+#                                     drop timeout, emergency stop)
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+QUEUED, SENT, DISPENSING, DONE, FAILED = "queued", "sent", "dispensing", "done", "failed"
+ACTIVE_STATES = (SENT, DISPENSING)
+FINAL_STATES = (DONE, FAILED)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Order:
+    __slots__ = (
+        "order_id", "device_id", "noodle_code", "noodle_name", "source",
+        "idempotency_key", "state", "attempts", "error",
+        "created_at", "sent_at", "started_at", "finished_at",
+    )
+
+    def __init__(self, order_id, device_id, noodle_code, noodle_name, source, idempotency_key=None):
+        self.order_id = order_id
+        self.device_id = device_id
+        self.noodle_code = noodle_code
+        self.noodle_name = noodle_name
+        self.source = source
+        self.idempotency_key = idempotency_key
+        self.state = QUEUED
+        self.attempts = 0
+        self.error = None
+        self.created_at = time.time()
+        self.sent_at = None
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        order = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(order, name, data.get(name))
+        order.attempts = order.attempts or 0
+        return order
+
+
+class OrderQueue:
+    """Per-device FIFO of orders with idempotency keys and a JSON-lines journal.
+
+    Every state change is appended to `journal_path` and fsync'd before the
+    caller hears about it; on start the journal is replayed so queued orders
+    survive a restart. Orders that were already sent when the server stopped
+    are marked failed rather than resent, to avoid dispensing twice.
+
+    An order requeued after `ack_timeout` stays linked to its device until
+    it is sent again: if the device reports dispensing that noodle late
+    (slow hardware), the order resumes as dispensing instead of being sent
+    a second time.
+
+    Journal lines are handed to a writer thread, which writes whatever has
+    accumulated and fsyncs once per batch (group commit), so no caller
+    waits on the disk while holding the queue lock. Callers that must not
+    report an order before it is durable await `synced()`. Once
+    `compact_after` orders have finished since the last compaction, the
+    writer rewrites the journal with only the latest state of each order.
+    """
+
+    def __init__(self, journal_path=None, ack_timeout=10.0, dispense_timeout=300.0,
+                 max_attempts=3, history_size=1000, compact_after=1000):
+        self.journal_path = journal_path
+        self.ack_timeout = ack_timeout
+        self.dispense_timeout = dispense_timeout
+        self.max_attempts = max_attempts
+        self.history_size = history_size
+        self.compact_after = compact_after
+
+        self._lock = threading.RLock()
+        self._queues = {}  # device_id -> deque[Order]
+        self._active = {}  # device_id -> Order (sent/dispensing)
+        self._orders = OrderedDict()  # order_id -> Order, bounded to recent history
+        self._keys = {}  # idempotency_key -> (order_id, expires_at)
+        self._unconfirmed = {}  # device_id -> Order requeued without a response, may still dispense
+        self._ids = itertools.count(1)
+        self._journal = None
+        self._listeners = []
+
+        # Journal writer; _journal_cond is only ever taken inside _lock, never around it
+        self._journal_cond = threading.Condition()
+        self._pending = []  # journal lines not yet written
+        self._appended = 0  # lines handed to the writer
+        self._synced = 0  # lines known to be on disk
+        self._sync_waiters = []  # (line count, loop, future)
+        self._finished_since_compact = 0
+        self._writer_thread = None
+        self._closing = False
+        self._fsyncs = 0
+        self._compactions = 0
+
+        # Metrics
+        self._counts = {QUEUED: 0, SENT: 0, DISPENSING: 0, DONE: 0, FAILED: 0}
+        self._duplicates = 0
+        self._wait_total = 0.0
+        self._wait_count = 0
+        self._wait_max = 0.0
+        self._recent_waits = deque(maxlen=500)
+
+        if journal_path:
+            self.open_journal(journal_path)
+
+    # --- journal ---------------------------------------------------------
+
+    def add_listener(self, listener):
+        """listener(order_dict) after every change, called with the queue lock held"""
+        self._listeners.append(listener)
+
+    def _write(self, order):
+        record = order.to_dict()
+        for listener in self._listeners:
+            try:
+                listener(record)
+            except Exception as e:
+                logger.error(f"Order listener failed: {e}")
+        if self._journal is None:
+            return
+        with self._journal_cond:
+            self._pending.append(json.dumps(record) + "\n")
+            self._appended += 1
+            if order.state in FINAL_STATES:
+                self._finished_since_compact += 1
+            self._journal_cond.notify()
+
+    def open_journal(self, journal_path):
+        """Replay and compact `journal_path`, then append every change to it.
+
+        In a multi-worker deployment only the leader calls this, once it
+        holds the lock; a second process compacting the file would cut
+        the leader off from it.
+        """
+        with self._lock:
+            self.journal_path = journal_path
+            self._replay()
+            self._journal = open(journal_path, "a", encoding="utf-8")
+            self._closing = False
+            self._writer_thread = threading.Thread(target=self._run_writer, name="order-journal", daemon=True)
+            self._writer_thread.start()
+
+    def _run_writer(self):
+        """Writer thread: write and fsync everything pending as one batch, compact when due"""
+        while True:
+            with self._journal_cond:
+                while not self._pending and not self._closing:
+                    self._journal_cond.wait()
+                if not self._pending:
+                    return
+                lines, self._pending = self._pending, []
+                written = self._appended
+                compact = self._finished_since_compact >= self.compact_after
+            try:
+                self._journal.write("".join(lines))
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._fsyncs += 1
+            except OSError as e:
+                logger.error(f"Order journal write failed: {e}")
+            if compact:
+                written = self._compact()
+            self._mark_synced(written)
+
+    def _compact(self):
+        """Rewrite the journal from memory on the writer thread. Returns the lines it covers"""
+        with self._lock:
+            records = [order.to_dict() for order in self._orders.values()]
+            with self._journal_cond:
+                # Every pending line is an older copy of something in records
+                self._pending = []
+                written = self._appended
+                self._finished_since_compact = 0
+        try:
+            self._rewrite(records)
+            self._journal.close()
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+            self._compactions += 1
+            logger.info(f"🗜️ Order journal compacted to {len(records)} orders")
+        except OSError as e:
+            logger.error(f"Order journal compaction failed: {e}")
+        return written
+
+    def _rewrite(self, records):
+        """Atomically replace the journal with one line per record"""
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def _mark_synced(self, written):
+        with self._journal_cond:
+            self._synced = max(self._synced, written)
+            done = [w for w in self._sync_waiters if w[0] <= self._synced]
+            self._sync_waiters = [w for w in self._sync_waiters if w[0] > self._synced]
+            self._journal_cond.notify_all()
+        for _, loop, future in done:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                pass  # loop closed
+
+    async def synced(self):
+        """Wait until every change made so far is on disk (no-op without a journal)"""
+        with self._journal_cond:
+            target = self._appended
+            if self._journal is None or self._synced >= target:
+                return
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._sync_waiters.append((target, loop, future))
+        await future
+
+    def flush(self, timeout=None):
+        """Block until every change made so far is on disk; False on timeout"""
+        with self._journal_cond:
+            target = self._appended
+            return self._journal_cond.wait_for(
+                lambda: self._journal is None or self._synced >= target, timeout
+            )
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        latest = OrderedDict()
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    continue
+                latest[data["order_id"]] = data
+
+        max_numeric = 0
+        for data in latest.values():
+            order = Order.from_dict(data)
+            if order.state in ACTIVE_STATES:
+                order.state = FAILED
+                order.error = "server restarted while order was in progress"
+                order.finished_at = time.time()
+            if order.state == QUEUED:
+                self._queues.setdefault(order.device_id, deque()).append(order)
+                if order.idempotency_key:
+                    self._keys[order.idempotency_key] = (order.order_id, time.time() + 600.0)
+            self._remember(order)
+            try:
+                max_numeric = max(max_numeric, int(order.order_id.rsplit("-", 1)[-1]))
+            except ValueError:
+                pass
+        self._ids = itertools.count(max_numeric + 1)
+
+        # Compact: rewrite the journal with only the latest state of recent orders
+        self._rewrite([order.to_dict() for order in self._orders.values()])
+        queued = sum(len(q) for q in self._queues.values())
+        logger.info(f"✅ Order journal replayed: {len(self._orders)} orders, {queued} still queued")
+
+    def _remember(self, order):
+        self._orders[order.order_id] = order
+        self._orders.move_to_end(order.order_id)
+        while len(self._orders) > self.history_size:
+            oldest_id, oldest = next(iter(self._orders.items()))
+            if oldest.state not in FINAL_STATES:
+                break
+            del self._orders[oldest_id]
+
+    def close(self):
+        """Write what is pending, stop the writer and close the journal"""
+        writer = self._writer_thread
+        if writer is not None:
+            with self._journal_cond:
+                self._closing = True
+                self._journal_cond.notify()
+            writer.join()
+            self._writer_thread = None
+        if self._journal is not None:
+            with self._journal_cond:
+                self._journal.close()
+                self._journal = None
+                self._journal_cond.notify_all()
+
+    # --- API -------------------------------------------------------------
+
+    def submit(self, device_id, noodle_code, noodle_name, source="chat",
+               idempotency_key=None, key_ttl=600.0):
+        """Queue an order; returns (order, created). A repeated key returns the original order."""
+        now = time.time()
+        with self._lock:
+            if idempotency_key:
+                known = self._keys.get(idempotency_key)
+                if known and known[1] > now and known[0] in self._orders:
+                    self._duplicates += 1
+                    return self._orders[known[0]], False
+
+            order = Order(f"ord-{next(self._ids)}", device_id, noodle_code, noodle_name,
+                          source, idempotency_key)
+            self._queues.setdefault(device_id, deque()).append(order)
+            self._remember(order)
+            if idempotency_key:
+                self._keys[idempotency_key] = (order.order_id, now + key_ttl)
+                if len(self._keys) > self.history_size * 2:
+                    self._keys = {k: v for k, v in self._keys.items() if v[1] > now}
+            self._counts[QUEUED] += 1
+            self._write(order)
+            return order, True
+
+    def get(self, order_id):
+        return self._orders.get(order_id)
+
+    def position(self, order):
+        """1-based position in its device queue (0 if no longer queued)"""
+        with self._lock:
+            queue = self._queues.get(order.device_id, ())
+            for index, queued in enumerate(queue, start=1):
+                if queued is order:
+                    return index
+        return 0
+
+    def depth(self, device_id=None):
+        with self._lock:
+            if device_id is not None:
+                return len(self._queues.get(device_id, ()))
+            return sum(len(q) for q in self._queues.values())
+
+    def recent(self, state=None, device_id=None, limit=50):
+        with self._lock:
+            orders = [
+                o for o in reversed(self._orders.values())
+                if (state is None or o.state == state) and (device_id is None or o.device_id == device_id)
+            ]
+        return [o.to_dict() for o in orders[:limit]]
+
+    def _set_state(self, order, state, error=None):
+        order.state = state
+        now = time.time()
+        if state == SENT:
+            order.sent_at = now
+            order.attempts += 1
+        elif state == DISPENSING:
+            order.started_at = now
+        elif state in FINAL_STATES:
+            order.finished_at = now
+            order.error = error
+            if self._active.get(order.device_id) is order:
+                del self._active[order.device_id]
+        self._counts[state] += 1
+        self._write(order)
+
+    def _requeue_or_fail(self, order, reason):
+        if self._active.get(order.device_id) is order:
+            del self._active[order.device_id]
+        if order.attempts >= self.max_attempts:
+            self._set_state(order, FAILED, reason)
+            logger.warning(f"⚠️ Order {order.order_id} failed: {reason}")
+        else:
+            order.state = QUEUED
+            self._queues.setdefault(order.device_id, deque()).appendleft(order)
+            self._write(order)
+
+    def take_next(self, device_id):
+        """Pop the next order for a free device and mark it sent (None if nothing to do)"""
+        with self._lock:
+            if device_id in self._active:
+                return None
+            queue = self._queues.get(device_id)
+            if not queue:
+                return None
+            order = queue.popleft()
+            if self._unconfirmed.get(device_id) is order:
+                del self._unconfirmed[device_id]  # resent: its reports now go to the active order
+            first_send = order.sent_at is None
+            self._active[device_id] = order
+            self._set_state(order, SENT)
+            if first_send:
+                wait = order.sent_at - order.created_at
+                self._wait_total += wait
+                self._wait_count += 1
+                self._wait_max = max(self._wait_max, wait)
+                self._recent_waits.append(wait)
+            return order
+
+    def send_failed(self, order, reason="publish failed"):
+        with self._lock:
+            self._requeue_or_fail(order, reason)
+
+    def devices_with_work(self):
+        with self._lock:
+            return [d for d, q in self._queues.items() if q and d not in self._active]
+
+    def on_device_status(self, device_id, status):
+        """Advance the device's active order from a status report"""
+        with self._lock:
+            order = self._active.get(device_id)
+            if order is None:
+                if status.startswith("dispensing"):
+                    self._resume_unconfirmed(device_id, status)
+                return
+            if status.startswith("dispensing"):
+                if order.state == SENT:
+                    self._set_state(order, DISPENSING)
+            elif status == "ready":
+                if order.state == DISPENSING:
+                    self._set_state(order, DONE)
+            elif status == "busy":
+                # Device rejected the command; try again once it is ready
+                if order.state == SENT:
+                    self._requeue_or_fail(order, "device busy")
+            elif status.startswith("emergency"):
+                self._set_state(order, FAILED, "emergency stop")
+
+    def _resume_unconfirmed(self, device_id, status):
+        """A late "dispensing_<noodle>" for an order requeued after no response: it is running"""
+        order = self._unconfirmed.pop(device_id, None)
+        if order is None or order.state != QUEUED or status != f"dispensing_{order.noodle_code}":
+            return
+        queue = self._queues.get(device_id)
+        if queue is None or order not in queue:
+            return
+        queue.remove(order)
+        self._active[device_id] = order
+        self._set_state(order, DISPENSING)
+        logger.warning(f"⚠️ Order {order.order_id} started late on {device_id}, not resending")
+
+    def on_drop_event(self, device_id, payload):
+        """noodle_vending/drop_detected: 'timeout_noodle_N' means nothing dropped"""
+        if not payload.startswith("timeout"):
+            return
+        with self._lock:
+            order = self._active.get(device_id)
+            if order is not None:
+                self._set_state(order, FAILED, "drop timeout")
+
+    def cancel_all(self, device_id, reason="cancelled"):
+        """Fail every queued and active order for a device"""
+        with self._lock:
+            cancelled = 0
+            for order in self._queues.pop(device_id, deque()):
+                self._set_state(order, FAILED, reason)
+                cancelled += 1
+            order = self._active.get(device_id)
+            if order is not None:
+                self._set_state(order, FAILED, reason)
+                cancelled += 1
+            return cancelled
+
+    def expire(self, now=None):
+        """Handle active orders that never got an ack or never finished"""
+        now = now or time.time()
+        with self._lock:
+            for order in list(self._active.values()):
+                if order.state == SENT and now - order.sent_at > self.ack_timeout:
+                    self._requeue_or_fail(order, "no response from device")
+                    if order.state == QUEUED:
+                        self._unconfirmed[order.device_id] = order
+                elif order.state == DISPENSING and now - order.started_at > self.dispense_timeout:
+                    self._set_state(order, FAILED, "dispense timed out")
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            oldest = min(
+                (q[0].created_at for q in self._queues.values() if q),
+                default=None
+            )
+            waits = sorted(self._recent_waits)
+            return {
+                "depth": sum(len(q) for q in self._queues.values()),
+                "depth_by_device": {d: len(q) for d, q in self._queues.items() if q},
+                "active": len(self._active),
+                "transitions": dict(self._counts),
+                "duplicates": self._duplicates,
+                "avg_wait_seconds": round(self._wait_total / self._wait_count, 3) if self._wait_count else 0.0,
+                "p95_wait_seconds": round(waits[int(len(waits) * 0.95) - 1 if len(waits) > 1 else 0], 3) if waits else 0.0,
+                "max_wait_seconds": round(self._wait_max, 3),
+                "oldest_queued_seconds": round(now - oldest, 3) if oldest else None,
+                "journal_path": self.journal_path,
+                "journal_pending": len(self._pending),
+                "journal_fsyncs": self._fsyncs,
+                "journal_compactions": self._compactions,
+            }
+
+
+class Dispatcher:
+    """Sends queued orders to devices as they become ready.
+
+    Runs on the event loop; `wake()` is safe to call from any thread.
+    `send(order)` publishes the command and returns a truthy receipt
+    (e.g. the publish-ack future) on success.
+    """
+
+    def __init__(self, queue, is_ready, send, tick_seconds=1.0):
+        self.queue = queue
+        self.is_ready = is_ready
+        self.send = send
+        self.tick_seconds = tick_seconds
+        self._loop = None
+        self._event = None
+
+    def bind_loop(self, loop):
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def wake(self):
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            pass
+
+    def dispatch(self, device_id=None):
+        """Send the next order to every free, ready device; returns (order, receipt) pairs"""
+        sent = []
+        devices = [device_id] if device_id else self.queue.devices_with_work()
+        for target in devices:
+            if not self.is_ready(target):
+                continue
+            order = self.queue.take_next(target)
+            if order is None:
+                continue
+            receipt = self.send(order)
+            if receipt:
+                sent.append((order, receipt))
+            else:
+                self.queue.send_failed(order)
+        return sent
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._event.wait(), self.tick_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._event.clear()
+            try:
+                self.queue.expire()
+                self.dispatch()
+            except Exception as e:
+                logger.error(f"Error in order dispatcher: {e}")
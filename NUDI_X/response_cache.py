@@ -0,0 +1,163 @@
+# response_cache.py - Bounded LRU/TTL cache for AI replies
+import json
+import os
+import re
+import sys
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(message, token_sort=False):
+    """Cache key for a user message: lowercase, no punctuation, collapsed whitespace"""
+    key = _PUNCTUATION.sub(" ", message.lower())
+    words = _WHITESPACE.split(key.strip())
+    if token_sort:
+        words.sort()
+    return " ".join(words)
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with a size bound and per-entry TTL.
+
+    Entries are keyed on the normalized message. Optionally persisted to a
+    JSON file so a restarted server does not start cold.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600.0, token_sort=False, persist_path=None):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self.token_sort = token_sort
+        self.persist_path = persist_path
+
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+        if persist_path:
+            self.load()
+
+    def key(self, message):
+        return normalize_message(message, self.token_sort)
+
+    @staticmethod
+    def _entry_size(key, value):
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(value, (tuple, list)):
+            size += sum(sys.getsizeof(v) for v in value)
+        return size
+
+    def _drop(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= self._entry_size(key, value)
+
+    def get(self, message):
+        """Return the cached reply for message, or None"""
+        key = self.key(message)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            value, stored_at = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                self._drop(key)
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, message, value):
+        key = self.key(message)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, time.time())
+            self._bytes += self._entry_size(key, value)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "token_sort": self.token_sort,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "memory_bytes_estimate": self._bytes,
+                "persist_path": self.persist_path,
+            }
+
+    def save(self):
+        """Write live entries to persist_path (atomic replace)"""
+        if not self.persist_path:
+            return False
+        with self._lock:
+            entries = [[k, v, t] for k, (v, t) in self._entries.items()]
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "entries": entries}, f)
+            os.replace(tmp_path, self.persist_path)
+            logger.info(f"💾 Saved {len(entries)} cached replies to {self.persist_path}")
+            return True
+        except OSError as e:
+            logger.warning(f"⚠️ Could not save response cache: {e}")
+            return False
+
+    def load(self):
+        """Load entries from persist_path, skipping expired ones"""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return 0
+        try:
+            with open(self.persist_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Could not load response cache: {e}")
+            return 0
+
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for key, value, stored_at in data.get("entries", []):
+                if self.ttl is not None and now - stored_at > self.ttl:
+                    continue
+                if key in self._entries:
+                    self._drop(key)
+                if isinstance(value, list):
+                    value = tuple(value)  # JSON has no tuples
+                self._entries[key] = (value, stored_at)
+                self._bytes += self._entry_size(key, value)
+                loaded += 1
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+        logger.info(f"✅ Loaded {loaded} cached replies from {self.persist_path}")
+        return loaded
@@ -0,0 +1,302 @@
+# semantic_cache.py - Nearest-neighbour reply cache over message embeddings
+#
+# The exact cache (response_cache.py) only hits on identical text after
+# normalization. Kiosk traffic is a few dozen intents phrased endlessly
+# differently ("something warm for a rainy evening" / "something warm on a
+# rainy evening please"), so this cache embeds each message into a unit
+# vector and answers from the most similar past message when the cosine
+# similarity reaches a threshold.
+#
+# Entries live in one preallocated float32 matrix (max_entries x dim); a
+# lookup is a single matrix-vector product plus argmax. When the matrix is
+# full the least recently used row is overwritten.
+#
+# Similar wording is not the same request: "I am not in the mood for
+# something filling" reads close to its positive twin, and "cold evening"
+# close to "warm evening". A reused answer dispenses a real bowl, so a
+# neighbour whose polarity differs (negation or an antonym, see
+# polarity_conflict) is never reused, whatever its score.
+#
+# Embeddings come from a sentence-transformers encoder (SentenceEmbedder),
+# trained so that cosine similarity tracks meaning; the word-overlap and
+# causal-LM hidden states tried before either missed paraphrases or scored
+# unrelated sentences ~0.9. The threshold is not a guess: calibrate() picks
+# it on LABELLED_PAIRS, and the cache is only used when it separates them.
+import re
+import threading
+import time
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WORDS = re.compile(r"[a-z0-9']+")
+
+NEGATIONS = frozenset((
+    "no", "not", "never", "nothing", "none", "nor", "neither", "without", "cannot",
+    "dont", "cant", "wont", "isnt", "arent", "wasnt", "didnt", "doesnt",  # typed without the apostrophe
+))
+# Opposites that change what a customer is asking for
+ANTONYMS = (
+    ("hot", "cold"), ("warm", "cold"), ("warm", "cool"), ("hot", "cool"), ("spicy", "mild"),
+    ("light", "heavy"), ("light", "filling"), ("light", "rich"), ("big", "small"), ("large", "small"),
+    ("hungry", "full"), ("starving", "full"), ("more", "less"),
+)
+_OPPOSITES = {}
+for _first, _second in ANTONYMS:
+    _OPPOSITES.setdefault(_first, set()).add(_second)
+    _OPPOSITES.setdefault(_second, set()).add(_first)
+
+
+def _negated(words):
+    """Odd number of negations ("not ... no" cancels out); any "...n't" counts"""
+    return sum(1 for w in words if w in NEGATIONS or w.endswith("n't")) % 2 == 1
+
+
+def polarity_conflict(first, second):
+    """True if the messages differ in negation, or one uses a word the other contradicts"""
+    words = [_WORDS.findall(text.lower().replace("\u2019", "'")) for text in (first, second)]
+    if _negated(words[0]) != _negated(words[1]):
+        return True
+    only_first, only_second = set(words[0]) - set(words[1]), set(words[1]) - set(words[0])
+    return any(_OPPOSITES.get(word, set()) & only_second for word in only_first)
+
+
+# Messages that reach this cache carry no menu keyword (the keyword matcher
+# answers those first), so neither do these. (first, second, same request?)
+LABELLED_PAIRS = (
+    ("something warm for a rainy evening", "something warm on a rainy evening please", True),
+    ("what do you have today?", "what's on the menu today?", True),
+    ("I had a long day at work", "work was exhausting today", True),
+    ("something with a kick", "I want something with a real kick", True),
+    ("I'm starving", "I am famished", True),
+    ("something to warm me up", "I need something to warm me up", True),
+    ("what would you suggest?", "what do you suggest?", True),
+    ("give me something quick", "something quick please", True),
+    ("a mild one please", "something mild please", True),
+    ("something warm for a rainy evening", "something cold for a sunny afternoon", False),
+    ("something with a kick", "something mild please", False),
+    ("what do you have today?", "I had a long day at work", False),
+    ("something to warm me up", "something to cool me down", False),
+    ("something sweet", "something savoury", False),
+    ("give me something quick", "surprise me with your favourite", False),
+    ("a big bowl please", "a small bowl please", False),
+    ("I'm starving", "I'm full, just a small bowl", False),
+    ("I'd like something filling", "I don't want anything filling", False),
+)
+
+
+class SentenceEmbedder:
+    """Mask-aware mean of a sentence-transformers encoder's last hidden state.
+
+    Loaded through transformers (no extra dependency); raises like
+    from_pretrained() when the model cannot be loaded.
+    """
+
+    def __init__(self, model_name="sentence-transformers/all-MiniLM-L6-v2", max_tokens=64):
+        from transformers import AutoTokenizer, AutoModel
+
+        self.name = model_name
+        self.max_tokens = max_tokens
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.dim = self.model.config.hidden_size
+
+    def embed(self, texts):
+        """(len(texts), dim) float32 array of unit vectors"""
+        import torch
+
+        encoded = self.tokenizer(list(texts), return_tensors="pt", padding=True,
+                                 truncation=True, max_length=self.max_tokens)
+        with torch.no_grad():
+            hidden = self.model(**encoded).last_hidden_state.float()
+        weights = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * weights).sum(dim=1) / weights.sum(dim=1).clamp(min=1)
+        return _normalize(pooled.numpy().astype(np.float32))
+
+
+def calibrate(embedder, pairs=LABELLED_PAIRS, min_threshold=0.7, margin=0.02, min_recall=0.6,
+              conflict=polarity_conflict):
+    """Pick the lowest threshold at which no labelled different-request pair is a hit.
+
+    A pair is a hit when its similarity reaches the threshold and `conflict`
+    does not veto it, as in SemanticCache.lookup. Returns a report whose
+    "valid" is False when fewer than `min_recall` of the same-request pairs
+    would hit at that threshold (the embedder cannot tell them apart).
+    """
+    firsts = embedder.embed([first for first, _, _ in pairs])
+    seconds = embedder.embed([second for _, second, _ in pairs])
+    similarities = (firsts * seconds).sum(axis=1)
+    vetoed = [conflict is not None and conflict(first, second) for first, second, _ in pairs]
+
+    negatives = [float(sim) for sim, veto, (_, _, same) in zip(similarities, vetoed, pairs) if not same and not veto]
+    threshold = max([min_threshold] + [sim + margin for sim in negatives])
+    positives = [float(sim) for sim, veto, (_, _, same) in zip(similarities, vetoed, pairs) if same]
+    matched = sum(1 for sim, veto, (_, _, same) in zip(similarities, vetoed, pairs)
+                  if same and not veto and sim >= threshold)
+    recall = matched / len(positives) if positives else 0.0
+    return {
+        "embedder": embedder.name,
+        "pairs": len(pairs),
+        "threshold": round(threshold, 4),
+        "recall": round(recall, 4),
+        "max_different_similarity": round(max(negatives), 4) if negatives else None,
+        "min_same_similarity": round(min(positives), 4) if positives else None,
+        "valid": threshold <= 1.0 and recall >= min_recall,
+    }
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+class SemanticCache:
+    """Thread-safe nearest-neighbour cache with LRU eviction and per-entry TTL.
+
+    `lookup` returns (value, similarity, matched_message) or None. A message
+    closer than `dedup_threshold` to an existing entry replaces that entry
+    instead of taking a new row, so the index holds distinct phrasings.
+    `conflict(message, matched_message)` vetoes a neighbour (lookup falls
+    back to the next one above the threshold, add takes a new row); None disables the check.
+    """
+
+    def __init__(self, embedder, max_entries=2048, threshold=0.8, ttl_seconds=3600.0, dedup_threshold=0.98,
+                 conflict=polarity_conflict, calibration=None):
+        self.embedder = embedder
+        self.max_entries = max(1, int(max_entries))
+        self.threshold = threshold
+        self.dedup_threshold = dedup_threshold
+        self.conflict = conflict
+        self.calibration = calibration  # calibrate() report the threshold came from
+        self.ttl = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self._lock = threading.Lock()
+        self._reset()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._replaced = 0
+        self._conflicts = 0
+        self._hit_similarity = 0.0
+        self._lookup_seconds = 0.0
+        self._lookups = 0
+
+    def _reset(self):
+        self._matrix = np.zeros((self.max_entries, self.embedder.dim), dtype=np.float32)
+        self._values = [None] * self.max_entries
+        self._messages = [None] * self.max_entries
+        self._stored_at = np.zeros(self.max_entries)
+        self._last_used = np.zeros(self.max_entries)
+        self._size = 0
+
+    def _nearest(self, vector):
+        """(row, similarity) of the closest live entry, or (None, 0.0)"""
+        if not self._size:
+            return None, 0.0
+        similarities = self._matrix[:self._size] @ vector
+        row = int(similarities.argmax())
+        return row, float(similarities[row])
+
+    def _nearest_consistent(self, message, vector, now):
+        """Most similar fresh row above the threshold that `conflict` does not veto, or None"""
+        similarities = self._matrix[:self._size] @ vector
+        candidates = np.flatnonzero(similarities >= self.threshold)
+        for row in candidates[np.argsort(-similarities[candidates])].tolist():
+            if self.ttl is not None and now - self._stored_at[row] > self.ttl:
+                continue
+            if not self.conflict(message, self._messages[row]):
+                return row
+        return None
+
+    def _expire(self, row):
+        """Move the last row into `row` so the live rows stay contiguous"""
+        last = self._size - 1
+        if row != last:
+            self._matrix[row] = self._matrix[last]
+            self._values[row] = self._values[last]
+            self._messages[row] = self._messages[last]
+            self._stored_at[row] = self._stored_at[last]
+            self._last_used[row] = self._last_used[last]
+        self._values[last] = self._messages[last] = None
+        self._size = last
+
+    def lookup(self, message):
+        """Cached value of the most similar past message, if similar enough"""
+        started = time.perf_counter()
+        vector = self.embedder.embed([message])[0]  # outside the lock, it is the slow part
+        now = time.time()
+        with self._lock:
+            row, similarity = self._nearest(vector)
+            if row is not None and self.ttl is not None and now - self._stored_at[row] > self.ttl:
+                self._expire(row)
+                self._expirations += 1
+                row, similarity = self._nearest(vector)  # next best may still be fresh
+                if row is not None and now - self._stored_at[row] > self.ttl:
+                    row = None
+            if row is not None and self.conflict is not None and self.conflict(message, self._messages[row]):
+                # A vetoed neighbour must not hide a consistent one just below it
+                self._conflicts += 1
+                row = self._nearest_consistent(message, vector, now)
+                similarity = float(self._matrix[row] @ vector) if row is not None else 0.0
+            self._lookups += 1
+            self._lookup_seconds += time.perf_counter() - started
+            if row is None or similarity < self.threshold:
+                self._misses += 1
+                return None
+            self._last_used[row] = now
+            self._hits += 1
+            self._hit_similarity += similarity
+            return self._values[row], round(similarity, 4), self._messages[row]
+
+    def add(self, message, value):
+        vector = self.embedder.embed([message])[0]
+        now = time.time()
+        with self._lock:
+            row, similarity = self._nearest(vector)
+            if (row is not None and similarity >= self.dedup_threshold
+                    and not (self.conflict is not None and self.conflict(message, self._messages[row]))):
+                self._replaced += 1
+            elif self._size < self.max_entries:
+                row = self._size
+                self._size += 1
+            else:
+                row = int(self._last_used.argmin())  # full: reuse the least recently used row
+                self._evictions += 1
+            self._matrix[row] = vector
+            self._values[row] = value
+            self._messages[row] = message
+            self._stored_at[row] = now
+            self._last_used[row] = now
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def __len__(self):
+        return self._size
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "embedder": self.embedder.name,
+                "dim": self.embedder.dim,
+                "entries": self._size,
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "avg_hit_similarity": round(self._hit_similarity / self._hits, 4) if self._hits else None,
+                "avg_lookup_ms": round(self._lookup_seconds / self._lookups * 1000, 4) if self._lookups else None,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "replaced": self._replaced,
+                "conflicts": self._conflicts,
+                "memory_bytes": self._matrix.nbytes,
+                "calibration": self.calibration,
+            }
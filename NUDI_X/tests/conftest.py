@@ -0,0 +1,25 @@
+# conftest.py - Shared fixtures: server modules on sys.path, a local MQTT broker
+import os
+import socket
+import sys
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def broker_port():
+    """A fresh mini_broker on a background thread, so no retained message outlives its test"""
+    from device_simulator import start_embedded_broker
+
+    port = free_port()
+    start_embedded_broker("127.0.0.1", port)
+    return port
@@ -0,0 +1,56 @@
+# test_ai_model.py - Score mode is only trusted when it agrees with generation
+import pytest
+
+import ai_model
+from menu import NOODLE_MAP
+
+
+@pytest.fixture
+def score_mode(monkeypatch):
+    monkeypatch.setattr(ai_model, "INFERENCE_MODE", "score")
+    monkeypatch.setattr(ai_model, "BACKEND_CHECK", None)
+
+
+def fake_model(monkeypatch, picks, generated, confidence=0.9):
+    """Scorer picks `picks[i]` and greedy generation names `generated[i]` (None: no item)"""
+    def score(prompts):
+        return [(name, NOODLE_MAP[name], confidence, {}) for name in picks[:len(prompts)]]
+
+    def generate(prompts, sample=True):
+        assert not sample  # the reference must be deterministic
+        return [f"{p}{name} for you!" if name else f"{p}something nice" for p, name in zip(prompts, generated)]
+
+    monkeypatch.setattr(ai_model, "_score_batch", score)
+    monkeypatch.setattr(ai_model, "_generate_batch", generate)
+
+
+def test_score_mode_stays_on_when_it_agrees_with_generation(monkeypatch, score_mode):
+    prompts = ["a", "b", "c", "d"]
+    fake_model(monkeypatch, ["Hot Spicy Ramen", "Chicken Noodles", "Cheese Noodles", "Veg Clear Soup"],
+               ["Hot Spicy Ramen", "Chicken Noodles", "Cheese Noodles", None])
+    check = ai_model.check_backend_accuracy(prompts)
+    assert check["valid"] and check["compared"] == 3 and check["agreement"] == 1.0
+    assert ai_model.INFERENCE_MODE == "score"
+
+
+def test_score_mode_falls_back_to_generate_when_picks_disagree(monkeypatch, score_mode):
+    prompts = ["a", "b", "c", "d"]
+    fake_model(monkeypatch, ["Hot Spicy Ramen"] * 4,
+               ["Hot Spicy Ramen", "Chicken Noodles", "Cheese Noodles", "Veg Clear Soup"])
+    check = ai_model.check_backend_accuracy(prompts)
+    assert not check["valid"] and check["agreement"] == 0.25
+    assert ai_model.INFERENCE_MODE == "generate"
+
+
+def test_nothing_to_compare_is_not_a_pass(monkeypatch, score_mode):
+    fake_model(monkeypatch, ["Chicken Noodles"] * 2, [None, None])
+    assert not ai_model.check_backend_accuracy(["a", "b"])["valid"]
+    assert ai_model.INFERENCE_MODE == "generate"
+
+
+def test_low_confidence_pick_uses_the_default_reply():
+    assert ai_model.AI_MIN_CONFIDENCE > 0.25  # above chance for four items
+    unsure = ai_model._resolve_scored(("Cheese Noodles", "noodle_3", 0.3, {}))
+    sure = ai_model._resolve_scored(("Cheese Noodles", "noodle_3", 0.8, {}))
+    assert unsure is ai_model.DEFAULT_INTENT
+    assert sure.noodle_code == "noodle_3" and sure.source == "model"
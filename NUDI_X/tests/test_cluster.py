@@ -0,0 +1,89 @@
+# test_cluster.py - Leader lock, state replication and request forwarding in one process
+import asyncio
+import os
+
+import pytest
+
+from cluster import LeaderLock, MemoryState, Follower, LeaderServer, LeaderClient, LeaderUnavailable
+
+
+def test_leader_lock_is_exclusive_until_released(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    first, second = LeaderLock(path), LeaderLock(path)
+    assert first.try_acquire()
+    assert not second.try_acquire()  # flock is per open file, so this holds within one process too
+    first.release()
+    assert second.try_acquire()
+    assert second.held and not first.held
+    second.release()
+
+
+def test_follower_loads_latest_keyed_state_then_tails_the_log():
+    state = MemoryState()
+    state.publish({"type": "device_status", "status": "busy"}, "status/default")
+    state.publish({"type": "log", "seq": 1, "line": "one"})
+    state.publish({"type": "device_status", "status": "ready"}, "status/default")
+
+    applied = []
+    replica = Follower(state, applied.append)
+    replica.sync()
+    # Only the latest value per key, then the unkeyed log lines
+    assert applied == [{"type": "device_status", "status": "ready"}, {"type": "log", "seq": 1, "line": "one"}]
+    assert replica.seq == 3
+
+    state.publish({"type": "log", "seq": 2, "line": "two"})
+    assert replica.poll() == 1
+    assert applied[-1]["line"] == "two"
+    assert replica.poll() == 0
+
+
+def test_follower_counts_events_it_cannot_apply():
+    state = MemoryState()
+    state.publish({"type": "log"})
+
+    def apply(event):
+        raise KeyError("seq")
+
+    replica = Follower(state, apply)
+    replica.sync()
+    assert replica.stats()["errors"] == 1
+
+
+async def _streaming_app(scope, receive, send):
+    message = await receive()
+    await send({"type": "http.response.start", "status": 201,
+                "headers": [(b"content-type", b"text/plain"), (b"x-path", scope["path"].encode())]})
+    await send({"type": "http.response.body", "body": b"got " + message["body"], "more_body": True})
+    await send({"type": "http.response.body", "body": b" | done", "more_body": False})
+
+
+def test_leader_server_runs_forwarded_requests_and_streams_the_body(tmp_path):
+    path = str(tmp_path / "leader.sock")
+
+    async def scenario():
+        server = LeaderServer(_streaming_app, path)
+        await server.start()
+        try:
+            client = LeaderClient(path)
+            status, headers, body = await client.request(
+                "POST", "/chat", "", [("content-type", "application/json"), ("connection", "keep-alive")], b"hello"
+            )
+            chunks = [chunk async for chunk in body]
+            return status, dict(headers), chunks, server.stats(), client.stats()
+        finally:
+            await server.close()
+
+    status, headers, chunks, server_stats, client_stats = asyncio.run(scenario())
+    assert status == 201
+    assert headers["x-path"] == "/chat"
+    assert chunks == [b"got hello", b" | done"]  # one chunk per ASGI body message
+    assert server_stats["requests"] == 1 and server_stats["errors"] == 0
+    assert client_stats["forwarded"] == 1
+    assert not os.path.exists(path)
+
+
+def test_leader_client_raises_when_no_leader_listens(tmp_path):
+    client = LeaderClient(str(tmp_path / "missing.sock"), connect_timeout=0.5)
+    with pytest.raises(LeaderUnavailable):
+        asyncio.run(client.request("GET", "/status", "", [], b""))
+    assert client.stats()["failed"] == 1
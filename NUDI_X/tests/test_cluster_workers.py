@@ -0,0 +1,161 @@
+# test_cluster_workers.py - Two server processes, mini_broker and a simulated machine
+#
+# Each worker is its own uvicorn process sharing CLUSTER_DIR, which is what
+# `uvicorn --workers N` gives the cluster code, but with one port per worker
+# so the test can choose who answers.
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import SERVER_DIR, free_port
+
+pytest.importorskip("uvicorn")
+
+
+def _request(port, path, body=None, timeout=30):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=data,
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def _wait_for(check, timeout=30.0, interval=0.2):
+    deadline = time.time() + timeout
+    last = None
+    while time.time() < deadline:
+        try:
+            last = check()
+            if last:
+                return last
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(interval)
+    raise AssertionError(f"timed out, last result: {last!r}")
+
+
+class Worker:
+    def __init__(self, data_dir, broker_port, log_path):
+        self.port = free_port()
+        env = {
+            **os.environ,
+            "CLUSTER_MODE": "1",
+            "CLUSTER_RETRY_SECONDS": "0.2",
+            "DATA_DIR": str(data_dir),
+            "MQTT_BROKER": "127.0.0.1",
+            "MQTT_PORT": str(broker_port),
+            "WEARABLE_TELEMETRY": "0",
+            "HF_HUB_OFFLINE": "1",  # keyword replies only; never download a model
+            "TRANSFORMERS_OFFLINE": "1",
+        }
+        self._log = open(log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--log-level", "warning"],
+            cwd=SERVER_DIR, env=env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+
+    def get(self, path):
+        return _request(self.port, path)
+
+    def post(self, path, body):
+        return _request(self.port, path, body)
+
+    def role(self):
+        return self.get("/cluster")["role"]
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGKILL)
+            self.process.wait(10)
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.kill()
+        self._log.close()
+
+
+@pytest.fixture
+def machine(broker_port):
+    from device_simulator import SimulatedDevice
+    from fleet import DEFAULT_DEVICE_ID
+
+    device = SimulatedDevice(
+        DEFAULT_DEVICE_ID, "127.0.0.1", broker_port, drop_time=(0.05, 0.05), heating_time=(0.05, 0.05),
+        failure_rate=0.0, heartbeat_interval=1.0
+    ).start()
+    yield device
+    device.stop()
+
+
+@pytest.fixture
+def workers(tmp_path, broker_port):
+    started = []
+
+    def start(name):
+        worker = Worker(tmp_path / "data", broker_port, tmp_path / f"{name}.log")
+        started.append(worker)
+        return worker
+
+    yield start
+    for worker in started:
+        worker.stop()
+
+
+def _order_state(worker, order_id):
+    return worker.get(f"/orders/{order_id}")["state"]
+
+
+def test_follower_forwards_chat_and_takes_over_when_the_leader_dies(workers, machine):
+    leader = workers("leader")
+    assert _wait_for(leader.role) == "leader"
+    follower = workers("follower")
+    assert _wait_for(follower.role) == "follower"
+
+    # Replicated state: the follower sees the machine the leader is connected to
+    _wait_for(lambda: follower.get("/status")["device_status"] == "ready")
+
+    # Forwarded: the follower has no MQTT connection or order queue of its own
+    reply = follower.post("/chat", {"user_message": "something spicy please"})
+    assert reply["success"] and reply["order_id"] == "ord-1"
+    assert leader.get("/orders/ord-1")["noodle_code"] == "noodle_1"
+    _wait_for(lambda: _order_state(follower, "ord-1") == "done")
+    assert follower.get("/cluster")["forwarding"]["forwarded"] >= 1
+
+    leader.kill()  # no shutdown hook: the OS drops the lock
+    _wait_for(lambda: follower.role() == "leader")
+    _wait_for(lambda: follower.get("/status")["mqtt_connected"])
+
+    # The new leader replayed the shared order journal, so ids continue
+    assert follower.get("/orders/ord-1")["state"] == "done"
+    reply = follower.post("/chat", {"user_message": "chicken please"})
+    assert reply["order_id"] == "ord-2"
+    _wait_for(lambda: _order_state(follower, "ord-2") == "done")
+    assert machine.counts["dispensed"] == 2
+
+
+def test_queued_orders_survive_a_restart_of_the_only_worker(workers, broker_port):
+    first = workers("first")
+    assert _wait_for(first.role) == "leader"
+    # No machine has ever reported, so the order waits in the queue
+    assert first.get("/status")["device_status"] == "waiting_for_device"
+    reply = first.post("/chat", {"user_message": "cheese please"})
+    order_id = reply["order_id"]
+    assert first.get(f"/orders/{order_id}")["state"] == "queued"
+    first.kill()
+
+    second = workers("second")
+    assert _wait_for(second.role) == "leader"
+    assert second.get(f"/orders/{order_id}")["state"] == "queued"
+    assert second.get("/orders?state=queued")["orders"][0]["order_id"] == order_id
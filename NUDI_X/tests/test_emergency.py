@@ -0,0 +1,94 @@
+# test_emergency.py - Stop retries, expiry, and QoS 2 delivery past a saturated order lane
+import asyncio
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from device_simulator import SimulatedDevice
+from emergency import EmergencyStopper, ACKED, EXPIRED
+from fleet import device_topic, parse_topic
+from mqtt_publisher import AckPublisher
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_stop_is_resent_until_the_device_acks():
+    attempts = []
+    stopper = EmergencyStopper(lambda device_id, stop_id: attempts.append(stop_id) or True,
+                               retry_interval=0.05, deadline=5.0)
+    finished = []
+    stopper.add_listener(finished.append)
+    stop = stopper.trigger("m1")
+    assert len(attempts) == 1  # the first attempt goes out before trigger returns
+
+    assert wait_for(lambda: len(attempts) >= 3)
+    assert stopper.on_ack("m1", stop.stop_id) == 1
+    assert stop.state == ACKED and stop.latency_ms is not None
+    assert finished == [stop]
+    sent = len(attempts)
+    time.sleep(0.15)
+    assert len(attempts) == sent  # no retries after the ack
+
+
+def test_unacknowledged_stop_expires_and_wakes_waiters():
+    stopper = EmergencyStopper(lambda device_id, stop_id: True, retry_interval=0.02, deadline=0.1)
+    stop = stopper.trigger("m1")
+    result = asyncio.run(stopper.wait(stop, timeout=2.0))
+    assert result.state == EXPIRED and result.attempts > 1
+    assert stopper.stats()["expired"] == 1
+
+
+def test_qos2_stop_is_delivered_while_the_order_lane_is_saturated(broker_port):
+    # Order lane: connected, but its network loop never runs, so no PUBACK is
+    # ever processed and the in-flight window stays full
+    orders = AckPublisher(window=4, timeout=60.0)
+    order_client = mqtt.Client()
+    orders.set_client(order_client)
+    order_client.connect("127.0.0.1", broker_port)
+    for n in range(4):
+        assert orders.publish_nowait(device_topic("m1", "command"), f"noodle_{n % 4 + 1}") is not None
+    assert orders.publish_nowait(device_topic("m1", "command"), "noodle_1") is None
+
+    # Priority lane: its own connection, QoS 2, listening for acks
+    control = AckPublisher(window=8, timeout=5.0, retries=0)
+    control_client = mqtt.Client()
+    control.set_client(control_client)
+    connected = threading.Event()
+    control_client.on_connect = lambda client, userdata, flags, rc: (
+        client.subscribe(device_topic("m1", "emergency_ack"), qos=1), connected.set())
+
+    def send_stop(device_id, stop_id):
+        topic = device_topic(device_id, "emergency")
+        if control.publish_nowait(topic, stop_id, qos=2) is not None:
+            return True
+        return orders.publish_nowait(topic, stop_id, qos=2) is not None
+
+    stopper = EmergencyStopper(send_stop, retry_interval=0.5, deadline=5.0)
+    control_client.on_message = lambda client, userdata, msg: stopper.on_ack(
+        parse_topic(msg.topic)[0], msg.payload.decode())
+    control_client.connect("127.0.0.1", broker_port)
+    control_client.loop_start()
+    device = SimulatedDevice("m1", port=broker_port, heartbeat_interval=60).start()
+    try:
+        assert connected.wait(5)
+        time.sleep(0.2)  # let the device subscribe
+
+        stop = stopper.trigger("m1")
+        result = asyncio.run(stopper.wait(stop, timeout=5.0))
+        assert result.state == ACKED and result.attempts == 1
+        assert device.counts["emergency_stops"] == 1 and device.counts["commands"] == 0
+        assert wait_for(lambda: control.stats()["acked"] == 1)  # PUBCOMP: QoS 2 handshake finished
+        assert orders.stats()["in_flight"] == 4  # the order lane is still stuck
+    finally:
+        device.stop()
+        control_client.loop_stop()
+        control_client.disconnect()
+        order_client.disconnect()
@@ -0,0 +1,47 @@
+# test_fleet.py - Topic routing, shared device listeners and the least-loaded index
+from fleet import FleetRegistry, DEFAULT_DEVICE_ID, device_topic, parse_topic
+
+
+def test_topics_round_trip_for_legacy_and_fleet_devices():
+    assert device_topic(DEFAULT_DEVICE_ID, "status") == "noodle_vending/status"
+    assert parse_topic(device_topic("m42", "command")) == ("m42", "command")
+    assert parse_topic("other/m42/status") == (None, None)
+
+
+def test_listener_added_once_reaches_current_and_future_devices():
+    fleet = FleetRegistry()
+    early = fleet.get_or_create("m1")
+    seen = []
+    fleet.add_listener(lambda state, old, new: seen.append((state.device_id, new)))
+    late = fleet.get_or_create("m2")
+    early.set_status("ready")
+    late.set_status("busy")
+    assert seen == [("m1", "ready"), ("m2", "busy")]
+    assert fleet.ready_ids() == ["m1"]
+    assert early.history()[0]["to"] == "ready" and fleet.get_or_create("m3").history() == []
+
+
+def test_least_loaded_follows_queue_depth_status_and_liveness():
+    fleet = FleetRegistry()
+    for device_id in ("m1", "m2", "m3"):
+        fleet.get_or_create(device_id)
+    fleet.set_queue_depth("m1", 2)
+    fleet.set_queue_depth("m2", 1)
+    fleet.set_queue_depth("m3", 3)
+    assert fleet.least_loaded() == "m2"
+    assert fleet.least_loaded(exclude={"m2"}) == "m1"
+
+    fleet.get("m2").set_status("offline")  # last will
+    assert fleet.least_loaded() == "m1"
+    fleet.set_reachable("m1", False)  # heartbeat went stale
+    assert fleet.least_loaded() == "m3"
+
+    fleet.get("m2").set_status("busy")  # back, but liveness still rules out m1
+    assert fleet.least_loaded() == "m2"
+    fleet.set_reachable("m1", True)
+    fleet.set_queue_depth("m1", 0)
+    assert fleet.least_loaded() == "m1"
+
+    for device_id in ("m1", "m2", "m3"):
+        fleet.set_reachable(device_id, False)
+    assert fleet.least_loaded() is None
@@ -0,0 +1,38 @@
+# test_intent_matcher.py - Keyword precedence and word-boundary matching
+from intent_matcher import IntentMatcher
+
+KEYWORDS = {
+    "spicy": "Hot Spicy Ramen is perfect for you!",
+    "chicken": "Chicken Noodles coming up!",
+    "veg": "Veg Clear Soup is a light choice.",
+    "vegetarian": "Veg Clear Soup is fully vegetarian.",
+    "hot": "Hot Spicy Ramen will warm you up!",
+}
+
+
+def test_explicit_menu_name_beats_any_keyword():
+    matcher = IntentMatcher(KEYWORDS)
+    intent = matcher.match("something spicy, actually make it cheese noodles")
+    assert intent.source == "menu"
+    assert (intent.noodle_name, intent.noodle_code) == ("Cheese Noodles", "noodle_3")
+
+
+def test_first_listed_keyword_wins_regardless_of_position():
+    matcher = IntentMatcher(KEYWORDS)
+    intent = matcher.match("chicken, but spicy")
+    assert intent.source == "keyword"
+    assert intent.reply == KEYWORDS["spicy"] and intent.noodle_code == "noodle_1"
+
+
+def test_keywords_match_on_word_boundaries_with_plurals():
+    matcher = IntentMatcher(KEYWORDS)
+    assert matcher.match("which hotel is this") is None
+    assert matcher.match("two chickens").noodle_code == "noodle_2"
+    # Longest alternative first, so "vegetarian" is not read as "veg"
+    assert matcher.match("I am vegetarian").reply == KEYWORDS["vegetarian"]
+
+
+def test_menu_reply_reuses_the_first_keyword_reply_for_that_item():
+    matcher = IntentMatcher(KEYWORDS)
+    assert matcher.menu_reply("Hot Spicy Ramen") == KEYWORDS["spicy"]
+    assert matcher.menu_reply("Cheese Noodles") == "I'll prepare Cheese Noodles for you!"
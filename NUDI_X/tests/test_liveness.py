@@ -0,0 +1,61 @@
+# test_liveness.py - Heartbeat deadlines: alive -> stale -> offline and back
+from liveness import LivenessTracker, ALIVE, STALE, OFFLINE
+
+
+def tracker_with_log():
+    tracker = LivenessTracker(stale_after=10, offline_after=30)
+    seen = []
+    tracker.add_listener(lambda device_id, old, new, last_seen: seen.append((device_id, old, new)))
+    return tracker, seen
+
+
+def test_missed_heartbeats_go_stale_then_offline():
+    tracker, seen = tracker_with_log()
+    tracker.beat("m1", now=100)
+    assert tracker.check(now=109) == 1  # seconds until the stale deadline
+    assert tracker.state("m1") == ALIVE
+
+    tracker.check(now=110)
+    assert tracker.state("m1") == STALE
+    tracker.check(now=129)
+    assert tracker.state("m1") == STALE  # offline_after counts from the last heartbeat
+    tracker.check(now=130)
+    assert tracker.state("m1") == OFFLINE
+    assert seen == [("m1", None, ALIVE), ("m1", ALIVE, STALE), ("m1", STALE, OFFLINE)]
+
+    tracker.beat("m1", now=200)
+    assert seen[-1] == ("m1", OFFLINE, ALIVE)
+    assert tracker.stats()["transitions"] == 4
+
+
+def test_newer_heartbeat_supersedes_the_pending_deadline():
+    tracker, seen = tracker_with_log()
+    tracker.beat("m1", now=100)
+    tracker.beat("m1", now=105)
+    tracker.check(now=112)  # the first beat's deadline passed, but it is stale data
+    assert tracker.state("m1") == ALIVE
+    tracker.check(now=115)
+    assert tracker.state("m1") == STALE
+    assert seen.count(("m1", None, ALIVE)) == 1
+
+
+def test_grace_extends_both_deadlines_while_dispensing():
+    tracker, _ = tracker_with_log()
+    tracker.beat("m1", now=100, grace=60)
+    tracker.check(now=150)
+    assert tracker.state("m1") == ALIVE
+    tracker.check(now=170)
+    assert tracker.state("m1") == STALE
+    tracker.check(now=189)
+    assert tracker.state("m1") == STALE
+    tracker.check(now=190)
+    assert tracker.state("m1") == OFFLINE
+
+
+def test_last_will_marks_offline_without_waiting_for_a_deadline():
+    tracker, seen = tracker_with_log()
+    tracker.beat("m1", now=100)
+    tracker.mark_offline("m1")
+    assert tracker.state("m1") == OFFLINE
+    tracker.check(now=1000)  # the old deadline is ignored
+    assert seen == [("m1", None, ALIVE), ("m1", ALIVE, OFFLINE)]
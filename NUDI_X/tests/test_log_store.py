@@ -0,0 +1,39 @@
+# test_log_store.py - since() cursor paging over the ring buffer
+from log_store import LogStore
+
+
+def test_since_pages_through_entries_with_a_cursor():
+    store = LogStore(capacity=10)
+    for i in range(1, 8):
+        store.append(f"line {i}")
+
+    seen, cursor = [], 0
+    while True:
+        page = store.since(cursor, limit=3)
+        if not page:
+            break
+        seen.extend(entry for _, entry in page)
+        cursor = page[-1][0]
+    assert seen == [f"line {i}" for i in range(1, 8)]
+    assert cursor == store.last_seq == 7
+
+    store.append("line 8")
+    assert store.since(cursor) == [(8, "line 8")]
+
+
+def test_cursor_older_than_the_buffer_resumes_at_the_oldest_entry():
+    store = LogStore(capacity=4)
+    for i in range(1, 11):
+        store.append(f"line {i}")
+    assert store.first_seq == 7 and len(store) == 4
+    assert [seq for seq, _ in store.since(2)] == [7, 8, 9, 10]
+    assert store.tail(2) == [(9, "line 9"), (10, "line 10")]
+
+
+def test_replica_gap_drops_held_entries_and_keeps_the_leader_seq():
+    replica = LogStore(capacity=10)
+    replica.append("one", seq=1)
+    replica.append("two", seq=2)
+    replica.append("five", seq=5)  # 3 and 4 were missed
+    assert replica.since(0) == [(5, "five")]
+    assert replica.stats() == {"count": 1, "capacity": 10, "first_seq": 5, "last_seq": 5}
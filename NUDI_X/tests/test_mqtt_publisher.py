@@ -0,0 +1,89 @@
+# test_mqtt_publisher.py - PUBACK tracking, ack timeout and retries
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+
+from mqtt_publisher import AckPublisher
+
+
+class ScriptedClient:
+    """Stands in for paho's client; `acks` says, per publish, whether the broker acks it"""
+
+    def __init__(self, acks, ack_before_return=False):
+        self.acks = list(acks)
+        self.ack_before_return = ack_before_return
+        self.published = []
+        self.on_publish = None
+
+    def max_inflight_messages_set(self, n):
+        pass
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        mid = len(self.published) + 1
+        self.published.append((topic, payload, qos))
+        acked = self.acks.pop(0) if self.acks else True
+        if acked:
+            if self.ack_before_return:
+                self.on_publish(self, None, mid)  # paho's network thread can beat the return
+            else:
+                threading.Timer(0.01, self.on_publish, (self, None, mid)).start()
+        return SimpleNamespace(rc=mqtt.MQTT_ERR_SUCCESS, mid=mid)
+
+
+def test_missing_puback_times_out_and_the_retry_is_delivered():
+    publisher = AckPublisher(timeout=0.1, retries=2)
+    client = ScriptedClient(acks=[False, True])
+    publisher.set_client(client)
+
+    result = asyncio.run(publisher.publish("noodle_vending/command", "noodle_1"))
+    assert result.delivered and result.attempts == 2 and result.error is None
+    assert len(client.published) == 2
+
+    stats = publisher.stats()
+    assert stats["retries"] == 1 and stats["acked"] == 1
+    assert stats["timeouts"] == 1  # the lost mid was expired when the retry went out
+    assert stats["in_flight"] == 0
+
+
+def test_gives_up_after_the_configured_retries():
+    publisher = AckPublisher(timeout=0.05, retries=1)
+    publisher.set_client(ScriptedClient(acks=[False, False, False]))
+    started = time.perf_counter()
+    result = asyncio.run(publisher.publish("noodle_vending/command", "noodle_2"))
+    assert not result.delivered and result.attempts == 2
+    assert result.error == "no ack after 0.05s"
+    assert time.perf_counter() - started < 1.0
+
+
+def test_ack_that_arrives_before_the_mid_is_registered_still_resolves():
+    publisher = AckPublisher(timeout=1.0)
+    publisher.set_client(ScriptedClient(acks=[True], ack_before_return=True))
+    future = publisher.publish_nowait("noodle_vending/command", "noodle_3")
+    assert future.done() and future.result() >= 0
+    assert publisher.stats()["acked"] == 1
+
+
+def test_full_in_flight_window_rejects_instead_of_queueing():
+    publisher = AckPublisher(window=2, timeout=10.0)
+    publisher.set_client(ScriptedClient(acks=[False, False, False]))
+    assert publisher.publish_nowait("t", "1") is not None
+    assert publisher.publish_nowait("t", "2") is not None
+    assert publisher.publish_nowait("t", "3") is None
+    assert publisher.stats()["rejected"] == 1
+
+
+def test_qos1_publish_is_acked_by_a_real_broker(broker_port):
+    publisher = AckPublisher(timeout=2.0, retries=0)
+    client = mqtt.Client()
+    publisher.set_client(client)
+    client.connect("127.0.0.1", broker_port)
+    client.loop_start()
+    try:
+        result = asyncio.run(publisher.publish("noodle_vending/command", "noodle_4"))
+        assert result.delivered and result.attempts == 1 and result.latency_ms is not None
+    finally:
+        client.loop_stop()
+        client.disconnect()
@@ -0,0 +1,124 @@
+# test_order_queue.py - Journal replay across restarts and the no-double-dispense rules
+import asyncio
+import json
+import os
+import threading
+import time
+
+from order_queue import OrderQueue, QUEUED, SENT, DISPENSING, DONE, FAILED
+
+
+def test_replay_after_restart_keeps_queued_fails_in_flight_and_continues_ids(tmp_path):
+    journal = str(tmp_path / "orders.jsonl")
+    queue = OrderQueue(journal)
+    done, _ = queue.submit("default", "noodle_1", "Hot Spicy Ramen")
+    in_flight, _ = queue.submit("default", "noodle_2", "Chicken Noodles")
+    waiting, _ = queue.submit("default", "noodle_3", "Cheese Noodles", idempotency_key="tap-1")
+    assert queue.take_next("default") is done
+    queue.on_device_status("default", "dispensing_noodle_1")
+    queue.on_device_status("default", "ready")
+    assert queue.take_next("default") is in_flight
+    queue.close()  # the server stops with in_flight sent but not finished
+
+    restarted = OrderQueue(journal)
+    assert restarted.get(done.order_id).state == DONE
+    # Sent before the restart: may already be dispensing, so never sent again
+    assert restarted.get(in_flight.order_id).state == FAILED
+    assert restarted.get(waiting.order_id).state == QUEUED
+    assert restarted.depth("default") == 1
+    again, created = restarted.submit("default", "noodle_3", "Cheese Noodles", idempotency_key="tap-1")
+    assert not created and again.order_id == waiting.order_id
+    new, _ = restarted.submit("default", "noodle_4", "Veg Clear Soup")
+    assert new.order_id == "ord-4"
+    assert restarted.take_next("default").order_id == waiting.order_id
+    restarted.close()
+
+    # Compacted on replay: one line per order, then one per change since
+    with open(journal, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert [r["order_id"] for r in records[:3]] == [done.order_id, in_flight.order_id, waiting.order_id]
+
+
+def test_late_dispensing_report_resumes_the_order_instead_of_resending(tmp_path):
+    queue = OrderQueue(str(tmp_path / "orders.jsonl"), ack_timeout=0.01)
+    order, _ = queue.submit("default", "noodle_2", "Chicken Noodles")
+    assert queue.take_next("default") is order
+    queue.expire(now=time.time() + 1)  # no response within ack_timeout
+    assert order.state == QUEUED
+
+    queue.on_device_status("default", "dispensing_noodle_2")  # the slow machine started after all
+    assert order.state == DISPENSING and queue.depth("default") == 0
+    queue.on_device_status("default", "ready")
+    assert order.state == DONE and order.attempts == 1
+    queue.close()
+
+
+def test_late_report_for_another_noodle_does_not_claim_the_order(tmp_path):
+    queue = OrderQueue(ack_timeout=0.01)
+    order, _ = queue.submit("default", "noodle_2", "Chicken Noodles")
+    queue.take_next("default")
+    queue.expire(now=time.time() + 1)
+    queue.on_device_status("default", "dispensing_noodle_3")
+    assert order.state == QUEUED and queue.depth("default") == 1
+    assert queue.take_next("default") is order and order.state == SENT
+
+
+def test_submit_never_waits_on_the_disk_and_fsyncs_are_batched(tmp_path, monkeypatch):
+    queue = OrderQueue(str(tmp_path / "orders.jsonl"))
+    release = threading.Event()
+    real_fsync = os.fsync
+
+    def slow_fsync(fd):
+        release.wait(5)  # a disk stuck in fsync
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", slow_fsync)
+    started = time.perf_counter()
+    for n in range(50):
+        queue.submit("default", "noodle_1", "Hot Spicy Ramen", idempotency_key=f"tap-{n}")
+    assert time.perf_counter() - started < 1.0
+    release.set()
+    assert queue.flush(timeout=5)
+    # The first line may go out alone; the other 49 wait for it and share a batch
+    assert queue.stats()["journal_fsyncs"] <= 2
+    queue.close()
+    restarted = OrderQueue(str(tmp_path / "orders.jsonl"))
+    assert len(restarted.recent(limit=100)) == 50
+    restarted.close()
+
+
+def test_synced_resolves_once_the_change_is_on_disk(tmp_path):
+    journal = str(tmp_path / "orders.jsonl")
+    queue = OrderQueue(journal)
+
+    async def order_and_wait():
+        order, _ = queue.submit("default", "noodle_2", "Chicken Noodles")
+        await queue.synced()
+        with open(journal, encoding="utf-8") as f:
+            return order.order_id in f.read()
+
+    assert asyncio.run(order_and_wait())
+    queue.close()
+
+
+def test_journal_is_compacted_once_enough_orders_finish(tmp_path):
+    journal = str(tmp_path / "orders.jsonl")
+    queue = OrderQueue(journal, compact_after=3)
+    for n in range(3):
+        order, _ = queue.submit("default", "noodle_4", "Veg Clear Soup")
+        queue.take_next("default")
+        queue.on_device_status("default", "dispensing_noodle_4")
+        queue.on_device_status("default", "ready")
+        assert order.state == DONE
+    queued, _ = queue.submit("default", "noodle_3", "Cheese Noodles")
+    assert queue.flush(timeout=5)
+    assert queue.stats()["journal_compactions"] == 1
+    queue.close()
+
+    with open(journal, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    # One line per order: the queued/sent/dispensing lines of finished orders are gone
+    assert len(records) == len({r["order_id"] for r in records}) == 4
+    restarted = OrderQueue(journal)
+    assert restarted.get(queued.order_id).state == QUEUED
+    restarted.close()
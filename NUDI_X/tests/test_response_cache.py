@@ -0,0 +1,54 @@
+# test_response_cache.py - Key normalization, TTL expiry and LRU eviction
+import time
+
+from response_cache import ResponseCache, normalize_message
+
+
+def test_punctuation_case_and_spacing_share_one_key():
+    assert normalize_message("  Spicy   RAMEN, please!! ") == "spicy ramen please"
+    assert normalize_message("please ramen spicy", token_sort=True) == normalize_message("spicy ramen please", token_sort=True)
+
+
+def test_expired_entry_is_dropped_and_counted_as_a_miss(monkeypatch):
+    cache = ResponseCache(max_entries=4, ttl_seconds=10)
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache.set("spicy ramen", ("noodle_1", "Hot Spicy Ramen"))
+
+    now[0] += 9
+    assert cache.get("Spicy ramen!") == ("noodle_1", "Hot Spicy Ramen")
+    now[0] += 2  # 11 s after it was stored
+    assert cache.get("spicy ramen") is None
+    assert len(cache) == 0
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["expirations"] == 1
+    assert stats["memory_bytes_estimate"] == 0
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = ResponseCache(max_entries=2, ttl_seconds=0)
+    cache.set("ramen", "noodle_1")
+    cache.set("chicken", "noodle_2")
+    assert cache.get("ramen") == "noodle_1"  # now chicken is the oldest
+    cache.set("cheese", "noodle_3")
+
+    assert cache.get("chicken") is None
+    assert cache.get("ramen") == "noodle_1" and cache.get("cheese") == "noodle_3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_persisted_entries_survive_a_restart_but_expired_ones_do_not(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.json")
+    cache = ResponseCache(ttl_seconds=60, persist_path=path)
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache.set("old", ("noodle_1", "Hot Spicy Ramen"))
+    now[0] += 50
+    cache.set("new", ("noodle_2", "Chicken Noodles"))
+    assert cache.save()
+
+    now[0] += 20  # "old" is 70 s old by now
+    restarted = ResponseCache(ttl_seconds=60, persist_path=path)
+    assert len(restarted) == 1
+    assert restarted.get("new") == ("noodle_2", "Chicken Noodles")  # tuples come back as tuples
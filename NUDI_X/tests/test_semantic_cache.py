@@ -0,0 +1,102 @@
+# test_semantic_cache.py - Nearest-neighbour hits, misses, the polarity veto and threshold calibration
+import numpy as np
+
+import ai_model
+from semantic_cache import SemanticCache, LABELLED_PAIRS, calibrate
+
+
+class TableEmbedder:
+    """Unit vectors from a fixed table, so similarities are known exactly"""
+
+    name = "table"
+
+    def __init__(self, table, default=(0.0, 0.0, 1.0)):
+        self.table = table
+        self.default = default
+        self.dim = len(default)
+
+    def embed(self, texts):
+        vectors = np.array([self.table.get(text, self.default) for text in texts], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+WARM = (1.0, 0.0, 0.0)
+EMBEDDER = TableEmbedder({
+    "something warm for a rainy evening": WARM,
+    "something warm on a rainy evening please": (0.98, 0.2, 0.0),  # cos 0.98
+    "nothing warm for a rainy evening": (0.99, 0.1, 0.0),  # cos 0.995, but negated
+    "I had a long day at work": (0.0, 1.0, 0.0),  # cos 0
+})
+ANSWER = ("I'll prepare Hot Spicy Ramen for you!", "noodle_1")
+
+
+def warm_cache(**kwargs):
+    cache = SemanticCache(EMBEDDER, threshold=0.9, **kwargs)
+    cache.add("something warm for a rainy evening", ANSWER)
+    return cache
+
+
+def test_paraphrase_above_the_threshold_is_a_hit():
+    cache = warm_cache()
+    value, similarity, matched = cache.lookup("something warm on a rainy evening please")
+    assert value == ANSWER and matched == "something warm for a rainy evening"
+    assert similarity >= 0.9
+    assert cache.stats()["hits"] == 1
+
+
+def test_unrelated_message_is_a_miss():
+    cache = warm_cache()
+    assert cache.lookup("I had a long day at work") is None
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["conflicts"] == 0
+
+
+def test_negated_neighbour_is_vetoed_whatever_its_similarity():
+    cache = warm_cache()
+    assert cache.lookup("nothing warm for a rainy evening") is None
+    assert cache.stats()["conflicts"] == 1
+
+    # Nor does it replace the entry it nearly duplicates
+    cache.add("nothing warm for a rainy evening", ("I'll prepare Veg Clear Soup for you!", "noodle_4"))
+    assert len(cache) == 2 and cache.stats()["replaced"] == 0
+    assert cache.lookup("something warm on a rainy evening please")[0] == ANSWER
+
+
+def test_calibrated_threshold_keeps_every_labelled_different_pair_apart():
+    pairs = (
+        ("a", "a please", True),
+        ("b", "b please", True),
+        ("a", "b", False),
+        ("a", "not a", False),  # vetoed, so its similarity does not raise the threshold
+    )
+    embedder = TableEmbedder({
+        "a": (1.0, 0.0, 0.0), "a please": (0.99, 0.1, 0.0), "not a": (1.0, 0.0, 0.0),
+        "b": (0.8, 0.6, 0.0), "b please": (0.8, 0.55, 0.05),
+    })
+    report = calibrate(embedder, pairs, min_threshold=0.5, margin=0.02)
+    assert report["valid"] and report["recall"] == 1.0
+    assert report["threshold"] == round(report["max_different_similarity"] + 0.02, 4)
+
+
+def test_embedder_that_cannot_separate_the_labelled_set_is_rejected():
+    report = calibrate(TableEmbedder({}), LABELLED_PAIRS)  # every message maps to the same vector
+    assert not report["valid"]
+
+
+def test_cache_stays_off_when_the_encoder_cannot_load(monkeypatch):
+    def unavailable(model_name):
+        raise OSError(f"can't load {model_name}")
+
+    monkeypatch.setattr(ai_model, "SentenceEmbedder", unavailable)
+    monkeypatch.setattr(ai_model, "semantic_cache", None)
+    monkeypatch.setattr(ai_model, "SEMANTIC_CALIBRATION", None)
+    assert not ai_model.load_semantic_cache()
+    assert ai_model.semantic_cache is None and not ai_model.SEMANTIC_CALIBRATION["valid"]
+
+
+def test_hit_answers_without_the_model(monkeypatch):
+    monkeypatch.setattr(ai_model, "semantic_cache", warm_cache())
+    ai_model.response_cache.clear()
+    intent = ai_model._semantic_intent("something warm on a rainy evening please")
+    assert intent.source == "semantic" and intent.noodle_code == "noodle_1"
+    assert ai_model._semantic_intent("I had a long day at work") is None
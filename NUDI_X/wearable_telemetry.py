@@ -0,0 +1,250 @@
+# wearable_telemetry.py - Windowed telemetry from Smart Cooling Wearables over MQTT
+#
+# Topic layout:
+#   wearable/<device_id>/telemetry  readings in, one per line:
+#                                   "external_temp,body_temp,heart_rate" or
+#                                   "timestamp,external_temp,body_temp,heart_rate"
+#   wearable/<device_id>/cooling    "on" / "off" commands out, sent when the state changes
+#
+# A message may carry many lines; the whole payload is parsed by numpy in
+# one call and copied into the device's fixed-size ring of the last
+# `window` readings, so no Python object is kept per reading. Mean and
+# count are running sums updated on append; max and rate of change are
+# computed from the ring when the window is evaluated. Evaluation runs on
+# a timer over every device with new readings at once, and the cooling
+# classifier (cooling_model.py) scores all of those windows in one call.
+import asyncio
+import threading
+import time
+import logging
+
+import numpy as np
+
+from cooling_model import COOLING_NEEDED
+
+logger = logging.getLogger(__name__)
+
+WEARABLE_ROOT = "wearable"
+T, EXTERNAL, BODY, HEART = range(4)  # ring columns
+COOLING_ON, COOLING_OFF = "on", "off"
+
+
+def wearable_topic(device_id, kind):
+    return f"{WEARABLE_ROOT}/{device_id}/{kind}"
+
+
+def wearable_subscriptions():
+    return [wearable_topic("+", "telemetry")]
+
+
+def parse_wearable_topic(topic):
+    """(device_id, kind) for a wearable topic, or (None, None)"""
+    parts = topic.split("/")
+    if len(parts) != 3 or parts[0] != WEARABLE_ROOT:
+        return None, None
+    return parts[1], parts[2]
+
+
+def parse_readings(payload, now):
+    """Payload bytes -> float64 array (n, 4) of [t, external_temp, body_temp, heart_rate]"""
+    text = payload.decode("ascii").strip()
+    lines = text.count("\n") + 1
+    values = np.fromstring(text.replace("\n", ","), dtype=np.float64, sep=",")
+    if values.size == lines * 3:
+        readings = np.empty((lines, 4))
+        readings[:, T] = now
+        readings[:, 1:] = values.reshape(lines, 3)
+        return readings
+    if values.size == lines * 4:
+        return values.reshape(lines, 4)
+    raise ValueError(f"expected 3 or 4 fields per line, got {values.size} values on {lines} lines")
+
+
+class DeviceWindow:
+    """Ring buffer of the last `size` readings plus running column sums"""
+    __slots__ = ("device_id", "ring", "head", "count", "sums", "total", "evaluated_total",
+                 "cooling", "switched_at", "last", "last_seen")
+
+    def __init__(self, device_id, size):
+        self.device_id = device_id
+        self.ring = np.zeros((size, 4))
+        self.head = 0  # next slot to write
+        self.count = 0  # valid readings, <= size
+        self.sums = np.zeros(4)
+        self.total = 0  # readings ever received
+        self.evaluated_total = 0
+        self.cooling = None  # last commanded state
+        self.switched_at = 0.0
+        self.last = None  # latest aggregates
+        self.last_seen = None
+
+    def append(self, readings):
+        size = len(self.ring)
+        n = len(readings)
+        if n >= size:
+            self.ring[:] = readings[-size:]
+            self.head, self.count = 0, size
+            self.sums = self.ring.sum(axis=0)
+        else:
+            end = self.head + n
+            if end <= size:
+                slots = slice(self.head, end)
+                if self.count == size:
+                    self.sums -= self.ring[slots].sum(axis=0)  # overwritten = evicted
+                self.ring[slots] = readings
+            else:
+                first = size - self.head
+                if self.count == size:
+                    self.sums -= self.ring[self.head:].sum(axis=0) + self.ring[:end - size].sum(axis=0)
+                self.ring[self.head:] = readings[:first]
+                self.ring[:end - size] = readings[first:]
+            self.sums += readings.sum(axis=0)
+            self.count = min(size, self.count + n)
+            self.head = end % size
+            if self.head < n:
+                self.sums = self.ring[:self.count].sum(axis=0)  # once per lap: no float drift
+        self.total += n
+        self.last_seen = float(readings[-1, T])
+
+    def aggregates(self):
+        """mean, max and rate of change (per second) over the window"""
+        n = self.count
+        window = self.ring[:n]
+        mean = self.sums / n
+        peak = window.max(axis=0)
+        newest = self.ring[(self.head - 1) % len(self.ring)]
+        oldest = self.ring[self.head] if n == len(self.ring) else self.ring[0]
+        span = newest[T] - oldest[T]
+        if span > 0:
+            heart_rate_per_s = (newest[HEART] - oldest[HEART]) / span
+            body_temp_per_s = (newest[BODY] - oldest[BODY]) / span
+        else:
+            heart_rate_per_s = body_temp_per_s = None
+        return mean, peak, span, heart_rate_per_s, body_temp_per_s
+
+
+class TelemetryIngest:
+    """Per-device windows, batched classification and cooling commands.
+
+    `submit` is called from the MQTT network thread; `evaluate` from the
+    timer task. A device's command is sent only when its classified state
+    changes, and not more often than `min_switch_interval` seconds.
+    """
+
+    def __init__(self, model, send, window=60, min_readings=5, interval=1.0, min_switch_interval=10.0):
+        self.model = model
+        self.send = send  # send(device_id, "on" | "off") -> truthy if published
+        self.window = window
+        self.min_readings = min(min_readings, window)
+        self.interval = interval
+        self.min_switch_interval = min_switch_interval
+        self._devices = {}
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.messages = 0
+        self.readings = 0
+        self.parse_errors = 0
+        self.windows_evaluated = 0
+        self.commands = 0
+        self.last_evaluate_ms = None
+
+    def submit(self, device_id, payload, now=None):
+        """Parse one telemetry message into the device's window; False if it could not be parsed"""
+        try:
+            readings = parse_readings(payload, now if now is not None else time.time())
+        except (ValueError, UnicodeDecodeError) as e:
+            self.parse_errors += 1
+            logger.warning(f"⚠️ Bad telemetry from {device_id}: {e}")
+            return False
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is None:
+                state = self._devices[device_id] = DeviceWindow(device_id, self.window)
+                logger.info(f"🆕 Wearable '{device_id}' reporting")
+            state.append(readings)
+            self.messages += 1
+            self.readings += len(readings)
+        return True
+
+    def evaluate(self, now=None):
+        """Classify every window with new readings; returns the number of commands sent"""
+        now = now if now is not None else time.time()
+        started = time.perf_counter()
+        with self._lock:
+            due = [s for s in self._devices.values()
+                   if s.total > s.evaluated_total and s.count >= self.min_readings]
+            if not due:
+                return 0
+            features = np.empty((len(due), 3))
+            for i, state in enumerate(due):
+                mean, peak, span, hr_rate, body_rate = state.aggregates()
+                features[i] = mean[1:]
+                state.evaluated_total = state.total
+                state.last = {
+                    "readings": state.count,
+                    "span_seconds": round(float(span), 3),
+                    "mean": dict(zip(("external_temp", "body_temp", "heart_rate"), np.round(mean[1:], 3).tolist())),
+                    "max": dict(zip(("external_temp", "body_temp", "heart_rate"), peak[1:].tolist())),
+                    "heart_rate_per_s": round(float(hr_rate), 4) if hr_rate is not None else None,
+                    "body_temp_per_s": round(float(body_rate), 5) if body_rate is not None else None,
+                }
+        probabilities = self.model.predict_proba(features)
+        predictions = self.model.predict(features)
+
+        commands = []
+        for state, p, prediction in zip(due, probabilities.tolist(), predictions.tolist()):
+            wanted = COOLING_ON if prediction == COOLING_NEEDED else COOLING_OFF
+            state.last["p_cooling"] = round(p, 4)
+            state.last["prediction"] = wanted
+            if wanted != state.cooling and (state.cooling is None or now - state.switched_at >= self.min_switch_interval):
+                commands.append((state, wanted))
+        self.windows_evaluated += len(due)
+        self.last_evaluate_ms = round((time.perf_counter() - started) * 1000, 3)
+
+        sent = 0
+        for state, wanted in commands:
+            if self.send(state.device_id, wanted):
+                state.cooling, state.switched_at = wanted, now
+                sent += 1
+        self.commands += sent
+        return sent
+
+    async def run(self):
+        """Timer task: evaluate windows every `interval` seconds off the event loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await loop.run_in_executor(None, self.evaluate)
+            except Exception as e:
+                logger.error(f"Error evaluating wearable telemetry: {e}")
+
+    def snapshot(self, device_id):
+        state = self._devices.get(device_id)
+        if state is None:
+            return None
+        return {
+            "device_id": device_id,
+            "cooling": state.cooling,
+            "readings_total": state.total,
+            "last_seen": state.last_seen,
+            "window": state.last,
+        }
+
+    def snapshots(self):
+        return [self.snapshot(device_id) for device_id in sorted(self._devices)]
+
+    def stats(self):
+        cooling = sum(1 for s in self._devices.values() if s.cooling == COOLING_ON)
+        return {
+            "devices": len(self._devices),
+            "cooling_on": cooling,
+            "messages": self.messages,
+            "readings": self.readings,
+            "parse_errors": self.parse_errors,
+            "windows_evaluated": self.windows_evaluated,
+            "commands": self.commands,
+            "window": self.window,
+            "last_evaluate_ms": self.last_evaluate_ms,
+        }
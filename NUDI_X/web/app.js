@@ -45,7 +45,9 @@ console.log("🍜 Smart Noodle Interface v2.0");
 
 let deviceStatus = "disconnected";
 let mqttConnected = false;
-let lastUpdate = 0;
+let liveSocket = null;
+let pollTimer = null;
+let reconnectDelay = 1000;
 
 // Initialize
 document.addEventListener('DOMContentLoaded', function() {
@@ -70,10 +72,9 @@ document.addEventListener('DOMContentLoaded', function() {
         document.getElementById(`manualBtn${i}`).addEventListener("click", () => manualDispense(i));
     }
     
-    // Start status polling
+    // Status arrives over /ws; /status is only polled while the socket is down
     checkDeviceStatus();
-    setInterval(checkDeviceStatus, 3000);
-    setInterval(updateConnectionStatus, 1000);
+    connectLiveUpdates();
     
     // Add welcome message
     setTimeout(() => {
@@ -83,7 +84,6 @@ document.addEventListener('DOMContentLoaded', function() {
 
 function updateConnectionStatus() {
     const statusElement = document.getElementById('connectionStatus');
-    const timeDiff = Date.now() - lastUpdate;
     
     let statusText = "";
     let statusClass = "";
@@ -91,7 +91,7 @@ function updateConnectionStatus() {
     if (deviceStatus === "ready") {
         statusText = "✅ Connected - Ready to serve!";
         statusClass = "connected";
-    } else if (deviceStatus === "disconnected" || timeDiff > 15000) {
+    } else if (deviceStatus === "disconnected") {
         statusText = "❌ Disconnected - Check backend server";
         statusClass = "disconnected";
     } else if (deviceStatus.includes("busy") || deviceStatus.includes("dispensing")) {
@@ -115,6 +115,58 @@ function updateConnectionStatus() {
     }
 }
 
+// Live updates over WebSocket; falls back to polling /status while disconnected
+function startPolling() {
+    if (!pollTimer) pollTimer = setInterval(checkDeviceStatus, 3000);
+}
+
+function stopPolling() {
+    if (pollTimer) {
+        clearInterval(pollTimer);
+        pollTimer = null;
+    }
+}
+
+function applyStatus(status) {
+    deviceStatus = status.device_status || "disconnected";
+    mqttConnected = status.mqtt_connected || false;
+    updateDeviceDisplay();
+}
+
+function connectLiveUpdates() {
+    try {
+        liveSocket = new WebSocket("ws://127.0.0.1:8000/ws");
+    } catch (error) {
+        startPolling();
+        return;
+    }
+
+    liveSocket.onopen = () => {
+        reconnectDelay = 1000;
+        stopPolling();
+    };
+
+    liveSocket.onmessage = (event) => {
+        const msg = JSON.parse(event.data);
+        if (msg.type === "snapshot") {
+            applyStatus(msg.status);
+        } else if (msg.type === "status") {
+            applyStatus(msg);
+        } else if (msg.type === "emergency") {
+            addMessage("ai", msg.state === "acked"
+                ? `🛑 Emergency stop acknowledged by the machine (${msg.latency_ms} ms)`
+                : "⚠️ Emergency stop NOT acknowledged by the machine, check it in person.");
+        }
+    };
+
+    liveSocket.onclose = () => {
+        liveSocket = null;
+        startPolling();
+        setTimeout(connectLiveUpdates, reconnectDelay);
+        reconnectDelay = Math.min(reconnectDelay * 2, 30000);
+    };
+}
+
 async function checkDeviceStatus() {
     try {
         const response = await fetch("http://127.0.0.1:8000/status");
@@ -123,7 +175,6 @@ async function checkDeviceStatus() {
         const data = await response.json();
         deviceStatus = data.device_status || "disconnected";
         mqttConnected = data.mqtt_connected || false;
-        lastUpdate = Date.now();
         
         updateDeviceDisplay();
         
@@ -158,6 +209,7 @@ function updateDeviceDisplay() {
     
     // Update noodle status indicators
     updateNoodleStatus();
+    updateConnectionStatus();
 }
 
 function updateNoodleStatus() {
@@ -229,6 +281,16 @@ function removeTypingIndicator() {
   }
 }
 
+// Parse "event: x\ndata: {...}" blocks from the /chat/stream response
+function parseSseBlock(block) {
+    let event = "message", data = "";
+    for (const line of block.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+    }
+    return { event, data: data ? JSON.parse(data) : {} };
+}
+
 async function sendMessage() {
     const input = document.getElementById("userInput");
     const message = input.value.trim();
@@ -240,21 +302,55 @@ async function sendMessage() {
     showTypingIndicator();
 
     try {
-        console.log("[SEND_MESSAGE] Sending request to /chat...");
-        const response = await fetch("http://127.0.0.1:8000/chat", {
+        console.log("[SEND_MESSAGE] Sending request to /chat/stream...");
+        const response = await fetch("http://127.0.0.1:8000/chat/stream", {
             method: "POST",
             headers: { "Content-Type": "application/json" },
             body: JSON.stringify({ user_message: message })
         });
 
         console.log("[SEND_MESSAGE] Response status:", response.status);
-        if (!response.ok) throw new Error(`Server error: ${response.status}`);
+        if (!response.ok || !response.body) throw new Error(`Server error: ${response.status}`);
+
+        // Show tokens as they arrive instead of waiting for the full reply
+        const chatBox = document.getElementById("chatBox");
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        let streamed = "";
+        let bubble = null;
+        let data = null;
+
+        while (data === null) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let split;
+            while ((split = buffer.indexOf("\n\n")) !== -1) {
+                const { event, data: payload } = parseSseBlock(buffer.slice(0, split));
+                buffer = buffer.slice(split + 2);
+                if (event === "token") {
+                    if (!bubble) {
+                        removeTypingIndicator();
+                        bubble = document.createElement("div");
+                        bubble.className = "msg ai";
+                        chatBox.appendChild(bubble);
+                    }
+                    streamed += payload.text;
+                    bubble.textContent = "I'll prepare " + streamed;
+                    chatBox.scrollTop = chatBox.scrollHeight;
+                } else if (event === "done" || event === "error") {
+                    data = payload;
+                    break;
+                }
+            }
+        }
+        if (data === null) throw new Error("Stream ended early");
 
-        const data = await response.json();
         console.log("[SEND_MESSAGE] Response data:", data);
         removeTypingIndicator();
         
-        let aiResponse = data.reply || "I didn't understand that.";
+        let aiResponse = data.reply || (data.error ? "" : "I didn't understand that.");
         
         // Add additional info
         if (data.action) {
@@ -273,7 +369,11 @@ async function sendMessage() {
             showNotification(data.error, "error");
         }
         
-        await addMessageWithTyping("ai", aiResponse.trim(), 30);
+        if (bubble) {
+            bubble.textContent = aiResponse.trim();
+        } else {
+            await addMessageWithTyping("ai", aiResponse.trim(), 30);
+        }
         
         // Update status
         if (data.device_status) {
@@ -282,6 +382,7 @@ async function sendMessage() {
         }
         if (data.mqtt_connected !== undefined) {
             mqttConnected = data.mqtt_connected;
+            updateConnectionStatus();
         }
 
     } catch (error) {